@@ -8,11 +8,10 @@ import random
 from datetime import datetime
 import base64
 from pathlib import Path
+import uuid
 
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-
-from RAG.models.RAG import RAG
-from RAG.database.vector_database import VectorDatabase
+from RAG.service.client import InProcessRAGClient, RAGClient
+from RAG.service.engine import PARTIES, build_rag
 from streamlit_app.utils.translate import translate
 from streamlit_app.utils.support_widgets import support_button, support_banner
 from streamlit.components.v1 import html
@@ -38,49 +37,24 @@ st.set_page_config(page_title="Electify", page_icon="🇪🇺", layout="centered
 ### RAG SETUP ####################
 ##################################
 
-DATABASE_DIR_MANIFESTOS = "./data/manifestos/chroma/openai"
-DATABASE_DIR_DEBATES = "./data/debates/chroma/openai"
-TEMPERATURE = 0.0
-LARGE_LANGUAGE_MODEL = ChatOpenAI(
-    model_name="gpt-3.5-turbo", max_tokens=400, temperature=TEMPERATURE
-)
-
-
-# Load the OpenAI embeddings model
-@st.cache_resource
-def load_embedding_model():
-    return OpenAIEmbeddings(model="text-embedding-3-large")
-
-
-embedding_model = load_embedding_model()
-
-
-# Load the databases
-@st.cache_resource
-def load_db_manifestos():
-    return VectorDatabase(
-        embedding_model=embedding_model,
-        source_type="manifestos",
-        database_directory=DATABASE_DIR_MANIFESTOS,
-    )
+# Set RAG_SERVICE_URL to use a running query service (python -m RAG.service.server),
+# otherwise the RAG engine runs in the app process (see RAG/service/engine.py for its settings):
+RAG_SERVICE_URL = os.environ.get("RAG_SERVICE_URL")
+# Fill the party columns progressively while the answers are generated:
+STREAM_RESPONSES = True
 
 
+# Load the RAG engine (databases, caches and LLM scheduler shared by all sessions)
 @st.cache_resource
-def load_db_debates():
-    return VectorDatabase(
-        embedding_model=embedding_model,
-        source_type="debates",
-        database_directory=DATABASE_DIR_DEBATES,
-    )
+def load_rag_engine():
+    return build_rag()
 
 
-# Initialize RAG module with default parties
-rag = RAG(
-    databases=[load_db_manifestos(), load_db_debates()],
-    parties=["cdu", "spd", "gruene", "fdp", "linke", "afd"],
-    llm=LARGE_LANGUAGE_MODEL,
-    k=3,
-)
+# Each session gets its own client, the engine or service is shared
+if RAG_SERVICE_URL:
+    rag = RAGClient(RAG_SERVICE_URL, parties=list(PARTIES))
+else:
+    rag = InProcessRAGClient(load_rag_engine())
 
 ##################################
 ### TRUBRICS SETUP ###############
@@ -112,6 +86,11 @@ if "response" not in st.session_state:
 if "stage" not in st.session_state:
     st.session_state.stage = 0
 
+# The "session_id" string identifies the session in the LLM scheduler (requests of different sessions are served in turn):
+if "session_id" not in st.session_state:
+    st.session_state.session_id = str(uuid.uuid4())
+rag.session_id = st.session_state.session_id
+
 # The "language" string will determine the language of the interface and response:
 if "language" not in st.session_state:
     st.session_state.language = "Deutsch"
@@ -211,37 +190,87 @@ def submit_example(query):
 
 
 def generate_response():
-    max_retries = 2
-    retry_count = 0
-    while retry_count <= max_retries:
-        try:
-            print("Getting response")
-            st.session_state.response = rag.query(query)
-
-            # Assert that the response contains all parties
-            assert set(st.session_state.response["answer"].keys()) == set(
-                st.session_state.parties
-            ), "LLM response does not contain all parties"
-            break
-
-        except Exception as e:
-            print(f"An error occurred: {e}")
-            # Error occured, increment retry counter
-            retry_count += 1
-            if retry_count > max_retries:
-                print(f"Max number of tries ({max_retries}) reached, aborting")
-                st.session_state.response = None
-                st.error(
-                    translate(
-                        "Das Sprachmodell ist gerade nicht verfügbar. **Bitte versuche es gleich nochmal.**",
-                        st.session_state.language,
-                    )
-                )
-                # Display error message in app:
-                raise e
-            else:
-                print(f"Retrying, retry number {retry_count}")
-                pass
+    # Failed party completions are retried inside rag.query, so a failure here is final
+    try:
+        print("Getting response")
+        st.session_state.response = rag.query(query)
+        print(f"Query stats: {rag.query_stats}")
+        print(f"RAG stats: {rag.stats()}")
+
+        # Assert that the response contains all parties
+        assert set(st.session_state.response["answer"].keys()) == set(
+            st.session_state.parties
+        ), "LLM response does not contain all parties"
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        st.session_state.response = None
+        st.error(
+            translate(
+                "Das Sprachmodell ist gerade nicht verfügbar. **Bitte versuche es gleich nochmal.**",
+                st.session_state.language,
+            )
+        )
+        # Display error message in app:
+        raise e
+
+
+def stream_response():
+    # Show a preliminary column for each party and fill it with the answer tokens as they arrive
+    stream_container = st.empty()
+    answer_placeholders = {}
+    with stream_container.container():
+        for i, party in enumerate(st.session_state.parties):
+            p = i + 1
+            col1, col2 = st.columns([0.3, 0.7])
+            with col1:
+                st.write("\n" * 2)
+                if st.session_state.show_all_parties:
+                    file_loc = party_dict[party]["image"]
+                else:
+                    file_loc = "streamlit_app/assets/placeholder_logo.png"
+                st.markdown(img_to_html(file_loc), unsafe_allow_html=True)
+            with col2:
+                if st.session_state.show_all_parties:
+                    st.header(party_dict[party]["name"])
+                else:
+                    st.header(f"{translate('Partei', st.session_state.language)} {p}")
+                answer_placeholders[party] = st.empty()
+                answer_placeholders[party].write("...")
+
+    try:
+        print("Streaming response")
+        partial_answers = {party: "" for party in st.session_state.parties}
+        for event_type, party, content in rag.stream_query(query):
+            if event_type == "token":
+                partial_answers[party] += content
+                answer_placeholders[party].write(partial_answers[party] + " ▌")
+            elif event_type == "error":
+                # The party's answer is generated again and arrives as "answer"
+                partial_answers[party] = ""
+                answer_placeholders[party].write("...")
+            elif event_type == "answer":
+                answer_placeholders[party].write(content)
+            elif event_type == "response":
+                st.session_state.response = content
+        print(f"Query stats: {rag.query_stats}")
+        print(f"RAG stats: {rag.stats()}")
+
+    except Exception as e:
+        print(f"An error occurred while streaming: {e}")
+        stream_container.empty()
+        # Fall back to the blocking query
+        with st.spinner(
+            translate(
+                "Suche nach Antworten in Wahlprogrammen und Parlamentsdebatten...",
+                st.session_state.language,
+            )
+            + "🕵️"
+        ):
+            generate_response()
+
+    # The final response is rendered in stage 2, so remove the preliminary columns
+    stream_container.empty()
 
 
 # The following function converts a date string from the format "YYYY-MM-DD" to "DD.MM.YYYY"
@@ -409,14 +438,17 @@ if st.session_state.stage > 0:
 # STAGE 1: User submitted a query and we are waiting for the response
 if st.session_state.stage == 1:
     st.session_state.number_of_requests += 1
-    with st.spinner(
-        translate(
-            "Suche nach Antworten in Wahlprogrammen und Parlamentsdebatten...",
-            st.session_state.language,
-        )
-        + "🕵️"
-    ):
-        generate_response()
+    if STREAM_RESPONSES:
+        stream_response()
+    else:
+        with st.spinner(
+            translate(
+                "Suche nach Antworten in Wahlprogrammen und Parlamentsdebatten...",
+                st.session_state.language,
+            )
+            + "🕵️"
+        ):
+            generate_response()
 
     if st.session_state.use_trubrics:
         st.session_state.logged_prompt = collector.log_prompt(
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+
+from langchain_core.documents import Document
+
+# Increase whenever the layout of cached documents or the parsing and splitting changes
+CHUNK_CACHE_FORMAT_VERSION = 1
+
+
+def documents_to_table(documents):
+    """
+    Converts documents to a pyarrow table with a "page_content" column and one column per metadata key
+    (missing values are null).
+    """
+    import pyarrow as pa
+
+    columns = {"page_content": [doc.page_content for doc in documents]}
+    keys = sorted({key for doc in documents for key in doc.metadata})
+    for key in keys:
+        columns[f"metadata.{key}"] = [doc.metadata.get(key) for doc in documents]
+    return pa.table(columns)
+
+
+def table_to_documents(table):
+    """
+    Converts a pyarrow table written by documents_to_table back to documents.
+    """
+    columns = table.to_pydict()
+    documents = []
+    for i, text in enumerate(columns.pop("page_content")):
+        metadata = {}
+        for column, values in columns.items():
+            if values[i] is not None:
+                metadata[column[len("metadata.") :]] = values[i]
+        documents.append(Document(page_content=text, metadata=metadata))
+    return documents
+
+
+class ChunkCache:
+    """
+    On-disk cache of parsed source files and their splits, stored as Parquet files.
+
+    Parsed documents (e.g. the text of a PDF, the rows of a CSV file) are keyed by the SHA-256 hash of
+    the source file, splits additionally by the splitter parameters. Databases with different embedding
+    models share the cached splits, and a different chunk_size or chunk_overlap only re-splits the
+    cached text. Requires pyarrow.
+
+    Args:
+    directory: str, directory of the cache
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def load_parsed(self, source_path, source_hash):
+        """
+        Returns the cached parsed documents of a source file, or None if they are not cached.
+        """
+        return self._load(self._parsed_path(source_hash), source_path)
+
+    def save_parsed(self, source_hash, documents):
+        self._save(self._parsed_path(source_hash), documents)
+
+    def load_splits(self, source_path, source_hash, splitter_params):
+        """
+        Returns the cached splits of a source file for the splitter parameters, or None if they are not cached.
+        """
+        return self._load(self._splits_path(source_hash, splitter_params), source_path)
+
+    def save_splits(self, source_hash, splitter_params, splits):
+        self._save(self._splits_path(source_hash, splitter_params), splits)
+
+    def _parsed_path(self, source_hash):
+        return os.path.join(
+            self.directory,
+            "parsed",
+            f"{source_hash}-v{CHUNK_CACHE_FORMAT_VERSION}.parquet",
+        )
+
+    def _splits_path(self, source_hash, splitter_params):
+        params_hash = hashlib.sha256(
+            json.dumps(splitter_params, sort_keys=True).encode("utf-8")
+        ).hexdigest()[:16]
+        return os.path.join(
+            self.directory,
+            "splits",
+            f"{source_hash}-{params_hash}-v{CHUNK_CACHE_FORMAT_VERSION}.parquet",
+        )
+
+    def _load(self, path, source_path):
+        if not os.path.exists(path):
+            return None
+        import pyarrow.parquet as pq
+
+        documents = table_to_documents(pq.read_table(path))
+        # The same file may have been cached under another path
+        for doc in documents:
+            doc.metadata.update({"source": source_path})
+        return documents
+
+    def _save(self, path, documents):
+        import pyarrow.parquet as pq
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first, so parallel workers never read a partial file
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        pq.write_table(documents_to_table(documents), temporary_path)
+        os.replace(temporary_path, path)
+
+
+def cached_splits(cache, source_path, source_hash, splitter_params, parse, split):
+    """
+    Returns the splits of a source file from the cache, parsing and splitting only what is not cached.
+
+    Args:
+    cache: ChunkCache object, or None to parse and split without cache
+    source_path: str, path of the source file
+    source_hash: str, SHA-256 hash of the source file
+    splitter_params: dict, parameters of the splitter (part of the cache key)
+    parse: function, parses the source file into a list of documents
+    split: function, splits the parsed documents
+
+    Returns:
+    splits: list of split documents
+    """
+    if cache is None:
+        return split(parse(source_path))
+
+    splits = cache.load_splits(source_path, source_hash, splitter_params)
+    if splits is not None:
+        return splits
+
+    documents = cache.load_parsed(source_path, source_hash)
+    if documents is None:
+        documents = parse(source_path)
+        cache.save_parsed(source_hash, documents)
+    splits = split(documents)
+    cache.save_splits(source_hash, splitter_params, splits)
+    return splits
@@ -0,0 +1,211 @@
+import math
+import os
+import pickle
+import re
+import unicodedata
+
+import numpy as np
+
+# Increase whenever the layout of saved lexical indexes changes
+LEXICAL_INDEX_FORMAT_VERSION = 2
+
+GERMAN_STOPWORDS = set(
+    """
+    aber alle allem allen aller alles als also am an ander andere anderem anderen anderer anderes auch auf aus
+    bei bin bis bist da damit dann das dass dein deine dem den denn der des dich die dies diese diesem diesen
+    dieser dieses dir doch dort du durch ein eine einem einen einer eines er es etwas euch euer eure für gegen
+    hat hatte haben habe hier hin ich ihm ihn ihnen ihr ihre ihrem ihren ihrer im in ins ist ja jede jedem jeden
+    jeder jedes kann kein keine keinem keinen keiner man mehr mein meine mich mir mit muss nach nicht nichts noch
+    nun nur ob oder ohne sehr sein seine seinem seinen seiner sich sie sind so soll sollen sollte sollten sondern
+    um und uns unser unsere unter vom von vor war waren was weil welche welchem welchen welcher welches wenn
+    werden wie wir wird wo wollen zu zum zur über
+    partei parteien
+    """.split()
+)
+
+
+def stem_german(token):
+    """
+    Light German stemmer inspired by CISTEM: folds umlauts and strips one inflectional suffix in a single pass, so that unrelated words (e.g. "Rente" and "Rennen") keep different stems.
+
+    Args:
+    token: str, lower-case token
+
+    Returns:
+    stem: str, stemmed token
+    """
+    token = (
+        token.replace("ä", "a").replace("ö", "o").replace("ü", "u").replace("ß", "ss")
+    )
+    if len(token) > 6 and token.endswith("ern"):
+        token = token[:-3]
+    elif len(token) > 5 and token[-2:] in ("em", "en", "er", "es", "nd"):
+        token = token[:-2]
+    elif len(token) > 3 and token[-1] in ("e", "s"):
+        token = token[:-1]
+    return token
+
+
+def tokenize_german(text, remove_stopwords=True):
+    """
+    Splits a German text into stemmed, lower-case tokens.
+
+    Args:
+    text: str, text
+    remove_stopwords: bool, whether to drop German stopwords, default is True
+
+    Returns:
+    tokens: list of str, tokens
+    """
+    words = re.findall(r"\w+", unicodedata.normalize("NFKC", text).lower())
+    return [
+        stem_german(word)
+        for word in words
+        if not (remove_stopwords and word in GERMAN_STOPWORDS)
+    ]
+
+
+def is_single_keyword(question):
+    """
+    Returns True if the question is a single keyword (e.g. "Klimaschutz"), which lexical search serves well.
+    """
+    words = re.findall(r"\w+", question)
+    return len(words) == 1 and len(tokenize_german(question)) == 1
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fuses several rankings with reciprocal rank fusion.
+
+    Args:
+    rankings: list of lists of IDs, each ordered from best to worst
+    k: int, rank offset that dampens the influence of the top ranks, default is 60
+
+    Returns:
+    fused: list of IDs, ordered by fused score (best first)
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, id_ in enumerate(ranking):
+            scores[id_] = scores.get(id_, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=lambda id_: scores[id_], reverse=True)
+
+
+class BM25Index:
+    """
+    Inverted BM25 index over the chunks of a VectorDatabase, partitioned by party.
+
+    Args:
+    ids: list of str, chunk IDs
+    texts: list of str, chunk texts
+    metadatas: list of dict, chunk metadata (the "party" field determines the partition)
+    k1: float, BM25 term frequency saturation, default is 1.5
+    b: float, BM25 document length normalization, default is 0.75
+    """
+
+    def __init__(self, ids, texts, metadatas, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids = list(ids)
+
+        party_rows = {}
+        for i, metadata in enumerate(metadatas):
+            party_rows.setdefault((metadata or {}).get("party"), []).append(i)
+
+        # party -> {"rows": global row of each local document, "lengths": document lengths,
+        #           "avgdl": average document length, "postings": term -> (local rows, term frequencies)}
+        self.partitions = {}
+        for party, rows in party_rows.items():
+            postings = {}
+            lengths = np.zeros(len(rows), dtype=np.float32)
+            for local_row, row in enumerate(rows):
+                tokens = tokenize_german(texts[row])
+                lengths[local_row] = len(tokens)
+                term_frequencies = {}
+                for token in tokens:
+                    term_frequencies[token] = term_frequencies.get(token, 0) + 1
+                for token, tf in term_frequencies.items():
+                    postings.setdefault(token, ([], []))
+                    postings[token][0].append(local_row)
+                    postings[token][1].append(tf)
+
+            self.partitions[party] = {
+                "rows": np.array(rows, dtype=np.int64),
+                "lengths": lengths,
+                "avgdl": float(lengths.mean()) if len(rows) > 0 else 0.0,
+                "postings": {
+                    token: (
+                        np.array(local_rows, dtype=np.int32),
+                        np.array(tfs, dtype=np.float32),
+                    )
+                    for token, (local_rows, tfs) in postings.items()
+                },
+            }
+
+    def search(self, query, party, k=4):
+        """
+        Returns the k chunks of a party with the highest BM25 score for the query.
+
+        Args:
+        query: str, query text
+        party: str, party name
+        k: int, number of chunks to return
+
+        Returns:
+        results: list of (id, score) tuples with a positive score, best first
+        """
+        partition = self.partitions.get(party)
+        if partition is None or len(partition["rows"]) == 0:
+            return []
+
+        n_docs = len(partition["rows"])
+        length_norm = self.k1 * (
+            1 - self.b + self.b * partition["lengths"] / max(partition["avgdl"], 1e-9)
+        )
+        scores = np.zeros(n_docs, dtype=np.float32)
+        for token in set(tokenize_german(query)):
+            if token not in partition["postings"]:
+                continue
+            local_rows, tfs = partition["postings"][token]
+            idf = math.log(1 + (n_docs - len(local_rows) + 0.5) / (len(local_rows) + 0.5))
+            scores[local_rows] += (
+                idf * tfs * (self.k1 + 1) / (tfs + length_norm[local_rows])
+            )
+
+        k = min(k, int((scores > 0).sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [
+            (self.ids[partition["rows"][i]], float(scores[i])) for i in top
+        ]
+
+    def save(self, path):
+        """
+        Writes the index to a file.
+        """
+        with open(path, "wb") as file:
+            pickle.dump({"version": LEXICAL_INDEX_FORMAT_VERSION, "index": self}, file)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads an index written by save, or returns None if the file has an outdated format.
+        """
+        with open(path, "rb") as file:
+            data = pickle.load(file)
+        if data.get("version") != LEXICAL_INDEX_FORMAT_VERSION:
+            print(f"Ignoring lexical index with outdated format at {path}")
+            return None
+        return data["index"]
+
+    @classmethod
+    def from_directory(cls, directory):
+        """
+        Loads the index saved in a bundle directory, or returns None if there is none.
+        """
+        path = os.path.join(directory, "lexical_index.pkl")
+        if not os.path.exists(path):
+            return None
+        return cls.load(path)
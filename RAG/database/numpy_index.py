@@ -0,0 +1,543 @@
+from langchain_core.documents import Document
+from datetime import datetime, timezone
+import hashlib
+import json
+import numpy as np
+import os
+
+# Increase whenever the layout of exported bundles changes
+BUNDLE_FORMAT_VERSION = 1
+# Number of float16/int8 rows converted to float32 at a time during a search
+SEARCH_BLOCK_SIZE = 1024
+
+
+def quantize_embeddings(embeddings, dtype="float32", dimensions=None):
+    """
+    Normalizes embeddings and converts them to a compact storage format.
+
+    Args:
+    embeddings: array-like of shape (n_chunks, dim), embeddings
+    dtype: str, storage type: "float32", "float16" or "int8" (symmetric quantization with one scale per vector), default is "float32"
+    dimensions: int, optional, keep only the first dimensions (Matryoshka truncation, e.g. 256 or 1024 for text-embedding-3-large)
+
+    Returns:
+    embeddings: np.ndarray of shape (n_chunks, dimensions), normalized embeddings in the storage type
+    scales: np.ndarray of shape (n_chunks,) with the scale of each vector for "int8", otherwise None
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if embeddings.ndim != 2:
+        embeddings = embeddings.reshape(len(embeddings), -1)
+    if dimensions is not None:
+        embeddings = embeddings[:, :dimensions]
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    embeddings = embeddings / np.maximum(norms, 1e-12)
+
+    if dtype == "float32":
+        return np.ascontiguousarray(embeddings), None
+    if dtype == "float16":
+        return np.ascontiguousarray(embeddings.astype(np.float16)), None
+    if dtype == "int8":
+        scales = np.maximum(np.abs(embeddings).max(axis=1), 1e-12) / 127
+        quantized = np.round(embeddings / scales[:, None]).astype(np.int8)
+        return np.ascontiguousarray(quantized), scales.astype(np.float32)
+    raise ValueError(f"Unsupported dtype {dtype}, use float32, float16 or int8.")
+
+
+def maximal_marginal_relevance_indices(
+    query_embedding, candidate_embeddings, k=4, lambda_mult=0.5
+):
+    """
+    Selects candidates by maximal marginal relevance with vectorized matrix operations.
+
+    Args:
+    query_embedding: np.ndarray of shape (dim,), normalized query embedding
+    candidate_embeddings: np.ndarray of shape (n_candidates, dim), normalized candidate embeddings
+    k: int, number of candidates to select
+    lambda_mult: float, trade-off between relevance (1) and diversity (0)
+
+    Returns:
+    selected: list of int, indices of the selected candidates in order of selection
+    """
+    n_candidates = len(candidate_embeddings)
+    if min(k, n_candidates) <= 0:
+        return []
+
+    similarity_to_query = candidate_embeddings @ query_embedding
+    similarity_between = candidate_embeddings @ candidate_embeddings.T
+
+    selected = [int(np.argmax(similarity_to_query))]
+    redundancy = similarity_between[:, selected[0]].copy()
+    while len(selected) < min(k, n_candidates):
+        scores = lambda_mult * similarity_to_query - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        idx = int(np.argmax(scores))
+        selected.append(idx)
+        redundancy = np.maximum(redundancy, similarity_between[:, idx])
+    return selected
+
+
+def batched_maximal_marginal_relevance_indices(
+    query_embedding, candidate_embeddings, candidate_mask, k=4, lambda_mult=0.5
+):
+    """
+    Selects candidates by maximal marginal relevance for several candidate pools at once
+    (e.g. one pool per party), computing relevance and redundancy of all pools with batched matrix operations.
+
+    Args:
+    query_embedding: np.ndarray of shape (dim,), normalized query embedding
+    candidate_embeddings: np.ndarray of shape (n_pools, n_candidates, dim), normalized candidate embeddings (padded)
+    candidate_mask: np.ndarray of shape (n_pools, n_candidates), True for actual (non-padding) candidates
+    k: int, number of candidates to select per pool
+    lambda_mult: float, trade-off between relevance (1) and diversity (0)
+
+    Returns:
+    selected: np.ndarray of shape (n_pools, k), indices of the selected candidates in order of selection (-1 if a pool has fewer than k candidates)
+    """
+    n_pools, n_candidates = candidate_mask.shape
+    selected = np.full((n_pools, k), -1, dtype=np.int64)
+    if k <= 0 or n_candidates == 0:
+        return selected
+
+    pools = np.arange(n_pools)
+    similarity_to_query = np.where(
+        candidate_mask, candidate_embeddings @ query_embedding, -np.inf
+    )
+    similarity_between = candidate_embeddings @ candidate_embeddings.transpose(0, 2, 1)
+
+    taken = ~candidate_mask
+    idx = np.argmax(similarity_to_query, axis=1)
+    valid = candidate_mask[pools, idx]
+    selected[valid, 0] = idx[valid]
+    taken[pools, idx] = True
+    redundancy = similarity_between[pools, :, idx]
+
+    for j in range(1, k):
+        scores = lambda_mult * similarity_to_query - (1 - lambda_mult) * redundancy
+        scores[taken] = -np.inf
+        idx = np.argmax(scores, axis=1)
+        valid = np.isfinite(scores[pools, idx])
+        selected[valid, j] = idx[valid]
+        taken[pools[valid], idx[valid]] = True
+        redundancy = np.maximum(redundancy, similarity_between[pools, :, idx])
+    return selected
+
+
+class NumpyVectorIndex:
+    """
+    In-memory vector index holding all embeddings of a collection in one contiguous float32 matrix.
+
+    Documents are partitioned by party, so a search with filter={"party": party} only touches the
+    rows of that party. Search is exact (cosine similarity of normalized vectors). The search methods
+    mirror the ones of the langchain Chroma vectorstore used by RAG.
+
+    To save memory, the embeddings can be stored as float16 or int8 and truncated to their first
+    dimensions (Matryoshka embeddings such as text-embedding-3-large); queries are truncated accordingly.
+
+    Args:
+    ids: list of str, chunk IDs
+    embeddings: array-like of shape (n_chunks, dim), chunk embeddings
+    documents: list of str, chunk texts
+    metadatas: list of dict, chunk metadata
+    embedding_function: Embeddings object, optional, used to embed queries given as text
+    dtype: str, storage type of the embeddings: "float32", "float16" or "int8", default is "float32"
+    dimensions: int, optional, number of leading embedding dimensions to keep (all if None)
+    normalized: bool, whether the embeddings are already normalized and in their storage type (used as is, e.g. memory-mapped), default is False
+    scales: np.ndarray, optional, per-vector scales of already quantized int8 embeddings (only with normalized=True)
+    manifest: dict, optional, manifest of the bundle the index was loaded from
+    """
+
+    def __init__(
+        self,
+        ids,
+        embeddings,
+        documents,
+        metadatas,
+        embedding_function=None,
+        dtype="float32",
+        dimensions=None,
+        normalized=False,
+        scales=None,
+        manifest=None,
+    ):
+        self.ids = list(ids)
+        self.documents = list(documents)
+        self.metadatas = [metadata or {} for metadata in metadatas]
+        self.embedding_function = embedding_function
+        self.manifest = manifest
+
+        if normalized:
+            self.embeddings = embeddings
+            self.scales = scales
+        else:
+            self.embeddings, self.scales = quantize_embeddings(
+                embeddings, dtype=dtype, dimensions=dimensions
+            )
+        self.dtype = str(self.embeddings.dtype)
+        self.dimensions = self.embeddings.shape[1] if self.embeddings.ndim == 2 else 0
+
+        self._id_to_index = {id_: i for i, id_ in enumerate(self.ids)}
+        party_indices = {}
+        for i, metadata in enumerate(self.metadatas):
+            party_indices.setdefault(metadata.get("party"), []).append(i)
+        self._party_indices = {
+            party: np.array(indices, dtype=np.int64)
+            for party, indices in party_indices.items()
+        }
+
+    @classmethod
+    def from_chroma(
+        cls, chroma, embedding_function=None, dtype="float32", dimensions=None
+    ):
+        """
+        Loads all embeddings, texts and metadata of a Chroma vectorstore into memory.
+
+        Args:
+        chroma: Chroma object
+        embedding_function: Embeddings object, optional, used to embed queries given as text
+        dtype: str, storage type of the embeddings: "float32", "float16" or "int8", default is "float32"
+        dimensions: int, optional, number of leading embedding dimensions to keep (all if None)
+
+        Returns:
+        index: NumpyVectorIndex object
+        """
+        data = chroma._collection.get(include=["embeddings", "documents", "metadatas"])
+        return cls(
+            ids=data["ids"],
+            embeddings=data["embeddings"],
+            documents=data["documents"],
+            metadatas=data["metadatas"],
+            embedding_function=embedding_function,
+            dtype=dtype,
+            dimensions=dimensions,
+        )
+
+    @classmethod
+    def from_bundle(cls, directory, embedding_function=None, mmap=True):
+        """
+        Loads an index from a bundle written by save_bundle.
+
+        With mmap=True the embedding matrix is memory-mapped read-only, so loading is near-instant
+        and the memory pages are shared between all processes that load the same bundle.
+
+        Args:
+        directory: str, bundle directory
+        embedding_function: Embeddings object, optional, used to embed queries given as text
+        mmap: bool, whether to memory-map the embedding matrix, default is True
+
+        Returns:
+        index: NumpyVectorIndex object
+        """
+        with open(os.path.join(directory, "manifest.json"), "r") as file:
+            manifest = json.load(file)
+        if manifest.get("format_version") != BUNDLE_FORMAT_VERSION:
+            raise AssertionError(
+                f"{directory} has bundle format {manifest.get('format_version')}, expected {BUNDLE_FORMAT_VERSION}. Export the bundle again."
+            )
+
+        mmap_mode = "r" if mmap else None
+        embeddings = np.load(
+            os.path.join(directory, "embeddings.npy"), mmap_mode=mmap_mode
+        )
+        scales = None
+        if os.path.exists(os.path.join(directory, "scales.npy")):
+            scales = np.load(os.path.join(directory, "scales.npy"), mmap_mode=mmap_mode)
+        with open(os.path.join(directory, "ids.json"), "r") as file:
+            ids = json.load(file)
+        with open(os.path.join(directory, "documents.json"), "r") as file:
+            documents = json.load(file)
+        with open(os.path.join(directory, "metadata.json"), "r") as file:
+            metadata_columns = json.load(file)
+
+        # Metadata is stored column-wise, None marks a missing value
+        metadatas = [{} for _ in ids]
+        for column, values in metadata_columns.items():
+            for metadata, value in zip(metadatas, values):
+                if value is not None:
+                    metadata[column] = value
+
+        return cls(
+            ids=ids,
+            embeddings=embeddings,
+            documents=documents,
+            metadatas=metadatas,
+            embedding_function=embedding_function,
+            normalized=True,
+            scales=scales,
+            manifest=manifest,
+        )
+
+    def save_bundle(self, directory, **manifest_fields):
+        """
+        Writes the index as a read-only bundle: an .npy embedding matrix (in the storage type of the index,
+        plus the per-vector scales for int8), columnar metadata and a manifest.
+
+        Args:
+        directory: str, bundle directory (must not exist yet)
+        manifest_fields: additional manifest entries, e.g. embedding_model, chunk_size and chunk_overlap
+
+        Returns:
+        manifest: dict, manifest of the bundle (including its content hash)
+        """
+        if os.path.exists(directory):
+            raise AssertionError(f"{directory} already exists, delete it first.")
+        os.makedirs(directory)
+
+        columns = sorted({key for metadata in self.metadatas for key in metadata})
+        metadata_columns = {
+            column: [metadata.get(column) for metadata in self.metadatas]
+            for column in columns
+        }
+        embeddings = np.ascontiguousarray(self.embeddings)
+
+        content_hash = hashlib.sha256()
+        content_hash.update(json.dumps(self.ids).encode("utf-8"))
+        content_hash.update(json.dumps(self.documents).encode("utf-8"))
+        content_hash.update(
+            json.dumps(metadata_columns, sort_keys=True).encode("utf-8")
+        )
+        content_hash.update(embeddings.tobytes())
+        if self.scales is not None:
+            content_hash.update(np.ascontiguousarray(self.scales).tobytes())
+
+        np.save(os.path.join(directory, "embeddings.npy"), embeddings)
+        if self.scales is not None:
+            np.save(os.path.join(directory, "scales.npy"), np.asarray(self.scales))
+        with open(os.path.join(directory, "ids.json"), "w") as file:
+            json.dump(self.ids, file)
+        with open(os.path.join(directory, "documents.json"), "w") as file:
+            json.dump(self.documents, file, ensure_ascii=False)
+        with open(os.path.join(directory, "metadata.json"), "w") as file:
+            json.dump(metadata_columns, file, ensure_ascii=False)
+
+        manifest = {
+            "format_version": BUNDLE_FORMAT_VERSION,
+            "created": datetime.now(timezone.utc).isoformat(),
+            "count": len(self.ids),
+            "dimensions": int(self.dimensions),
+            "dtype": self.dtype,
+            "content_hash": content_hash.hexdigest(),
+            **manifest_fields,
+        }
+        with open(os.path.join(directory, "manifest.json"), "w") as file:
+            json.dump(manifest, file, indent=2)
+
+        self.manifest = manifest
+        return manifest
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        """
+        Memory used by the embeddings (and int8 scales) in bytes.
+        """
+        nbytes = self.embeddings.nbytes
+        if self.scales is not None:
+            nbytes += self.scales.nbytes
+        return nbytes
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None):
+        """
+        Returns the k documents most similar to the query embedding (exact cosine top-k).
+        """
+        indices, _ = self._top_k(embedding, k, filter)
+        return [self._document(i) for i in indices]
+
+    def similarity_search_ids_by_vector(self, embedding, k=4, filter=None):
+        """
+        Returns the chunk IDs of the k documents most similar to the query embedding (exact cosine top-k).
+        """
+        indices, _ = self._top_k(embedding, k, filter)
+        return [self.ids[i] for i in indices]
+
+    def max_marginal_relevance_search_ids_by_vector(
+        self, embedding, k=4, fetch_k=20, filter=None, lambda_mult=0.5
+    ):
+        """
+        Selects documents by maximal marginal relevance among the fetch_k most similar documents.
+
+        Returns:
+        ids: list of str, chunk IDs of the selected documents
+        docs: list of Document objects, selected documents (in the order of their similarity to the query)
+        """
+        candidates, query = self._top_k(embedding, fetch_k, filter)
+        selected = maximal_marginal_relevance_indices(
+            query, self._vectors(candidates), k=k, lambda_mult=lambda_mult
+        )
+
+        # Keep the candidate order (most similar first), as Chroma does
+        indices = [candidates[i] for i in sorted(selected)]
+        return [self.ids[i] for i in indices], [self._document(i) for i in indices]
+
+    def max_marginal_relevance_search_ids_for_parties(
+        self, embedding, parties, k=4, fetch_k=20, lambda_mult=0.5
+    ):
+        """
+        Runs the MMR search of several parties in a single pass: one similarity computation over all
+        chunks, a batched top-fetch_k per party and a batched MMR selection.
+
+        Args:
+        embedding: query embedding
+        parties: list of str, party names
+        k: int, number of documents to return per party
+        fetch_k: int, number of candidate documents per party passed to the MMR algorithm
+        lambda_mult: float, trade-off between relevance (1) and diversity (0)
+
+        Returns:
+        results: dict, (ids, docs) for each party, as returned by max_marginal_relevance_search_ids_by_vector
+        """
+        query = self._prepare_query(embedding)
+        similarities = self._similarities(query)
+
+        # Pad the row indices of all parties into one matrix (-1 marks padding)
+        party_indices = [
+            self._party_indices.get(party, np.array([], dtype=np.int64))
+            for party in parties
+        ]
+        max_length = max([len(indices) for indices in party_indices] + [1])
+        padded = np.full((len(parties), max_length), -1, dtype=np.int64)
+        for i, indices in enumerate(party_indices):
+            padded[i, : len(indices)] = indices
+        padded_similarities = np.where(padded >= 0, similarities[padded], -np.inf)
+
+        # Top fetch_k candidates of each party, most similar first
+        fetch_k = min(fetch_k, max_length)
+        top = np.argpartition(-padded_similarities, fetch_k - 1, axis=1)[:, :fetch_k]
+        order = np.argsort(
+            -np.take_along_axis(padded_similarities, top, axis=1), axis=1, kind="stable"
+        )
+        top = np.take_along_axis(top, order, axis=1)
+        candidates = np.take_along_axis(padded, top, axis=1)
+        candidate_mask = candidates >= 0
+
+        selected = batched_maximal_marginal_relevance_indices(
+            query,
+            self._vectors(np.maximum(candidates, 0)),
+            candidate_mask,
+            k=k,
+            lambda_mult=lambda_mult,
+        )
+
+        results = {}
+        for i, party in enumerate(parties):
+            # Keep the candidate order (most similar first), as Chroma does
+            indices = [int(candidates[i, j]) for j in sorted(selected[i]) if j >= 0]
+            results[party] = (
+                [self.ids[index] for index in indices],
+                [self._document(index) for index in indices],
+            )
+        return results
+
+    def max_marginal_relevance_search_by_vector(
+        self, embedding, k=4, fetch_k=20, lambda_mult=0.5, filter=None, **kwargs
+    ):
+        """
+        Drop-in replacement for Chroma.max_marginal_relevance_search_by_vector.
+        """
+        _, docs = self.max_marginal_relevance_search_ids_by_vector(
+            embedding, k=k, fetch_k=fetch_k, filter=filter, lambda_mult=lambda_mult
+        )
+        return docs
+
+    def max_marginal_relevance_search(
+        self, query, k=4, fetch_k=20, lambda_mult=0.5, filter=None, **kwargs
+    ):
+        """
+        Drop-in replacement for Chroma.max_marginal_relevance_search.
+        """
+        if self.embedding_function is None:
+            raise ValueError("An embedding_function is required to search by text.")
+        embedding = self.embedding_function.embed_query(query)
+        return self.max_marginal_relevance_search_by_vector(
+            embedding, k=k, fetch_k=fetch_k, lambda_mult=lambda_mult, filter=filter
+        )
+
+    def get_documents(self, ids):
+        """
+        Returns the documents with the given chunk IDs (in the same order).
+        """
+        return [self._document(self._id_to_index[id_]) for id_ in ids]
+
+    def _candidate_indices(self, filter):
+        """
+        Returns the row indices matching a metadata filter (None or equality on metadata fields).
+        """
+        if not filter:
+            return None
+        if set(filter.keys()) == {"party"}:
+            return self._party_indices.get(
+                filter["party"], np.array([], dtype=np.int64)
+            )
+        return np.array(
+            [
+                i
+                for i, metadata in enumerate(self.metadatas)
+                if all(metadata.get(key) == value for key, value in filter.items())
+            ],
+            dtype=np.int64,
+        )
+
+    def _top_k(self, embedding, k, filter):
+        """
+        Returns the indices of the k rows most similar to the embedding (most similar first) and the normalized query.
+        """
+        query = self._prepare_query(embedding)
+
+        indices = self._candidate_indices(filter)
+        similarities = self._similarities(query, indices)
+        if indices is None:
+            indices = np.arange(len(self.ids))
+
+        k = min(k, len(indices))
+        if k <= 0:
+            return [], query
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top], kind="stable")]
+        return [int(i) for i in indices[top]], query
+
+    def _prepare_query(self, embedding):
+        """
+        Truncates the query embedding to the stored dimensions and normalizes it.
+        """
+        query = np.asarray(embedding, dtype=np.float32)[: self.dimensions]
+        return query / max(np.linalg.norm(query), 1e-12)
+
+    def _similarities(self, query, indices=None):
+        """
+        Returns the cosine similarity of the query to all rows (or the given rows).
+
+        float16 and int8 rows are converted to float32 in blocks of SEARCH_BLOCK_SIZE rows, so a search
+        never holds more than one block in float32.
+        """
+        n_rows = len(self.embeddings) if indices is None else len(indices)
+        if self.embeddings.dtype == np.float32:
+            rows = self.embeddings if indices is None else self.embeddings[indices]
+            similarities = rows @ query
+        else:
+            similarities = np.empty(n_rows, dtype=np.float32)
+            for start in range(0, n_rows, SEARCH_BLOCK_SIZE):
+                end = min(start + SEARCH_BLOCK_SIZE, n_rows)
+                if indices is None:
+                    block = self.embeddings[start:end]
+                else:
+                    block = self.embeddings[indices[start:end]]
+                similarities[start:end] = block.astype(np.float32) @ query
+        if self.scales is not None:
+            scales = self.scales if indices is None else self.scales[indices]
+            similarities *= scales
+        return similarities
+
+    def _vectors(self, indices):
+        """
+        Returns the (dequantized) float32 embeddings of the given rows (only the candidates of a search).
+        """
+        vectors = self.embeddings[indices].astype(np.float32)
+        if self.scales is not None:
+            vectors *= self.scales[indices][..., None]
+        return vectors
+
+    def _document(self, i):
+        return Document(
+            page_content=self.documents[i], metadata=dict(self.metadatas[i])
+        )
@@ -3,10 +3,215 @@ from langchain_community.document_loaders.pdf import UnstructuredPDFLoader
 from langchain_community.document_loaders.csv_loader import CSVLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import Chroma
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+from langchain_core.documents import Document
+from RAG.database.chunk_cache import ChunkCache, cached_splits
+from RAG.database.numpy_index import NumpyVectorIndex
+from RAG.database.lexical_index import BM25Index, reciprocal_rank_fusion
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import bisect
 import glob
+import hashlib
 import os
 import random
 
+# PDFMiner ends the text of every page with a form feed
+PAGE_BREAK = "\x0c"
+# Number of chunks embedded and written per request when updating a database
+UPDATE_BATCH_SIZE = 500
+
+
+def page_offsets(text):
+    """
+    Returns the character offsets at which the pages of a PDFMiner text start (page i starts after the i-th form feed).
+    """
+    offsets = [0]
+    position = text.find(PAGE_BREAK)
+    while position != -1:
+        offsets.append(position + 1)
+        position = text.find(PAGE_BREAK, position + 1)
+    return offsets
+
+
+def page_of_offset(offsets, offset):
+    """
+    Returns the (0-based) page containing a character offset, given the page offsets of page_offsets.
+    """
+    return max(bisect.bisect_right(offsets, offset) - 1, 0)
+
+
+def parse_pdf(pdf_path):
+    """
+    Parses a manifesto PDF once into a single document with "party" metadata (PDFMiner ends every page with a form feed).
+
+    Parameters:
+    - pdf_path (str): Path of the PDF, the file name starts with the party (e.g. "spd_wahlprogramm.pdf").
+
+    Returns:
+    - List with the parsed document.
+    """
+    party = os.path.basename(pdf_path).split("_")[0]
+
+    # Load pdf as single doc
+    doc = PDFMinerLoader(pdf_path, concatenate_pages=True).load()[0]
+    doc.metadata.update({"party": party})
+    return [doc]
+
+
+def split_pdf(docs, chunk_size=1000, chunk_overlap=200):
+    """
+    Splits parsed PDF documents into chunks with "page" metadata.
+
+    The page of a split is the page on which it starts, found by binary search of the split's start offset
+    in the offsets of the page boundaries.
+
+    Parameters:
+    - docs: List of documents parsed by parse_pdf.
+    - chunk_size (int): The size of text chunks to split the documents into.
+    - chunk_overlap (int): The number of characters to overlap between adjacent chunks.
+
+    Returns:
+    - List of split documents.
+    """
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True
+    )
+    splits = []
+    for doc in docs:
+        offsets = page_offsets(doc.page_content)
+        for split in text_splitter.split_documents([doc]):
+            start_index = split.metadata.pop("start_index")
+            split.metadata.update({"page": page_of_offset(offsets, start_index)})
+            splits.append(split)
+    return splits
+
+
+def load_pdf_splits(
+    pdf_path, chunk_size=1000, chunk_overlap=200, cache_directory=None
+):
+    """
+    Parses and splits a manifesto PDF (see parse_pdf and split_pdf).
+
+    Parameters:
+    - pdf_path (str): Path of the PDF.
+    - chunk_size (int): The size of text chunks to split the document into.
+    - chunk_overlap (int): The number of characters to overlap between adjacent chunks.
+    - cache_directory (str): Optional, directory of a ChunkCache holding parsed documents and splits.
+
+    Returns:
+    - List of split documents.
+    """
+    cache = None if cache_directory is None else ChunkCache(cache_directory)
+    return cached_splits(
+        cache,
+        pdf_path,
+        None if cache is None else file_hash(pdf_path),
+        {"loader": "pdf", "chunk_size": chunk_size, "chunk_overlap": chunk_overlap},
+        parse_pdf,
+        partial(split_pdf, chunk_size=chunk_size, chunk_overlap=chunk_overlap),
+    )
+
+
+def parse_csv(csv_path):
+    """
+    Parses a debates CSV file into one document per row.
+    """
+    loader = CSVLoader(
+        csv_path,
+        metadata_columns=["date", "fullName", "politicalGroup", "party"],
+    )
+    return loader.load()
+
+
+def load_pdf_directory_splits(
+    data_path, chunk_size=1000, chunk_overlap=200, workers=None, cache_directory=None
+):
+    """
+    Parses, splits and page-maps all PDFs of a directory in a pool of processes (see load_pdf_files_splits).
+    """
+    pdf_paths = sorted(glob.glob(os.path.join(data_path, "*.pdf")))
+    return load_pdf_files_splits(
+        pdf_paths, chunk_size, chunk_overlap, workers, cache_directory
+    )
+
+
+def load_pdf_files_splits(
+    pdf_paths, chunk_size=1000, chunk_overlap=200, workers=None, cache_directory=None
+):
+    """
+    Parses, splits and page-maps PDFs in a pool of processes (see load_pdf_splits).
+
+    The splits are merged in the order of pdf_paths, independent of which process finishes first.
+
+    Parameters:
+    - pdf_paths: List of paths of the PDFs.
+    - chunk_size (int): The size of text chunks to split the documents into.
+    - chunk_overlap (int): The number of characters to overlap between adjacent chunks.
+    - workers (int): Number of processes, defaults to the number of CPUs. With 1, the PDFs are parsed in this process.
+    - cache_directory (str): Optional, directory of a ChunkCache holding parsed documents and splits.
+
+    Returns:
+    - List of split documents.
+    """
+    load = partial(
+        load_pdf_splits,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        cache_directory=cache_directory,
+    )
+
+    if workers == 1 or len(pdf_paths) <= 1:
+        results = map(load, pdf_paths)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # map returns the results in the order of pdf_paths
+            results = list(executor.map(load, pdf_paths))
+
+    splits = []
+    for pdf_path, pdf_splits in zip(pdf_paths, results):
+        print(f"Parsed {os.path.basename(pdf_path)}: {len(pdf_splits)} splits")
+        splits.extend(pdf_splits)
+    return splits
+
+
+def file_hash(path):
+    """
+    Returns the SHA-256 hash of the content of a file.
+    """
+    sha = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def source_name(metadata):
+    """
+    Returns the file name of the source of a chunk (the key under which updates track its source file).
+    """
+    return os.path.basename(str((metadata or {}).get("source", "")))
+
+
+def chunk_ids(splits):
+    """
+    Returns deterministic IDs for splits: the SHA-256 hash of the source file name, the chunk text and
+    the number of earlier identical chunks of the same source.
+
+    The IDs only depend on the content, so rebuilding a database from the same files yields the same IDs.
+    """
+    ids = []
+    occurrences = {}
+    for split in splits:
+        source = source_name(split.metadata)
+        key = (source, split.page_content)
+        occurrence = occurrences.get(key, 0)
+        occurrences[key] = occurrence + 1
+        content = f"{source}\x00{split.page_content}\x00{occurrence}"
+        ids.append(hashlib.sha256(content.encode("utf-8")).hexdigest())
+    return ids
+
 
 class VectorDatabase:
     def __init__(
@@ -19,6 +224,11 @@ class VectorDatabase:
         chunk_overlap=200,
         loader="pdf",
         reload=True,
+        backend="chroma",
+        dtype="float32",
+        dimensions=None,
+        lexical=False,
+        chunk_cache_directory=None,
     ):
         """
         Initializes the VectorDatabase.
@@ -30,6 +240,17 @@ class VectorDatabase:
         - chunk_size (int): The size of text chunks to split the documents into. Defaults to 1000.
         - chunk_overlap (int): The number of characters to overlap between adjacent chunks. Defaults to 100.
         - loader(str): "pdf" or "csv", depending on data format
+        - backend (str): "chroma" to search the Chroma database, "numpy" to load all embeddings into memory
+          and search them with exact matrix operations (NumpyVectorIndex), or "bundle" to memory-map a bundle
+          written by export_bundle (database_directory is then the bundle directory). Defaults to "chroma".
+        - dtype (str): Storage type of the embeddings for the "numpy" backend: "float32", "float16" or "int8". Defaults to "float32".
+        - dimensions (int): Optional, number of leading embedding dimensions kept by the "numpy" backend (Matryoshka truncation).
+          Bundles keep the storage type and dimensions they were exported with.
+        - lexical (bool): Whether to load (from a bundle) or build a per-party BM25 index over the same chunks,
+          used for hybrid and lexical search. Defaults to False.
+        - chunk_cache_directory (str): Optional, directory of a ChunkCache (Parquet files) in which parsed
+          documents and splits are kept, so databases with other embedding models or splitter parameters
+          are built without parsing the sources again.
         """
 
         self.embedding_model = embedding_model
@@ -39,120 +260,491 @@ class VectorDatabase:
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
         self.loader = loader
+        self.backend = backend
+        self.dtype = dtype
+        self.dimensions = dimensions
+        self.lexical = lexical
+        self.lexical_index = None
+        self.chunk_cache_directory = chunk_cache_directory
 
         if reload:
             self.database = self.load_database()
 
     def load_database(self):
         """
-        Loads an existing Chroma database.
+        Loads an existing Chroma database (and copies it into memory for the "numpy" backend),
+        or memory-maps an exported bundle for the "bundle" backend.
 
         Returns:
-        - The loaded Chroma database.
+        - The loaded Chroma database or NumpyVectorIndex.
         """
-        if os.path.exists(self.database_directory):
+        if self.backend == "bundle" and os.path.exists(self.database_directory):
+            self.database = NumpyVectorIndex.from_bundle(
+                self.database_directory, embedding_function=self.embedding_model
+            )
+            bundle_model = self.database.manifest.get("embedding_model")
+            if bundle_model != self._embedding_model_name():
+                raise AssertionError(
+                    f"Bundle {self.database_directory} was built with {bundle_model}, not {self._embedding_model_name()}."
+                )
+            print("loaded database bundle")
+        elif os.path.exists(self.database_directory):
             self.database = Chroma(
                 persist_directory=self.database_directory,
                 embedding_function=self.embedding_model,
             )
+            if self.backend == "numpy":
+                self.database = NumpyVectorIndex.from_chroma(
+                    self.database,
+                    embedding_function=self.embedding_model,
+                    dtype=self.dtype,
+                    dimensions=self.dimensions,
+                )
             print("reloaded database")
         else:
             raise AssertionError(
                 f"{self.database_directory} does not include database."
             )
 
+        if self.lexical:
+            if self.backend == "bundle":
+                self.lexical_index = BM25Index.from_directory(self.database_directory)
+            if self.lexical_index is None:
+                self.lexical_index = self.build_lexical_index()
+
         return self.database
 
-    def build_database(self, overwrite=True):
+    def build_lexical_index(self):
+        """
+        Builds a per-party BM25 index over the chunks of the loaded database.
+
+        Returns:
+        - The BM25Index.
+        """
+        if isinstance(self.database, NumpyVectorIndex):
+            ids = self.database.ids
+            texts = self.database.documents
+            metadatas = self.database.metadatas
+        else:
+            data = self.database.get(include=["documents", "metadatas"])
+            ids, texts, metadatas = data["ids"], data["documents"], data["metadatas"]
+
+        self.lexical_index = BM25Index(ids, texts, metadatas)
+        return self.lexical_index
+
+    def export_bundle(self, bundle_directory):
         """
-        Builds a new Chroma database from the documents in the data directory.
+        Exports the loaded database as a read-only bundle for fast startup with backend="bundle":
+        an .npy embedding matrix, columnar metadata and a manifest with the embedding model name,
+        chunk parameters and a content hash.
 
         Parameters:
-        - loader: Optional, a document loader instance. If None, PyPDFDirectoryLoader will be used with the data_directory.
+        - bundle_directory (str): The directory to write the bundle to (must not exist yet).
 
         Returns:
-        - The newly built Chroma database.
+        - The manifest of the bundle.
         """
-        # # If overwrite flag is true, remove old databases from directory if they exist
-        # if overwrite:
-        #     if os.path.exists(self.database_directory):
-        #         shutil.rmtree(self.database_directory)
-        #         time.sleep(1)
+        index = self.database
+        if not isinstance(index, NumpyVectorIndex):
+            index = NumpyVectorIndex.from_chroma(
+                index, dtype=self.dtype, dimensions=self.dimensions
+            )
 
-        # PDF is the default loader defined above
+        manifest = index.save_bundle(
+            bundle_directory,
+            source_type=self.source_type,
+            embedding_model=self._embedding_model_name(),
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap,
+        )
 
-        if os.path.exists(self.database_directory):
-            raise AssertionError("Delete old database first and restart session!")
+        # Ship a prebuilt lexical index with the bundle
+        lexical_index = self.lexical_index or self.build_lexical_index()
+        lexical_index.save(os.path.join(bundle_directory, "lexical_index.pkl"))
 
-        # Define text_splitter
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap
+        return manifest
+
+    def _embedding_model_name(self):
+        """
+        Returns a name identifying the embedding model (e.g. "text-embedding-3-large").
+        """
+        return getattr(self.embedding_model, "model", type(self.embedding_model).__name__)
+
+    def max_marginal_relevance_search_ids_by_vector(
+        self, embedding, k=4, fetch_k=20, filter=None, lambda_mult=0.5
+    ):
+        """
+        Selects documents by maximal marginal relevance, like Chroma's max_marginal_relevance_search_by_vector,
+        but also returns the chunk IDs of the selected documents.
+
+        Parameters:
+        - embedding: The query embedding.
+        - k (int): Number of documents to return.
+        - fetch_k (int): Number of candidate documents passed to the MMR algorithm.
+        - filter (dict): Optional metadata filter, e.g. {"party": "spd"}.
+        - lambda_mult (float): Trade-off between relevance (1) and diversity (0).
+
+        Returns:
+        - ids: List of chunk IDs of the selected documents.
+        - docs: List of the selected documents (in the order of their similarity to the query).
+        """
+        if isinstance(self.database, NumpyVectorIndex):
+            return self.database.max_marginal_relevance_search_ids_by_vector(
+                embedding, k=k, fetch_k=fetch_k, filter=filter, lambda_mult=lambda_mult
+            )
+
+        results = self.database._collection.query(
+            query_embeddings=[embedding],
+            n_results=fetch_k,
+            where=filter,
+            include=["metadatas", "documents", "embeddings"],
+        )
+        mmr_selected = maximal_marginal_relevance(
+            np.array(embedding, dtype=np.float32),
+            results["embeddings"][0],
+            k=k,
+            lambda_mult=lambda_mult,
+        )
+
+        # Keep the candidate order (most similar first), as Chroma does
+        selected = sorted(mmr_selected)
+        ids = [results["ids"][0][i] for i in selected]
+        docs = [
+            Document(
+                page_content=results["documents"][0][i],
+                metadata=results["metadatas"][0][i] or {},
+            )
+            for i in selected
+        ]
+        return ids, docs
+
+    def max_marginal_relevance_search_ids_for_parties(
+        self, embedding, parties, k=4, fetch_k=20, lambda_mult=0.5
+    ):
+        """
+        Runs the MMR search for several parties. The in-memory backends ("numpy" and "bundle") select the
+        documents of all parties in a single batched pass, the "chroma" backend searches party by party.
+
+        Parameters:
+        - embedding: The query embedding.
+        - parties: List of party names.
+        - k (int): Number of documents to return per party.
+        - fetch_k (int): Number of candidate documents per party passed to the MMR algorithm.
+        - lambda_mult (float): Trade-off between relevance (1) and diversity (0).
+
+        Returns:
+        - Dictionary with (ids, docs) for each party, as returned by max_marginal_relevance_search_ids_by_vector.
+        """
+        if isinstance(self.database, NumpyVectorIndex):
+            return self.database.max_marginal_relevance_search_ids_for_parties(
+                embedding, parties, k=k, fetch_k=fetch_k, lambda_mult=lambda_mult
+            )
+
+        return {
+            party: self.max_marginal_relevance_search_ids_by_vector(
+                embedding,
+                k=k,
+                fetch_k=fetch_k,
+                filter={"party": party},
+                lambda_mult=lambda_mult,
+            )
+            for party in parties
+        }
+
+    def lexical_search_ids_for_parties(self, question, parties, k=4):
+        """
+        Runs a BM25 search for several parties (requires the lexical index, see the lexical parameter).
+
+        Parameters:
+        - question (str): The query text.
+        - parties: List of party names.
+        - k (int): Number of documents to return per party (fewer if fewer documents match).
+
+        Returns:
+        - Dictionary with (ids, docs) for each party.
+        """
+        results = {}
+        for party in parties:
+            ids = [id_ for id_, _ in self.lexical_index.search(question, party, k=k)]
+            results[party] = (ids, self.get_documents(ids))
+        return results
+
+    def hybrid_search_ids_for_parties(
+        self, embedding, question, parties, k=4, fetch_k=20, rrf_k=60
+    ):
+        """
+        Fuses the dense ranking and the BM25 ranking of each party's fetch_k best chunks with reciprocal rank fusion.
+
+        Parameters:
+        - embedding: The query embedding.
+        - question (str): The query text.
+        - parties: List of party names.
+        - k (int): Number of documents to return per party.
+        - fetch_k (int): Number of candidates taken from each ranking.
+        - rrf_k (int): Rank offset of reciprocal rank fusion.
+
+        Returns:
+        - Dictionary with (ids, docs) for each party, in fused order.
+        """
+        results = {}
+        for party in parties:
+            dense_ids = self._similarity_search_ids(embedding, party, fetch_k)
+            lexical_ids = [
+                id_ for id_, _ in self.lexical_index.search(question, party, k=fetch_k)
+            ]
+            ids = reciprocal_rank_fusion([dense_ids, lexical_ids], k=rrf_k)[:k]
+            results[party] = (ids, self.get_documents(ids))
+        return results
+
+    def _similarity_search_ids(self, embedding, party, k):
+        """
+        Returns the IDs of the k chunks of a party most similar to the embedding.
+        """
+        if isinstance(self.database, NumpyVectorIndex):
+            return self.database.similarity_search_ids_by_vector(
+                embedding, k=k, filter={"party": party}
+            )
+        results = self.database._collection.query(
+            query_embeddings=[embedding],
+            n_results=k,
+            where={"party": party},
+            include=["distances"],
+        )
+        return results["ids"][0]
+
+    @property
+    def supports_batched_search(self):
+        """
+        Whether max_marginal_relevance_search_ids_for_parties searches all parties in one pass.
+        """
+        return isinstance(self.database, NumpyVectorIndex)
+
+    def get_documents(self, ids):
+        """
+        Fetches documents by their chunk IDs.
+
+        Parameters:
+        - ids: List of chunk IDs.
+
+        Returns:
+        - List of documents in the order of the given IDs.
+        """
+        if len(ids) == 0:
+            return []
+        if isinstance(self.database, NumpyVectorIndex):
+            return self.database.get_documents(ids)
+
+        results = self.database.get(ids=list(ids), include=["documents", "metadatas"])
+        documents = {
+            id_: Document(page_content=text, metadata=metadata or {})
+            for id_, text, metadata in zip(
+                results["ids"], results["documents"], results["metadatas"]
+            )
+        }
+        return [documents[id_] for id_ in ids]
+
+    def build_database(self, overwrite=True, workers=None):
+        """
+        Builds a new Chroma database from the documents in the data directory, or updates an existing
+        database incrementally (see update_database).
+
+        Parameters:
+        - workers (int): Number of processes parsing the PDFs, defaults to the number of CPUs.
+
+        Returns:
+        - The built Chroma database.
+        """
+        self.update_database(workers=workers)
+        return self.database
+
+    def update_database(self, dry_run=False, workers=None):
+        """
+        Brings the Chroma database in line with the source files (PDFs of the data directory or the CSV file),
+        creating it if it does not exist.
+
+        Every chunk stores the SHA-256 hash of its source file ("source_hash") and has a content-based ID
+        (see chunk_ids). Only new or changed source files are parsed. Chunks that are new are embedded
+        and added (reusing the stored embedding of a removed chunk with the same text instead of calling
+        the embedding model), chunks that no longer exist (also those of removed files) are deleted, and
+        the metadata of the remaining chunks of changed files (e.g. their page) is updated.
+
+        Parameters:
+        - dry_run (bool): Only report what would change, without embedding or writing anything.
+        - workers (int): Number of processes parsing the PDFs, defaults to the number of CPUs.
+
+        Returns:
+        - Report with the status of each source ("new", "changed", "unchanged" or "removed") and the number
+          of chunks to embed, to add with reused embeddings, to delete and to update.
+        """
+        if self.backend == "bundle":
+            raise AssertionError("Bundles are read-only, update the Chroma database.")
+
+        # A dry run must not create the database directory
+        collection = None
+        stored = {"ids": [], "metadatas": []}
+        if not dry_run or os.path.exists(self.database_directory):
+            database = Chroma(
+                persist_directory=self.database_directory,
+                embedding_function=self.embedding_model,
+                collection_metadata={"hnsw:space": "cosine"},
+            )
+            collection = database._collection
+            stored = collection.get(include=["metadatas"])
+
+        # Chunks in the database per source file
+        stored_ids = set(stored["ids"])
+        stored_sources = {}
+        for id_, metadata in zip(stored["ids"], stored["metadatas"]):
+            source = stored_sources.setdefault(
+                source_name(metadata), {"ids": [], "hashes": set()}
+            )
+            source["ids"].append(id_)
+            source["hashes"].add((metadata or {}).get("source_hash"))
+
+        if self.loader == "pdf":
+            source_paths = sorted(glob.glob(os.path.join(self.data_path, "*.pdf")))
+        else:
+            source_paths = [self.data_path]
+        source_hashes = {path: file_hash(path) for path in source_paths}
+
+        report = {"sources": {}}
+        changed_paths = []
+        for path in source_paths:
+            name = os.path.basename(path)
+            if name not in stored_sources:
+                report["sources"][name] = "new"
+            elif stored_sources[name]["hashes"] != {source_hashes[path]}:
+                report["sources"][name] = "changed"
+            else:
+                report["sources"][name] = "unchanged"
+                continue
+            changed_paths.append(path)
+        current_names = {os.path.basename(path) for path in source_paths}
+        for name in stored_sources:
+            if name not in current_names:
+                report["sources"][name] = "removed"
+
+        splits = self._load_splits(changed_paths, workers)
+        for split in splits:
+            path = split.metadata["source"]
+            split.metadata.update({"source_hash": source_hashes[path]})
+        ids = chunk_ids(splits)
+
+        # Chunks of changed and removed sources that no longer exist
+        current_ids = set(ids)
+        stale_ids = [
+            id_
+            for name, status in report["sources"].items()
+            if status in ["changed", "removed"]
+            for id_ in stored_sources[name]["ids"]
+            if id_ not in current_ids
+        ]
+        updated = []
+        added = []
+        for id_, split in zip(ids, splits):
+            (updated if id_ in stored_ids else added).append((id_, split))
+
+        # Reuse the embeddings of stale chunks with the same text (e.g. chunks of a database
+        # built before the IDs were content-based)
+        stale_embeddings = {}
+        for batch in self._batches(stale_ids):
+            stale = collection.get(ids=batch, include=["documents", "embeddings"])
+            for text, embedding in zip(stale["documents"], stale["embeddings"]):
+                stale_embeddings[text] = embedding
+        reused = []
+        embedded = []
+        for id_, split in added:
+            if split.page_content in stale_embeddings:
+                reused.append((id_, split))
+            else:
+                embedded.append((id_, split))
+
+        report.update(
+            {
+                "embed": len(embedded),
+                "reuse": len(reused),
+                "delete": len(stale_ids),
+                "update": len(updated),
+            }
         )
+        n_changed = sum(status != "unchanged" for status in report["sources"].values())
+        print(
+            f"{'Would update' if dry_run else 'Updating'} {self.database_directory}: "
+            f"{n_changed} of {len(report['sources'])} sources changed, "
+            f"{report['embed']} chunks to embed, {report['reuse']} to reuse, "
+            f"{report['delete']} to delete, {report['update']} to update"
+        )
+        for name, status in sorted(report["sources"].items()):
+            if status != "unchanged":
+                print(f"  {status}: {name}")
+        if dry_run:
+            return report
+
+        for batch in self._batches(reused):
+            collection.upsert(
+                ids=[id_ for id_, _ in batch],
+                embeddings=[stale_embeddings[split.page_content] for _, split in batch],
+                documents=[split.page_content for _, split in batch],
+                metadatas=[split.metadata for _, split in batch],
+            )
+        for batch in self._batches(embedded):
+            database.add_texts(
+                texts=[split.page_content for _, split in batch],
+                metadatas=[split.metadata for _, split in batch],
+                ids=[id_ for id_, _ in batch],
+            )
+        for batch in self._batches(updated):
+            collection.update(
+                ids=[id_ for id_, _ in batch],
+                metadatas=[split.metadata for _, split in batch],
+            )
+        for batch in self._batches(stale_ids):
+            collection.delete(ids=batch)
+
+        # Reload to refresh the in-memory index of the "numpy" backend
+        self.load_database()
+        return report
+
+    def _load_splits(self, source_paths, workers=None):
+        """
+        Parses and splits the given source files (PDFs or the CSV file).
+        """
+        if len(source_paths) == 0:
+            return []
 
         if self.loader == "pdf":
             # loader = PyPDFDirectoryLoader(self.data_path)
-            # get file_paths of all pdfs in data_folder
-            pdf_paths = glob.glob(os.path.join(self.data_path, "*.pdf"))
-
-            splits = []
-            for pdf_path in pdf_paths:
-                file_name = os.path.basename(pdf_path)
-                party = file_name.split("_")[0]
-
-                # Load pdf as single doc
-                loader = PDFMinerLoader(pdf_path, concatenate_pages=True)
-                doc = loader.load()
-
-                # Also load pdf as individual pages, this is important to extract the page number later
-                loader = PDFMinerLoader(pdf_path, concatenate_pages=False)
-                doc_pages = loader.load()
-
-                # Add party to metadata
-                for i in range(len(doc)):
-                    doc[i].metadata.update({"party": party})
-
-                # Create splits
-                splits_temp = text_splitter.split_documents(doc)
-
-                # For each split, we search for the page on which it has occurred
-                for split in splits_temp:
-                    for i, doc_page in enumerate(doc_pages):
-                        # Create first and second half of split
-                        split_1 = split.page_content[
-                            : int(0.5 * len(split.page_content))
-                        ]
-                        split_2 = split.page_content[
-                            int(0.5 * len(split.page_content)) :
-                        ]
-                        # If the first half is on page i, set page=i
-                        if split_1 in doc_page.page_content:
-                            split.metadata.update({"page": i})
-                        # If the second half is on page i, set page=i
-                        elif split_2 in doc_page.page_content:
-                            split.metadata.update({"page": i})
-
-                splits.extend(splits_temp)
-
-        elif self.loader == "csv":
-            loader = CSVLoader(
-                self.data_path,
-                metadata_columns=["date", "fullName", "politicalGroup", "party"],
-            )
-            # Load documents
-            docs = loader.load()
-
-            # Create splits
-            splits = text_splitter.split_documents(docs)
-
-        # Create database
-        self.database = Chroma.from_documents(
-            splits,
-            self.embedding_model,
-            persist_directory=self.database_directory,
-            collection_metadata={"hnsw:space": "cosine"},
+            return load_pdf_files_splits(
+                source_paths,
+                self.chunk_size,
+                self.chunk_overlap,
+                workers=workers,
+                cache_directory=self.chunk_cache_directory,
+            )
+
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap
+        )
+        cache = None
+        if self.chunk_cache_directory is not None:
+            cache = ChunkCache(self.chunk_cache_directory)
+        return cached_splits(
+            cache,
+            self.data_path,
+            None if cache is None else file_hash(self.data_path),
+            {
+                "loader": "csv",
+                "chunk_size": self.chunk_size,
+                "chunk_overlap": self.chunk_overlap,
+            },
+            parse_csv,
+            text_splitter.split_documents,
         )
 
-        return self.database
+    @staticmethod
+    def _batches(items, batch_size=UPDATE_BATCH_SIZE):
+        for start in range(0, len(items), batch_size):
+            yield items[start : start + batch_size]
 
 
 if __name__ == "__main__":
@@ -1,52 +1,260 @@
-from openai import OpenAI
+import asyncio
+import hashlib
+import json
+import os
+
+from openai import AsyncOpenAI, OpenAIError
+
+INSTRUCTION = """Du hilfst mir bei der Evaluation eines RAG systems.
+Bewerte, ob die folgenden Dokumente relevant sind für die Frage.
+Antworte mit einer List, in der für jedes Dokument entweder 0 (nicht relevant) oder 1 (relevant) ausgegeben wird.
+Beispiel: 0, 1, 1, 1, 0"""
+
+
+def document_hash(document):
+    """
+    Returns the SHA-256 hash of a document text.
+    """
+    return hashlib.sha256(document.encode("utf-8")).hexdigest()
+
+
+def parse_judgments(response, n_documents):
+    """
+    Parses a list of 0/1 judgments (e.g. "0, 1, 1") for n_documents documents.
+
+    Returns:
+    judgments: list of int, or None if the response does not contain exactly one 0 or 1 per document
+    """
+    values = [value.strip() for value in response.strip().strip("[]").split(",")]
+    if len(values) != n_documents or any(value not in ["0", "1"] for value in values):
+        return None
+    return [int(value) for value in values]
+
+
+class JudgmentCache:
+    """
+    Disk cache of relevance judgments keyed by (question, document hash, judge model).
+
+    Judgments are appended to a JSONL file as soon as they are made, so an interrupted
+    evaluation keeps all judgments made so far.
+
+    Args:
+    path: str, optional, JSONL file of the cache (the cache only lives in memory if None)
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._judgments = {}
+        if path is not None and os.path.exists(path):
+            with open(path, "r") as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # The last line may be incomplete if a run was interrupted while writing it
+                        continue
+                    key = (entry["question"], entry["document"], entry["model"])
+                    self._judgments[key] = entry["relevant"]
+
+    def get(self, question, document, model):
+        return self._judgments.get((question, document_hash(document), model))
+
+    def put(self, question, documents, model, judgments):
+        entries = []
+        for document, relevant in zip(documents, judgments):
+            key = (question, document_hash(document), model)
+            self._judgments[key] = relevant
+            entries.append(
+                {
+                    "question": question,
+                    "document": key[1],
+                    "model": model,
+                    "relevant": relevant,
+                }
+            )
+        if self.path is not None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a") as file:
+                for entry in entries:
+                    file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def __len__(self):
+        return len(self._judgments)
 
 
 class Evaluator:
-    def __init__(self):
-        self.client = OpenAI()
+    """
+    Evaluates the context relevancy of RAG experiment datasets with an LLM judge.
+
+    Every row of every split (one split per party) is scored. The documents of a row that have not been
+    judged for its question yet are judged in one request, with at most max_concurrency requests in flight.
+    Judgments are memoized on disk per (question, document hash, judge model), so re-running an
+    evaluation only sends requests for new question-document pairs.
+
+    Args:
+    model: str, judge model, default is "gpt-3.5-turbo"
+    cache_path: str, optional, JSONL file in which judgments are memoized (only in memory if None)
+    max_concurrency: int, maximum number of judge requests in flight, default is 8
+    client: AsyncOpenAI object, optional, client used for the judge requests
+    """
+
+    def __init__(
+        self, model="gpt-3.5-turbo", cache_path=None, max_concurrency=8, client=None
+    ):
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.client = client if client is not None else AsyncOpenAI()
+        self.cache = JudgmentCache(cache_path)
+        self.requests = 0
 
     def context_relevancy(self, dataset):
-        instruction = """
-        Du hilfst mir bei der Evaluation eines RAG systems. 
-        Bewerte, ob die folgenden Dokumente relevant sind für die Frage. 
-        Antworte mit einer List, in der für jedes Dokument entweder 0 (nicht relevant) oder 1 (relevant) ausgegeben wird.
-        Beispiel: 0, 1, 1, 1, 0
         """
-        question = dataset["question"][0]
-        context_docs = dataset["contexts"][0]
+        Scores the context relevancy of the first row of a dataset.
+
+        Args:
+        dataset: Dataset with columns "question" and "contexts"
+
+        Returns:
+        result: dict, {"context_relevancy": share of relevant documents, or None if the judgment failed}
+        """
+        row = {"question": dataset["question"][0], "contexts": dataset["contexts"][0]}
+        score = asyncio.run(self._score_row(row, asyncio.Semaphore(1)))
+        return {"context_relevancy": score}
+
+    async def astream_context_relevancy(self, dataset):
+        """
+        Scores the context relevancy of every row of every split and yields the results as they arrive.
+
+        Args:
+        dataset: DatasetDict (or dict of lists of rows) with one split per party and columns "question" and "contexts"
 
+        Yields:
+        update: dict with the "split", "row" index, "question" and "context_relevancy" of a scored row
+            and the running "aggregate" (mean, scored and failed rows for each split and "overall")
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        aggregate = {"overall": {"mean": None, "scored": 0, "failed": 0}}
+        totals = {"overall": 0.0}
+
+        async def score(split, i, row):
+            return split, i, row, await self._score_row(row, semaphore)
+
+        tasks = []
+        for split in dataset:
+            aggregate[split] = {"mean": None, "scored": 0, "failed": 0}
+            totals[split] = 0.0
+            for i, row in enumerate(dataset[split]):
+                tasks.append(asyncio.ensure_future(score(split, i, row)))
+
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                split, i, row, relevancy = await next_result
+                for name in [split, "overall"]:
+                    if relevancy is None:
+                        aggregate[name]["failed"] += 1
+                        continue
+                    totals[name] += relevancy
+                    aggregate[name]["scored"] += 1
+                    aggregate[name]["mean"] = totals[name] / aggregate[name]["scored"]
+                yield {
+                    "split": split,
+                    "row": i,
+                    "question": row["question"],
+                    "context_relevancy": relevancy,
+                    "aggregate": {
+                        name: dict(values) for name, values in aggregate.items()
+                    },
+                }
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def evaluate_context_relevancy(self, dataset, report_every=50):
+        """
+        Scores the context relevancy of every row of every split and prints the aggregated metrics while running.
+
+        Args:
+        dataset: DatasetDict with one split per party and columns "question" and "contexts"
+        report_every: int, number of scored rows between progress reports, default is 50
+
+        Returns:
+        results: dict, {question: {split: {"context_relevancy": score}}} (the layout of the experiment metrics)
+        aggregate: dict, mean, scored and failed rows for each split and "overall"
+        """
+
+        async def run():
+            results = {}
+            aggregate = {}
+            n_rows = 0
+            async for update in self.astream_context_relevancy(dataset):
+                results.setdefault(update["question"], {})[update["split"]] = {
+                    "context_relevancy": update["context_relevancy"]
+                }
+                aggregate = update["aggregate"]
+                n_rows += 1
+                if n_rows % report_every == 0:
+                    print(
+                        f"{n_rows} rows, {self.requests} judge requests, "
+                        f"context relevancy {aggregate['overall']['mean']}"
+                    )
+            return results, aggregate
+
+        return asyncio.run(run())
+
+    async def _score_row(self, row, semaphore):
+        """
+        Returns the share of relevant documents of a row, judging only the documents not in the cache.
+        """
+        question = row["question"]
+        documents = list(row["contexts"])
+        if len(documents) == 0:
+            return None
+
+        judgments = [self.cache.get(question, doc, self.model) for doc in documents]
+        missing = [doc for doc, judged in zip(documents, judgments) if judged is None]
+        if len(missing) > 0:
+            async with semaphore:
+                new_judgments = await self._judge(question, missing)
+            if new_judgments is None:
+                return None
+            self.cache.put(question, missing, self.model, new_judgments)
+            judgments = [self.cache.get(question, doc, self.model) for doc in documents]
+
+        return sum(judgments) / len(judgments)
+
+    async def _judge(self, question, documents):
+        """
+        Asks the judge model for the relevance of each document, returns None if the request or parsing failed.
+        """
         context = ""
-        for i, doc in enumerate(context_docs):
+        for i, doc in enumerate(documents):
             context += f"Dokument {i+1}: {doc}\n\n"
 
-        prompt = f"""
-        {instruction}
-        
-        Hier sind die Dokumente:
-        {context}
-        
-        Hier ist die Frage:
-        {question}"""
-
-        completion = self.client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            temperature=0,
-            messages=[
-                {"role": "user", "content": prompt},
-            ],
+        prompt = (
+            f"{INSTRUCTION}\n\nHier sind die Dokumente:\n{context}"
+            f"Hier ist die Frage:\n{question}"
         )
-        # Parse output into list
-        try:
-            response = completion.choices[0].message.content
-            result = [int(x.strip()) for x in response.split(",")]
 
-            # Check if all values are 0 or 1
-            if False in [r in [0, 1] for r in result]:
-                raise AssertionError
-        except:
-            print("Exception occurred")
-            return {"context_relevancy": None}
-
-        context_relevancy = sum(result) / len(result)
+        self.requests += 1
+        try:
+            completion = await self.client.chat.completions.create(
+                model=self.model,
+                temperature=0,
+                messages=[
+                    {"role": "user", "content": prompt},
+                ],
+            )
+        except OpenAIError as e:
+            print(f"Judge request failed: {e}")
+            return None
 
-        return {"context_relevancy": context_relevancy}
+        response = completion.choices[0].message.content
+        if not response:
+            print("Judge returned an empty response")
+            return None
+        judgments = parse_judgments(response, len(documents))
+        if judgments is None:
+            print(f"Could not parse judgments: {response!r}")
+        return judgments
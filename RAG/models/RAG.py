@@ -1,5 +1,66 @@
 from langchain_openai import ChatOpenAI
-import asyncio
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import contextvars
+import json
+import queue
+import re
+import threading
+import time
+
+from RAG.database.lexical_index import is_single_keyword
+from RAG.models.cache import normalize_question
+from RAG.models.context import ContextBuilder
+from RAG.models.latency import LatencyTracker
+
+PROMPT_TEMPLATE = """Beantworte die unten folgende FRAGE DES NUTZERS, indem du die politischen Positionen der Partei im unten angegebenen KONTEXT zusammenfasst.
+Der KONTEXT umfasst Ausschnitte aus Redebeiträgen im EU-Parlament und aus dem EU-Wahlprogramm für 2024 für die Partei.
+Deine Antwort soll ausschließlich die Informationen aus dem genannten KONTEXT beinhalten.
+Verwende in deiner Antwort NICHT den Namen der Partei, sondern beziehe dich auf die Partei ausschließlich mit "die Partei".
+Sollte der KONTEXT keine Antwort auf die FRAGE DES NUTZERS zulassen, gib anstelle der Zusammenfassung NUR die folgende Rückmeldung:
+"Es wurde keine passende Antwort in den Quellen gefunden."
+Gib die Antwort auf {language}.
+
+KONTEXT:
+{context}FRAGE DES NUTZERS:
+{question}"""
+
+COMBINED_PROMPT_TEMPLATE = """Beantworte die unten folgende FRAGE DES NUTZERS für jede der Parteien {labels}, indem du die politischen Positionen der jeweiligen Partei im unten angegebenen KONTEXT der Partei zusammenfasst.
+Der KONTEXT jeder Partei umfasst Ausschnitte aus Redebeiträgen im EU-Parlament und aus dem EU-Wahlprogramm für 2024 für die Partei.
+Jede Antwort soll ausschließlich die Informationen aus dem KONTEXT der jeweiligen Partei beinhalten.
+Verwende in deinen Antworten NICHT den Namen der Partei, sondern beziehe dich auf die Partei ausschließlich mit "die Partei".
+Sollte der KONTEXT einer Partei keine Antwort auf die FRAGE DES NUTZERS zulassen, gib als Antwort für diese Partei NUR die folgende Rückmeldung:
+"Es wurde keine passende Antwort in den Quellen gefunden."
+Gib die Antworten auf {language}.
+Antworte ausschließlich mit einem JSON-Objekt, das jeder Partei ({labels}) ihre Antwort als Text zuordnet.
+
+{contexts}FRAGE DES NUTZERS:
+{question}"""
+
+
+def parse_json_answers(text):
+    """
+    Parses the JSON object of a combined answer (also if it is wrapped in a code block or other text).
+
+    Args:
+    text: str, LLM output
+
+    Returns:
+    answers: dict, non-empty text answer for each key of the JSON object (empty if the output cannot be parsed)
+    """
+    match = re.search(r"\{.*\}", text, flags=re.DOTALL)
+    if match is None:
+        return {}
+    try:
+        parsed = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(parsed, dict):
+        return {}
+    return {
+        key: answer.strip()
+        for key, answer in parsed.items()
+        if isinstance(answer, str) and len(answer.strip()) > 0
+    }
 
 
 class RAG:
@@ -10,14 +71,60 @@ class RAG:
     databases: list of VectorDatabase objects
     llm: ChatOpenAI object, default is ChatOpenAI(model_name="gpt-3.5-turbo", max_tokens=2000, temperature=0)
     k: int, number of documents to fetch from each database, default is 3
+    fetch_k: int, number of candidate documents passed to the MMR algorithm, default is 5
     language: str, language of the generated answer, default is "Deutsch"
+    max_concurrency: int, maximum number of database searches running at the same time, default is 8 (1 searches sequentially)
+    cache: ResponseCache object, optional, cache for responses to (near-)identical questions
+    retrieval_cache: RetrievalCache object, optional, cache for retrieved chunk IDs and question embeddings (independent of the language)
+    retrieval_mode: str, "dense" (MMR on embeddings) or "hybrid" (reciprocal rank fusion of dense and BM25 rankings, for databases with a lexical index), default is "dense"
+    lexical_fast_path: bool, whether single-keyword questions are answered by BM25 search without embedding the question (for databases with a lexical index), default is True
+    context_builder: ContextBuilder object, optional, builds the context of each prompt within a token budget, default is ContextBuilder() (no budget, only removes overlapping text)
+    single_flight: SingleFlight object, optional, shared by RAG instances so that concurrent identical queries (same question, parties and settings) are computed only once
+    scheduler: LLMScheduler object, optional, shared by RAG instances to limit the rate and concurrency of all LLM requests (requests are sent directly if None)
+    session_id: hashable, optional, session under which LLM requests are queued by the scheduler (requests of different sessions are served in turn)
+    max_retries: int, maximum number of retries of a failed party completion (the other parties are kept), default is 2
+    hedge_percentile: float, optional, latency percentile after which a duplicate request is sent for a party and the first answer is used (no hedging if None)
+    latency_tracker: LatencyTracker object, optional, recent completion latencies for hedging (shared by RAG instances), default is a new LatencyTracker
+    generation_mode: str, "per_party" (one completion per party) or "combined" (one completion with the contexts of all parties and JSON output,
+        parties missing from the output fall back to per-party completions), default is "per_party". stream_query always generates per party.
+
+    After each call to query, query_stats holds counters for that query (e.g. the number of embedding calls and the prompt tokens per party,
+    prompt_tokens_estimated is True if the tokenizer was not available and the token counts are approximated).
+    After a call to query_many, the counters cover all questions (prompt_tokens is the total).
     """
 
-    def __init__(self, databases, parties=None, llm=None, k=3, language="Deutsch"):
+    def __init__(
+        self,
+        databases,
+        parties=None,
+        llm=None,
+        k=3,
+        fetch_k=5,
+        language="Deutsch",
+        max_concurrency=8,
+        cache=None,
+        retrieval_cache=None,
+        retrieval_mode="dense",
+        lexical_fast_path=True,
+        context_builder=None,
+        single_flight=None,
+        scheduler=None,
+        session_id=None,
+        max_retries=2,
+        hedge_percentile=None,
+        latency_tracker=None,
+        generation_mode="per_party",
+    ):
         self.databases = databases
         self.llm = llm
         self.k = k
+        self.fetch_k = fetch_k
         self.language = language
+        self.max_concurrency = max_concurrency
+        self.cache = cache
+        self.retrieval_cache = retrieval_cache
+        self.retrieval_mode = retrieval_mode
+        self.lexical_fast_path = lexical_fast_path
         if parties == None:
             self.parties = ["gruene", "spd", "cdu", "afd", "fdp", "linke"]
         else:
@@ -26,99 +133,304 @@ class RAG:
             self.llm = ChatOpenAI(
                 model_name="gpt-3.5-turbo", max_tokens=2000, temperature=0
             )
+        if context_builder is None:
+            context_builder = ContextBuilder(
+                model_name=getattr(self.llm, "model_name", "gpt-3.5-turbo")
+            )
+        self.context_builder = context_builder
+        self.single_flight = single_flight
+        self.scheduler = scheduler
+        self.session_id = session_id
+        self.max_retries = max_retries
+        self.hedge_percentile = hedge_percentile
+        if latency_tracker is None:
+            latency_tracker = LatencyTracker()
+        self.latency_tracker = latency_tracker
+        assert generation_mode in [
+            "per_party",
+            "combined",
+        ], f"Unknown generation mode {generation_mode}"
+        self.generation_mode = generation_mode
+        self.query_stats = {"embedding_calls": 0}
+        # Retrieval threads of query_many update the counters concurrently
+        self._stats_lock = threading.Lock()
+
+    def embed_question(self, question):
+        """
+        Embeds a question once per distinct embedding model used by the databases.
+
+        Args:
+        question: str, question
+
+        Returns:
+        question_embeddings: dict, question embedding for each source type ("manifestos" and "debates")
+        """
+        if self.retrieval_cache is not None:
+            question_embeddings = self.retrieval_cache.get_embeddings(question)
+            if question_embeddings is not None:
+                return question_embeddings
+
+        embeddings_by_model = {}
+        question_embeddings = {}
+        for db in self.databases:
+            model_key = id(db.embedding_model)
+            if model_key not in embeddings_by_model:
+                embeddings_by_model[model_key] = db.embedding_model.embed_query(
+                    question
+                )
+                self._count("embedding_calls")
+            question_embeddings[db.source_type] = embeddings_by_model[model_key]
+
+        if self.retrieval_cache is not None:
+            self.retrieval_cache.put_embeddings(question, question_embeddings)
+        return question_embeddings
 
-    def get_documents_for_party(self, question, party):
+    def get_documents_for_party(self, question, party, question_embeddings=None):
         """
         Fetches documents from each database for a given party and a list of questions.
 
         Args:
         question: str, question
         party: str, party name (one of "gruene", "spd", "cdu", "afd", "fdp", "linke")
+        question_embeddings: dict, optional, precomputed question embedding for each source type (see embed_question)
 
         Returns:
         docs: dict, dictionary of documents for each source type ("manifestos" and "debates")
         """
-        docs = {}
-        for db in self.databases:
-            docs[db.source_type] = db.database.max_marginal_relevance_search(
-                question, k=self.k, fetch_k=5, filter={"party": party}
-            )
-        return docs
+        return self.get_documents_for_parties(question, [party], question_embeddings)[
+            party
+        ]
 
-    def build_context_from_docs(self, docs):
+    def get_documents_for_parties(self, question, parties, question_embeddings=None):
         """
-        Builds context string from documents for use in prompting.
+        Fetches documents from each database for several parties, running all party x source searches concurrently.
+        Searches found in the retrieval cache are resolved from their cached chunk IDs instead.
+        Single-keyword questions are answered by lexical search where possible, without embedding the question.
 
         Args:
-        docs: dict, dictionary of documents for each source type ("manifestos" and "debates")
+        question: str, question
+        parties: list of str, party names
+        question_embeddings: dict, optional, precomputed question embedding for each source type (see embed_question).
+            If the question has to be embedded, the embeddings are added to this dictionary.
 
         Returns:
-        context: str, context string (formatted and human-readable excerpts from documents)
+        docs: dict, dictionary of documents for each source type ("manifestos" and "debates") for each party
         """
+        if question_embeddings is None:
+            question_embeddings = {}
+        docs = {party: {} for party in parties}
+        lexical_fast_path = self.lexical_fast_path and is_single_keyword(question)
+
+        searches = []
+        cached_ids = {db.source_type: {} for db in self.databases}
+        for party in parties:
+            for db in self.databases:
+                ids = None
+                if self.retrieval_cache is not None:
+                    ids = self.retrieval_cache.get(
+                        question,
+                        party,
+                        db.source_type,
+                        self.k,
+                        self.fetch_k,
+                        self._retrieval_mode(db, lexical_fast_path),
+                    )
+                if ids is None:
+                    searches.append((party, db))
+                else:
+                    cached_ids[db.source_type][party] = ids
+
+        # Resolve cached chunk IDs with a single lookup per database
+        for db in self.databases:
+            if len(cached_ids[db.source_type]) == 0:
+                continue
+            all_ids = [i for ids in cached_ids[db.source_type].values() for i in ids]
+            documents = dict(zip(all_ids, db.get_documents(all_ids)))
+            for party, ids in cached_ids[db.source_type].items():
+                docs[party][db.source_type] = [documents[i] for i in ids]
+
+        # Lexical fast path: keep the results that found k documents, search the rest densely
+        if lexical_fast_path:
+            remaining_searches = []
+            with self._stats_lock:
+                self.query_stats.setdefault("lexical_searches", 0)
+            for party, db in searches:
+                if db.lexical_index is None:
+                    remaining_searches.append((party, db))
+                    continue
+                ids, documents = db.lexical_search_ids_for_parties(
+                    question, [party], k=self.k
+                )[party]
+                if len(ids) < self.k:
+                    # Too few keyword matches, fall back to the (possibly cached) dense search
+                    cached = None
+                    if self.retrieval_cache is not None:
+                        cached = self.retrieval_cache.get(
+                            question,
+                            party,
+                            db.source_type,
+                            self.k,
+                            self.fetch_k,
+                            self._retrieval_mode(db),
+                        )
+                    if cached is None:
+                        remaining_searches.append((party, db))
+                    else:
+                        docs[party][db.source_type] = db.get_documents(cached)
+                    continue
+                docs[party][db.source_type] = documents
+                self._count("lexical_searches")
+                if self.retrieval_cache is not None:
+                    self.retrieval_cache.put(
+                        question,
+                        party,
+                        db.source_type,
+                        self.k,
+                        self.fetch_k,
+                        ids,
+                        "lexical",
+                    )
+            searches = remaining_searches
+
+        if len(searches) > 0:
+            if not question_embeddings:
+                question_embeddings.update(self.embed_question(question))
+
+            # Databases with batched search handle all their parties in one task,
+            # the others get one task per party so the searches run concurrently
+            tasks = []
+            for db in self.databases:
+                db_parties = [party for party, search_db in searches if search_db is db]
+                if len(db_parties) == 0:
+                    continue
+                if db.supports_batched_search and not self._is_hybrid(db):
+                    tasks.append((db, db_parties))
+                else:
+                    tasks.extend([(db, [party]) for party in db_parties])
 
-        context = ""
-        for source_type in docs:
-            if source_type == "manifestos":
-                context_header = (
-                    "Ausschnitte aus den Wahlprogrammen zur Europawahl 2024:\n"
+            def search(task):
+                db, task_parties = task
+                return self._search_database(
+                    db, question, question_embeddings[db.source_type], task_parties
                 )
-            elif source_type == "debates":
-                context_header = "Ausschnitte aus vergangenen Reden im Europaparlament im Zeitraum 2019-2024:\n\n"
 
-            context_source = (
-                context_header
-                + "\n\n".join([doc.page_content for doc in docs[source_type]])
-                + "\n\n"
+            if self.max_concurrency <= 1 or len(tasks) == 1:
+                results = [search(task) for task in tasks]
+            else:
+                with ThreadPoolExecutor(
+                    max_workers=min(self.max_concurrency, len(tasks))
+                ) as executor:
+                    results = list(executor.map(search, tasks))
+
+            for (db, _), task_results in zip(tasks, results):
+                for party, (ids, documents) in task_results.items():
+                    docs[party][db.source_type] = documents
+                    if self.retrieval_cache is not None:
+                        self.retrieval_cache.put(
+                            question,
+                            party,
+                            db.source_type,
+                            self.k,
+                            self.fetch_k,
+                            ids,
+                            self._retrieval_mode(db),
+                        )
+
+        # Keep the order of sources identical to self.databases
+        docs = {
+            party: {db.source_type: docs[party][db.source_type] for db in self.databases}
+            for party in parties
+        }
+        return docs
+
+    def _search_database(self, db, question, question_embedding, parties):
+        """
+        Runs the MMR (or hybrid) search of one database for one or more parties.
+
+        Returns:
+        results: dict, (ids, docs) for each party with the chunk IDs and the selected documents
+        """
+        if self._is_hybrid(db):
+            return db.hybrid_search_ids_for_parties(
+                question_embedding, question, parties, k=self.k, fetch_k=self.fetch_k
             )
+        return db.max_marginal_relevance_search_ids_for_parties(
+            question_embedding, parties, k=self.k, fetch_k=self.fetch_k
+        )
+
+    def _is_hybrid(self, db):
+        return self.retrieval_mode == "hybrid" and db.lexical_index is not None
+
+    def _retrieval_mode(self, db, lexical_fast_path=False):
+        """
+        Returns the retrieval mode used for a database, which is part of the retrieval cache key.
+        A cached lexical fast path result is only looked up for single-keyword questions.
+        """
+        if lexical_fast_path and db.lexical_index is not None:
+            return "lexical"
+        return "hybrid" if self._is_hybrid(db) else "dense"
 
-            context += context_source
+    def build_context_from_docs(self, docs):
+        """
+        Builds context string from documents for use in prompting (within the token budget of the context builder).
 
-        return context
+        Args:
+        docs: dict, dictionary of documents for each source type ("manifestos" and "debates")
 
-    def generate_prompt_for_party(self, question, party):
+        Returns:
+        context: str, context string (formatted and human-readable excerpts from documents)
+        """
+        return self.context_builder.build(docs)
+
+    def generate_prompt_for_party(
+        self, question, party, question_embeddings=None, docs=None
+    ):
         """
         Generates a prompt for a given party and question.
 
         Args:
         question: str, question
         party: str, party name (one of "gruene", "spd", "cdu", "afd", "fdp", "linke")
+        question_embeddings: dict, optional, precomputed question embedding for each source type (see embed_question)
+        docs: dict, optional, already retrieved documents for each source type (skips retrieval)
 
         Returns:
         prompt_dict: dict, dictionary containing the question, prompt, and documents for the party
         """
-        docs = self.get_documents_for_party(question, party)
+        if docs is None:
+            docs = self.get_documents_for_party(question, party, question_embeddings)
         context = self.build_context_from_docs(docs)
-        prompt = f"""   
-            Beantworte die unten folgende FRAGE DES NUTZERS, indem du die politischen Positionen der Partei im unten angegebenen KONTEXT zusammenfasst.
-            Der KONTEXT umfasst Ausschnitte aus Redebeiträgen im EU-Parlament und aus dem EU-Wahlprogramm für 2024 für die Partei. 
-            Deine Antwort soll ausschließlich die Informationen aus dem genannten KONTEXT beinhalten.
-            Verwende in deiner Antwort NICHT den Namen der Partei, sondern beziehe dich auf die Partei ausschließlich mit "die Partei".
-            Sollte der KONTEXT keine Antwort auf die FRAGE DES NUTZERS zulassen, gib anstelle der Zusammenfassung NUR die folgende Rückmeldung: 
-            "Es wurde keine passende Antwort in den Quellen gefunden."
-            Gib die Antwort auf {self.language}.
-
-            KONTEXT:
-            {context}
-
-            FRAGE DES NUTZERS: 
-            {question}
-            """
+        prompt = PROMPT_TEMPLATE.format(
+            language=self.language, context=context, question=question
+        )
+        self.query_stats.setdefault("prompt_tokens", {})[
+            party
+        ] = self._count_prompt_tokens(prompt)
         prompt_dict = {"question": question, "prompt": prompt, "docs": docs}
         return prompt_dict
 
-    def generate_prompts(self, question):
+    def generate_prompts(self, question, question_embeddings=None, parties=None):
         """
         Generates prompts for each party given a question.
 
         Args:
         question: str, question
+        question_embeddings: dict, optional, precomputed question embedding for each source type (see embed_question)
+        parties: list of str, optional, parties to generate prompts for (default is self.parties)
 
         Returns:
         prompts_dict: dict, dictionary containing the question, prompt, and documents for each party
         """
+        if parties is None:
+            parties = self.parties
+
+        # The question is embedded at most once (and only if needed) and reused for all parties and sources
+        if question_embeddings is None:
+            question_embeddings = {}
+        docs = self.get_documents_for_parties(question, parties, question_embeddings)
         prompts_dict = {
-            party: self.generate_prompt_for_party(question, party)
-            for party in self.parties
+            party: self.generate_prompt_for_party(question, party, docs=docs[party])
+            for party in parties
         }
         return prompts_dict
 
@@ -132,23 +444,636 @@ class RAG:
         Returns:
         response_dict: dict, dictionary containing the question, prompt, documents, and answer for each party
         """
-        response_dict = self.generate_prompts(question)
+        if self.single_flight is None:
+            return self._query(question)
 
-        # Run LLM on all prompts in parallel
-        response_ = asyncio.run(
-            self.llm.abatch(
-                [response_dict[party]["prompt"] for party in response_dict.keys()]
-            )
+        response_dict, leader = self.single_flight.do(
+            self.single_flight_key(question), lambda: self._query(question)
         )
+        if not leader:
+            self.query_stats = {"embedding_calls": 0, "coalesced": True}
+            response_dict["question"] = question
+        return response_dict
+
+    def _query(self, question):
+        """
+        Generates answers for each party given a question (see query), without coalescing.
+        """
+        self.query_stats = {"embedding_calls": 0}
+        question_embeddings = {}
 
-        # Attach response content to party dictionary
-        for i, party in enumerate(response_dict):
-            response_dict[party]["answer"] = response_[i].content
+        # Only retrieve and generate for parties without a cached answer
+        cached_responses = self._get_cached_responses(question, question_embeddings)
+        missing_parties = [p for p in self.parties if p not in cached_responses]
 
+        response_dict = {}
+        if len(missing_parties) > 0:
+            response_dict = self.generate_prompts(
+                question, question_embeddings, missing_parties
+            )
+
+            answers = {}
+            if self.generation_mode == "combined" and len(response_dict) > 1:
+                answers = self.generate_combined_answers(question, response_dict)
+                self.query_stats["combined_fallbacks"] = len(response_dict) - len(
+                    answers
+                )
+
+            # Run LLM on all (remaining) prompts in parallel, retrying and hedging each party independently
+            remaining_prompts = {
+                party: response_dict[party]["prompt"]
+                for party in response_dict
+                if party not in answers
+            }
+            if len(remaining_prompts) > 0:
+                answers.update(self.generate_answers(remaining_prompts))
+
+            # Attach response content to party dictionary
+            for party in response_dict:
+                response_dict[party]["answer"] = answers[party]
+
+            self._cache_responses(question, response_dict, question_embeddings)
+
+        response_dict = self._merge_responses(
+            question, cached_responses, response_dict
+        )
         response_dict = self.format_response(response_dict)
 
         return response_dict
 
+    def embed_questions(self, questions):
+        """
+        Embeds several questions with one batched request per distinct embedding model used by the databases.
+
+        Args:
+        questions: list of str, questions
+
+        Returns:
+        question_embeddings: list of dicts, question embedding for each source type for each question (see embed_question)
+        """
+        question_embeddings = [None] * len(questions)
+        if self.retrieval_cache is not None:
+            for i, question in enumerate(questions):
+                question_embeddings[i] = self.retrieval_cache.get_embeddings(question)
+        missing = [
+            i for i, embeddings in enumerate(question_embeddings) if embeddings is None
+        ]
+        if len(missing) == 0:
+            return question_embeddings
+
+        embeddings_by_model = {}
+        for i in missing:
+            question_embeddings[i] = {}
+        for db in self.databases:
+            model_key = id(db.embedding_model)
+            if model_key not in embeddings_by_model:
+                embeddings_by_model[model_key] = db.embedding_model.embed_documents(
+                    [questions[i] for i in missing]
+                )
+                self._count("embedding_calls")
+            for i, embedding in zip(missing, embeddings_by_model[model_key]):
+                question_embeddings[i][db.source_type] = embedding
+
+        if self.retrieval_cache is not None:
+            for i in missing:
+                self.retrieval_cache.put_embeddings(
+                    questions[i], question_embeddings[i]
+                )
+        return question_embeddings
+
+    def query_many(self, questions, session_ids=None):
+        """
+        Generates answers for each party for several questions.
+
+        All questions are embedded in one batched request per embedding model, the retrieval of all
+        (question, party, source) combinations runs concurrently and all party prompts are sent through
+        one LLM pipeline with at most max_concurrency prompts in flight (or through the scheduler).
+        Duplicate questions (after normalization) are only answered once. Answers are always generated
+        per party (see generation_mode).
+
+        Args:
+        questions: list of str, questions
+        session_ids: list, optional, session under which the LLM requests of each question are scheduled (default is session_id)
+
+        Returns:
+        responses: list of dicts, formatted response for each question (see query)
+        """
+        self.query_stats = {"embedding_calls": 0}
+        if session_ids is None:
+            session_ids = [self.session_id] * len(questions)
+
+        # Answer each distinct question once (under the session that asked it first)
+        distinct = {}
+        for question, session_id in zip(questions, session_ids):
+            distinct.setdefault(normalize_question(question), (question, session_id))
+        distinct_questions = [question for question, _ in distinct.values()]
+        distinct_session_ids = [session_id for _, session_id in distinct.values()]
+
+        question_embeddings = self.embed_questions(distinct_questions)
+        cached_responses = [
+            self._get_cached_responses(question, embeddings)
+            for question, embeddings in zip(distinct_questions, question_embeddings)
+        ]
+
+        def retrieve(i):
+            missing_parties = [p for p in self.parties if p not in cached_responses[i]]
+            if len(missing_parties) == 0:
+                return {}
+            return self.get_documents_for_parties(
+                distinct_questions[i], missing_parties, question_embeddings[i]
+            )
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            docs = list(executor.map(retrieve, range(len(distinct_questions))))
+
+        # Prompts of all questions, keyed by (question index, party)
+        response_dicts = [{} for _ in distinct_questions]
+        prompts = {}
+        prompt_tokens = {}
+        prompt_session_ids = {}
+        for i, question in enumerate(distinct_questions):
+            for party in docs[i]:
+                response_dicts[i][party] = self.generate_prompt_for_party(
+                    question, party, docs=docs[i][party]
+                )
+                prompts[(i, party)] = response_dicts[i][party]["prompt"]
+                prompt_session_ids[(i, party)] = distinct_session_ids[i]
+                prompt_tokens[(i, party)] = self.query_stats["prompt_tokens"][party]
+        self.query_stats["prompt_tokens"] = sum(prompt_tokens.values())
+
+        max_tokens = getattr(self.llm, "max_tokens", None) or 0
+        tokens = {key: n + max_tokens for key, n in prompt_tokens.items()}
+
+        if len(prompts) > 0:
+            answers = self.generate_answers(
+                prompts,
+                tokens=tokens,
+                max_concurrency=self.max_concurrency,
+                session_ids=prompt_session_ids,
+            )
+            for (i, party), answer in answers.items():
+                response_dicts[i][party]["answer"] = answer
+
+        responses = {}
+        for i, question in enumerate(distinct_questions):
+            if len(response_dicts[i]) > 0:
+                self._cache_responses(
+                    question, response_dicts[i], question_embeddings[i]
+                )
+            responses[normalize_question(question)] = self.format_response(
+                self._merge_responses(question, cached_responses[i], response_dicts[i])
+            )
+
+        return [
+            dict(responses[normalize_question(question)], question=question)
+            for question in questions
+        ]
+
+    def generate_combined_answers(self, question, response_dict):
+        """
+        Generates the answers of several parties with a single completion that returns a JSON object.
+
+        The parties are labeled neutrally (PARTEI_1, PARTEI_2, ...) in the prompt, so their names do not leak into the answers.
+
+        Args:
+        question: str, question
+        response_dict: dict, dictionary containing the question, prompt, and documents for each party (see generate_prompts)
+
+        Returns:
+        answers: dict, answer for each party that could be parsed from the output (empty if the completion failed);
+            the "prompt" of these parties in response_dict is replaced by the combined prompt
+        """
+        labels = {f"PARTEI_{i + 1}": party for i, party in enumerate(response_dict)}
+        contexts = "".join(
+            f"KONTEXT {label}:\n"
+            + self.build_context_from_docs(response_dict[party]["docs"])
+            for label, party in labels.items()
+        )
+        prompt = COMBINED_PROMPT_TEMPLATE.format(
+            labels=", ".join(labels),
+            language=self.language,
+            contexts=contexts,
+            question=question,
+        )
+        prompt_tokens = self._count_prompt_tokens(prompt)
+        self.query_stats.setdefault("prompt_tokens", {})["combined"] = prompt_tokens
+
+        # The combined answer needs room for the answers of all parties
+        llm = self.llm
+        max_tokens = getattr(self.llm, "max_tokens", None)
+        if max_tokens:
+            llm = self.llm.bind(max_tokens=max_tokens * len(labels))
+        try:
+            if self.scheduler is None:
+                message = llm.invoke(prompt)
+            else:
+                message = self.scheduler.invoke(
+                    llm,
+                    prompt,
+                    session_id=self.session_id,
+                    tokens=prompt_tokens + (max_tokens or 0) * len(labels),
+                )
+        except Exception as e:
+            print(
+                f"Combined generation failed, falling back to per-party generation: {e}"
+            )
+            return {}
+
+        answers = parse_json_answers(message.content)
+        answers = {
+            labels[label]: answer
+            for label, answer in answers.items()
+            if label in labels
+        }
+        # Keep the prompt that actually produced the answers
+        for party in answers:
+            response_dict[party]["prompt"] = prompt
+        return answers
+
+    def generate_answers(
+        self, prompts, tokens=None, max_concurrency=None, session_ids=None
+    ):
+        """
+        Generates the answers to the prompts of several parties in parallel.
+
+        Each party is tracked independently: a failed completion is retried (up to max_retries times)
+        without discarding the answers of the other parties. If hedge_percentile is set, a duplicate
+        request is sent for a party whose completion takes longer than that percentile of recent
+        latencies, and whichever request finishes first is used.
+
+        Args:
+        prompts: dict, prompt for each party (any hashable key can be used instead of the party)
+        tokens: dict, optional, estimated tokens of the request for each party (see _request_tokens)
+        max_concurrency: int, optional, maximum number of prompts in flight (all at once if None)
+        session_ids: dict, optional, session under which the requests of each party are scheduled (default is session_id)
+
+        Returns:
+        answers: dict, answer for each party
+        """
+        self.query_stats.update({"llm_retries": 0, "hedged_requests": 0})
+        answers = {}
+        attempts = {party: 0 for party in prompts}
+        # Parties waiting for a free slot (popped from the end), retries are pushed to the end
+        waiting = list(prompts)[::-1]
+        waiting_hedges = []
+        started = {}
+        hedged = set()
+        # future -> (party, submission time)
+        pending = {}
+        # Cancelled requests that are still running (they hold a slot until they finish)
+        abandoned = set()
+
+        executor = None
+        if self.scheduler is None:
+            executor = ThreadPoolExecutor(
+                max_workers=2 * min(len(prompts), max_concurrency or len(prompts))
+            )
+
+        def submit(party):
+            request_tokens = (
+                self._request_tokens(party) if tokens is None else tokens[party]
+            )
+            if self.scheduler is None:
+                # Run in a copy of the current context, so callbacks (e.g. token counting) see the request
+                future = executor.submit(
+                    contextvars.copy_context().run, self.llm.invoke, prompts[party]
+                )
+            else:
+                future = self.scheduler.submit(
+                    self.llm,
+                    prompts[party],
+                    session_id=(
+                        self.session_id if session_ids is None else session_ids[party]
+                    ),
+                    tokens=request_tokens,
+                )
+            pending[future] = (party, time.perf_counter())
+
+        def submit_waiting():
+            # Retries and hedged requests count against max_concurrency like first requests
+            while (
+                max_concurrency is None
+                or len(pending) + len(abandoned) < max_concurrency
+            ):
+                if len(waiting) > 0:
+                    party = waiting.pop()
+                    started[party] = time.perf_counter()
+                    submit(party)
+                elif len(waiting_hedges) > 0:
+                    party = waiting_hedges.pop(0)
+                    if party not in answers:
+                        submit(party)
+                else:
+                    break
+
+        def cancel(party):
+            for future, (future_party, _) in list(pending.items()):
+                if future_party == party:
+                    if not future.cancel():
+                        abandoned.add(future)
+                    del pending[future]
+
+        try:
+            while len(answers) < len(prompts):
+                submit_waiting()
+                hedge_after = None
+                if self.hedge_percentile is not None:
+                    hedge_after = self.latency_tracker.percentile(self.hedge_percentile)
+                timeout = None
+                if hedge_after is not None:
+                    deadlines = [
+                        started[party] + hedge_after
+                        for party in started
+                        if party not in answers and party not in hedged
+                    ]
+                    if len(deadlines) > 0:
+                        timeout = max(0.0, min(deadlines) - time.perf_counter())
+
+                done, _ = wait(
+                    list(pending) + list(abandoned),
+                    timeout=timeout,
+                    return_when=FIRST_COMPLETED,
+                )
+                for future in done:
+                    if future in abandoned:
+                        abandoned.discard(future)
+                        continue
+                    party, submitted = pending.pop(future)
+                    try:
+                        answers[party] = future.result().content
+                    except Exception as e:
+                        if any(p == party for p, _ in pending.values()):
+                            # A hedged request of the party is still running
+                            continue
+                        attempts[party] += 1
+                        if attempts[party] > self.max_retries:
+                            raise e
+                        print(f"Retrying the answer for {party} after error: {e}")
+                        self.query_stats["llm_retries"] += 1
+                        waiting.append(party)
+                        continue
+                    self.latency_tracker.record(time.perf_counter() - submitted)
+                    cancel(party)
+
+                if hedge_after is not None:
+                    for party in list(started):
+                        if (
+                            party not in answers
+                            and party not in hedged
+                            and party not in waiting
+                            and time.perf_counter() - started[party] >= hedge_after
+                        ):
+                            hedged.add(party)
+                            self.query_stats["hedged_requests"] += 1
+                            waiting_hedges.append(party)
+        finally:
+            for future in pending:
+                future.cancel()
+            if executor is not None:
+                executor.shutdown(wait=False)
+
+        return answers
+
+    def stream_query(self, question):
+        """
+        Generates answers for each party given a question and yields them as they arrive.
+
+        All party completions are streamed in parallel, so the first answers are available
+        long before the slowest party has finished. Cached answers are yielded first.
+
+        Args:
+        question: str, question
+
+        Yields:
+        event: tuple (event_type, party, content), where event_type is
+            "token" (content: next text chunk of the party's answer),
+            "answer" (content: complete answer of the party),
+            "error" (content: exception that ended the party's stream; its answer is then generated
+            again without streaming and sent as "answer", the answers of the other parties are kept) or
+            "response" (sent last, party is None, content: formatted response dict as returned by query)
+        """
+        if self.single_flight is None:
+            yield from self._stream_query(question)
+            return
+
+        key = self.single_flight_key(question)
+        call, leader = self.single_flight.join(key)
+        if not leader:
+            # An identical query is already running: wait for its complete response
+            response_dict = call.wait()
+            self.query_stats = {"embedding_calls": 0, "coalesced": True}
+            response_dict["question"] = question
+            for party, answer in response_dict["answer"].items():
+                yield "answer", party, answer
+            yield "response", None, response_dict
+            return
+
+        try:
+            for event_type, party, content in self._stream_query(question):
+                if event_type == "response":
+                    self.single_flight.finish(key, call, result=content)
+                yield event_type, party, content
+        except GeneratorExit:
+            # Closing the stream is not an error of the query, the followers are released below
+            raise
+        except BaseException as e:
+            self.single_flight.finish(key, call, error=e)
+            raise
+        finally:
+            # The stream was closed before the response (e.g. the session ended)
+            self.single_flight.finish(
+                key, call, error=RuntimeError("Coalesced query was aborted")
+            )
+
+    def _stream_query(self, question):
+        """
+        Generates answers for each party given a question and yields them as they arrive (see stream_query), without coalescing.
+        """
+        self.query_stats = {"embedding_calls": 0}
+        question_embeddings = {}
+
+        cached_responses = self._get_cached_responses(question, question_embeddings)
+        for party, party_response in cached_responses.items():
+            yield "answer", party, party_response["answer"]
+        missing_parties = [p for p in self.parties if p not in cached_responses]
+
+        response_dict = {}
+        if len(missing_parties) > 0:
+            response_dict = self.generate_prompts(
+                question, question_embeddings, missing_parties
+            )
+            events = queue.Queue()
+
+            def stream_answer(party):
+                prompt = response_dict[party]["prompt"]
+                for attempt in range(self.max_retries + 1):
+                    chunks = []
+                    try:
+                        if self.scheduler is None:
+                            stream = self.llm.stream(prompt)
+                        else:
+                            stream = self.scheduler.stream(
+                                self.llm,
+                                prompt,
+                                session_id=self.session_id,
+                                tokens=self._request_tokens(party),
+                            )
+                        for chunk in stream:
+                            chunks.append(chunk.content)
+                            events.put(("token", party, chunk.content))
+                        events.put(("answer", party, "".join(chunks)))
+                        return
+                    except Exception as e:
+                        # Streamed tokens cannot be taken back, so only retry before the first token
+                        if len(chunks) > 0 or attempt == self.max_retries:
+                            events.put(("error", party, e))
+                            return
+                        print(f"Retrying the answer for {party} after error: {e}")
+
+            with ThreadPoolExecutor(max_workers=len(response_dict)) as executor:
+                for party in response_dict:
+                    executor.submit(stream_answer, party)
+
+                failed = []
+                remaining = len(response_dict)
+                while remaining > 0:
+                    event_type, party, content = events.get()
+                    if event_type == "error":
+                        failed.append(party)
+                        remaining -= 1
+                    elif event_type == "answer":
+                        response_dict[party]["answer"] = content
+                        remaining -= 1
+                    yield event_type, party, content
+
+            # Cache the completed answers first, so they are kept even if the failed ones fail again
+            completed = {p: r for p, r in response_dict.items() if p not in failed}
+            if len(completed) > 0:
+                self._cache_responses(question, completed, question_embeddings)
+            if len(failed) > 0:
+                print(
+                    f"Generating the answers of {', '.join(failed)} without streaming"
+                )
+                answers = self.generate_answers(
+                    {party: response_dict[party]["prompt"] for party in failed},
+                    max_concurrency=self.max_concurrency,
+                )
+                for party in failed:
+                    response_dict[party]["answer"] = answers[party]
+                    yield "answer", party, answers[party]
+                self._cache_responses(
+                    question,
+                    {party: response_dict[party] for party in failed},
+                    question_embeddings,
+                )
+
+        response_dict = self._merge_responses(
+            question, cached_responses, response_dict
+        )
+        yield "response", None, self.format_response(response_dict)
+
+    def _count_prompt_tokens(self, prompt):
+        """
+        Counts the tokens of a prompt with the model's tokenizer; query_stats["prompt_tokens_estimated"]
+        is True if the tokenizer was not available and the count is approximated.
+        """
+        tokens = self.context_builder.count_tokens(prompt)
+        self.query_stats["prompt_tokens_estimated"] = self.context_builder.approximate
+        return tokens
+
+    def _request_tokens(self, party):
+        """
+        Estimates the tokens of the LLM request for a party (prompt tokens and maximum completion tokens).
+        """
+        max_tokens = getattr(self.llm, "max_tokens", None) or 0
+        return self.query_stats.get("prompt_tokens", {}).get(party, 0) + max_tokens
+
+    def single_flight_key(self, question):
+        """
+        Returns the key under which identical concurrent queries are coalesced (normalized question, parties and settings).
+        """
+        return (
+            normalize_question(question),
+            tuple(sorted(self.parties)),
+            self.cache_settings(),
+        )
+
+    def cache_settings(self):
+        """
+        Returns the query settings that a cached answer has to match (language, model, retrieval and generation
+        settings and context token budget).
+        """
+        model_name = getattr(self.llm, "model_name", type(self.llm).__name__)
+        return (
+            self.language,
+            model_name,
+            self.k,
+            self.fetch_k,
+            self.retrieval_mode,
+            self.lexical_fast_path,
+            self.generation_mode,
+            self.context_builder.max_tokens,
+        )
+
+    def _get_cached_responses(self, question, question_embeddings):
+        """
+        Looks up the answers of all parties in the response cache.
+        The question is only embedded if needed; the embeddings are stored in question_embeddings for reuse.
+        """
+        if self.cache is None:
+            return {}
+
+        def embed():
+            # query_many passes the batched embeddings of the question
+            source_type = self.databases[0].source_type
+            if source_type not in question_embeddings:
+                question_embeddings.update(self.embed_question(question))
+            return question_embeddings[source_type]
+
+        # Single-keyword questions are searched lexically, so a near-duplicate lookup
+        # must not embed them; embeddings passed by query_many are still used
+        embed_fn = embed
+        if (
+            self.lexical_fast_path
+            and is_single_keyword(question)
+            and self.databases[0].source_type not in question_embeddings
+        ):
+            embed_fn = None
+        return self.cache.get(question, self.parties, self.cache_settings(), embed_fn)
+
+    def _count(self, stat, n=1):
+        """
+        Increments a counter of query_stats (thread-safe).
+        """
+        with self._stats_lock:
+            self.query_stats[stat] = self.query_stats.get(stat, 0) + n
+
+    def _cache_responses(self, question, response_dict, question_embeddings):
+        """
+        Adds the party answers of a response dictionary to the response cache, if there is one.
+        """
+        if self.cache is None:
+            return
+        self.cache.put(
+            question,
+            self.cache_settings(),
+            response_dict,
+            question_embeddings.get(self.databases[0].source_type),
+        )
+
+    def _merge_responses(self, question, cached_responses, response_dict):
+        """
+        Merges cached and newly generated party responses in the order of self.parties.
+        """
+        merged = {}
+        for party in self.parties:
+            if party in response_dict:
+                merged[party] = response_dict[party]
+            else:
+                # Cached answers may come from a near-duplicate question
+                merged[party] = dict(cached_responses[party], question=question)
+        return merged
+
     def format_response(self, response):
         """
         Formats the response dictionary for simpler use in the app.
@@ -0,0 +1,436 @@
+from collections import OrderedDict
+from langchain_core.documents import Document
+import numpy as np
+import json
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+# Increase whenever the layout of the cache entries changes, older cache tables are then ignored
+CACHE_FORMAT_VERSION = 4
+
+
+def normalize_question(question):
+    """
+    Normalizes a question for use as cache key (unicode form, case, punctuation and whitespace).
+
+    Args:
+    question: str, question
+
+    Returns:
+    normalized_question: str, normalized question
+    """
+    question = unicodedata.normalize("NFKC", question).lower()
+    question = re.sub(r"[^\w\s]", " ", question)
+    return " ".join(question.split())
+
+
+def _to_json(value):
+    """
+    JSON encoder hook for the values of cache entries (documents and NumPy values).
+    """
+    if isinstance(value, Document):
+        return {
+            "__document__": True,
+            "page_content": value.page_content,
+            "metadata": value.metadata,
+        }
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} cannot be stored in the response cache")
+
+
+def _from_json(value):
+    if value.get("__document__"):
+        return Document(page_content=value["page_content"], metadata=value["metadata"])
+    return value
+
+
+def entry_to_json(key, entry):
+    """
+    Serializes a response cache entry (key and {"response", "embedding", "created"}) to JSON.
+    """
+    return json.dumps(
+        {"key": key, **entry}, default=_to_json, ensure_ascii=False, allow_nan=False
+    )
+
+
+def entry_from_json(data):
+    """
+    Restores a response cache entry serialized by entry_to_json and returns (key, entry).
+    """
+    entry = json.loads(data, object_hook=_from_json)
+    question, party, settings = entry.pop("key")
+    if entry["embedding"] is not None:
+        entry["embedding"] = np.asarray(entry["embedding"], dtype=np.float32)
+    return (question, party, tuple(settings)), entry
+
+
+class ResponseCache:
+    """
+    Cache for RAG answers with near-duplicate matching of questions.
+
+    Entries are stored per party and keyed on the normalized question, the party and the query settings
+    (see RAG.cache_settings), so a changed party selection only requires generating the missing parties.
+    Questions without an exact match are compared to the cached questions with the same settings
+    via the cosine similarity of their embeddings.
+
+    New entries are written to an SQLite file by a background thread, so queries never wait for the disk.
+    Each entry is its own row (stored as JSON), so several processes can share the file without overwriting
+    each other's entries (entries written by other processes are loaded on the next start).
+
+    Args:
+    path: str, optional, SQLite file in which the cache is persisted (the cache only lives in memory if None)
+    max_size: int, maximum number of cached party answers, least recently used answers are evicted first, default is 3000
+    ttl: float, optional, time to live of a cached answer in seconds (no expiry if None), default is 7 days
+    similarity_threshold: float, minimum cosine similarity of two question embeddings to count as near-duplicates
+        (only exact matches if None), default is 0.95
+    """
+
+    def __init__(
+        self, path=None, max_size=3000, ttl=7 * 24 * 3600, similarity_threshold=0.95
+    ):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+        # (question, party, settings) -> {"response": dict, "embedding": np.ndarray or None, "created": float}
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+        # Entries waiting to be written by the background writer
+        self._writes = queue.Queue()
+        self._writer = None
+
+        if self.path is not None and os.path.exists(self.path):
+            self.load()
+
+    def get(self, question, parties, settings, embed_fn=None):
+        """
+        Looks up the cached answers of several parties for a question.
+
+        Args:
+        question: str, question
+        parties: list of str, party names
+        settings: tuple, hashable query settings (e.g. language, model and k)
+        embed_fn: callable, optional, returns the question embedding. Only called if some parties have no exact match.
+
+        Returns:
+        party_responses: dict, cached response (question, prompt, docs and answer) for each party that was found
+        """
+        normalized_question = normalize_question(question)
+        party_responses = {}
+        with self._lock:
+            self._evict_expired()
+
+            for party in parties:
+                key = (normalized_question, party, settings)
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    party_responses[party] = self._entries[key]["response"]
+            self.hits += len(party_responses)
+
+            missing = [party for party in parties if party not in party_responses]
+            candidate_questions = {
+                key[0]: entry["embedding"]
+                for key, entry in self._entries.items()
+                if key[2] == settings
+                and key[1] in missing
+                and entry["embedding"] is not None
+            }
+
+        if (
+            embed_fn is not None
+            and self.similarity_threshold is not None
+            and len(candidate_questions) > 0
+        ):
+            embedding = self._normalize_embedding(embed_fn())
+            candidates = list(candidate_questions.keys())
+            similarities = np.stack(list(candidate_questions.values())) @ embedding
+
+            # Fill the missing parties from the most similar near-duplicate questions first
+            with self._lock:
+                for i in np.argsort(-similarities):
+                    if similarities[i] < self.similarity_threshold:
+                        break
+                    for party in missing:
+                        key = (candidates[i], party, settings)
+                        if party not in party_responses and key in self._entries:
+                            self._entries.move_to_end(key)
+                            party_responses[party] = self._entries[key]["response"]
+                            self.semantic_hits += 1
+
+        with self._lock:
+            self.misses += len(parties) - len(party_responses)
+        return party_responses
+
+    def put(self, question, settings, party_responses, question_embedding=None):
+        """
+        Adds party answers to the cache and queues them for persisting if a path is set.
+
+        Args:
+        question: str, question
+        settings: tuple, hashable query settings (e.g. language, model and k)
+        party_responses: dict, response (question, prompt, docs and answer) for each party
+        question_embedding: list of float, optional, question embedding used for near-duplicate matching
+        """
+        normalized_question = normalize_question(question)
+        if question_embedding is not None:
+            question_embedding = self._normalize_embedding(question_embedding)
+
+        new_entries = []
+        with self._lock:
+            for party, party_response in party_responses.items():
+                key = (normalized_question, party, settings)
+                self._entries[key] = {
+                    "response": party_response,
+                    "embedding": question_embedding,
+                    "created": time.time(),
+                }
+                self._entries.move_to_end(key)
+                new_entries.append((key, self._entries[key]))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+        if self.path is not None and len(new_entries) > 0:
+            self._start_writer()
+            self._writes.put(new_entries)
+
+    def flush(self):
+        """
+        Waits until all queued entries are written to the cache file.
+        """
+        if self._writer is not None:
+            self._writes.join()
+
+    def load(self):
+        """
+        Loads the newest entries from the cache file, dropping expired entries.
+        """
+        try:
+            connection = sqlite3.connect(self.path)
+            try:
+                rows = connection.execute(
+                    f"SELECT entry FROM {self._table} ORDER BY created"
+                ).fetchall()
+            finally:
+                connection.close()
+        except sqlite3.Error as e:
+            print(f"Could not load response cache from {self.path}: {e}")
+            return
+
+        entries = OrderedDict()
+        for (data,) in rows:
+            try:
+                key, entry = entry_from_json(data)
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"Skipping unreadable response cache entry: {e}")
+                continue
+            entries[key] = entry
+
+        with self._lock:
+            self._entries = entries
+            self._evict_expired()
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        print(f"loaded response cache with {len(self._entries)} entries")
+
+    @property
+    def _table(self):
+        # Tables of older formats are ignored
+        return f"entries_v{CACHE_FORMAT_VERSION}"
+
+    def _start_writer(self):
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._write_entries,
+                    name="response-cache-writer",
+                    daemon=True,
+                )
+                self._writer.start()
+
+    def _write_entries(self):
+        """
+        Writes queued entries to the cache file (runs in the background writer thread).
+        """
+        connection = None
+        while True:
+            new_entries = self._writes.get()
+            try:
+                if connection is None:
+                    connection = self._connect()
+                if connection is not None:
+                    self._write(connection, new_entries)
+            except Exception as e:
+                # Any error only loses these entries, the writer keeps running
+                print(f"Could not persist response cache to {self.path}: {e}")
+            finally:
+                self._writes.task_done()
+
+    def _connect(self):
+        try:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {self._table} "
+                "(key TEXT PRIMARY KEY, created REAL, entry TEXT)"
+            )
+            connection.commit()
+            return connection
+        except (OSError, sqlite3.Error) as e:
+            print(f"Could not persist response cache to {self.path}: {e}")
+            # Keep the cache in memory only instead of failing on every write
+            self.path = None
+            return None
+
+    def _write(self, connection, new_entries):
+        rows = []
+        for key, entry in new_entries:
+            try:
+                data = entry_to_json(key, entry)
+            except (TypeError, ValueError) as e:
+                print(f"Skipping response cache entry that cannot be stored: {e}")
+                continue
+            rows.append((json.dumps(key, default=str), entry["created"], data))
+        with connection:
+            connection.executemany(
+                f"INSERT OR REPLACE INTO {self._table} VALUES (?, ?, ?)", rows
+            )
+            # Keep the file bounded: drop expired entries and all but the newest max_size entries
+            if self.ttl is not None:
+                connection.execute(
+                    f"DELETE FROM {self._table} WHERE created < ?",
+                    (time.time() - self.ttl,),
+                )
+            connection.execute(
+                f"DELETE FROM {self._table} WHERE key NOT IN "
+                f"(SELECT key FROM {self._table} ORDER BY created DESC LIMIT ?)",
+                (self.max_size,),
+            )
+
+    def clear(self):
+        """
+        Removes all entries and resets the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.semantic_hits = 0
+            self.misses = 0
+
+    @property
+    def stats(self):
+        """
+        Hit and miss counters of the cache.
+        """
+        return {
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+        }
+
+    def _evict_expired(self):
+        if self.ttl is None:
+            return
+        now = time.time()
+        expired = [
+            key
+            for key, entry in self._entries.items()
+            if now - entry["created"] > self.ttl
+        ]
+        for key in expired:
+            del self._entries[key]
+
+    @staticmethod
+    def _normalize_embedding(embedding):
+        embedding = np.asarray(embedding, dtype=np.float32)
+        return embedding / max(np.linalg.norm(embedding), 1e-12)
+
+
+class RetrievalCache:
+    """
+    In-memory cache for retrieval results and question embeddings.
+
+    Retrieval results do not depend on the answer language, so switching the language only requires new LLM calls.
+    Entries store chunk IDs, which are resolved to documents by the VectorDatabase.
+
+    Args:
+    max_size: int, maximum number of cached searches (and, separately, question embeddings), default is 20000
+    """
+
+    def __init__(self, max_size=20000):
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+
+        # (question, party, source_type, k, fetch_k, mode) -> list of chunk IDs
+        self._ids = OrderedDict()
+        # question -> {source_type: embedding}
+        self._embeddings = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, question, party, source_type, k, fetch_k, mode="dense"):
+        """
+        Returns the cached chunk IDs of a search, or None if the search is not cached.
+        """
+        key = (normalize_question(question), party, source_type, k, fetch_k, mode)
+        with self._lock:
+            if key in self._ids:
+                self._ids.move_to_end(key)
+                self.hits += 1
+                return self._ids[key]
+            self.misses += 1
+            return None
+
+    def put(self, question, party, source_type, k, fetch_k, ids, mode="dense"):
+        """
+        Adds the chunk IDs of a search to the cache.
+        """
+        key = (normalize_question(question), party, source_type, k, fetch_k, mode)
+        with self._lock:
+            self._ids[key] = list(ids)
+            self._ids.move_to_end(key)
+            while len(self._ids) > self.max_size:
+                self._ids.popitem(last=False)
+
+    def get_embeddings(self, question):
+        """
+        Returns the cached question embedding for each source type, or None if the question is not cached.
+        """
+        key = normalize_question(question)
+        with self._lock:
+            if key in self._embeddings:
+                self._embeddings.move_to_end(key)
+                return self._embeddings[key]
+            return None
+
+    def put_embeddings(self, question, question_embeddings):
+        """
+        Adds the question embedding for each source type to the cache.
+        """
+        key = normalize_question(question)
+        with self._lock:
+            self._embeddings[key] = dict(question_embeddings)
+            self._embeddings.move_to_end(key)
+            while len(self._embeddings) > self.max_size:
+                self._embeddings.popitem(last=False)
+
+    @property
+    def stats(self):
+        """
+        Hit and miss counters of the cache.
+        """
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._ids)}
@@ -0,0 +1,210 @@
+import tiktoken
+
+# Average number of characters per token, used when the tokenizer is not available
+CHARS_PER_TOKEN = 4
+
+CONTEXT_HEADERS = {
+    "manifestos": "Ausschnitte aus den Wahlprogrammen zur Europawahl 2024:\n",
+    "debates": "Ausschnitte aus vergangenen Reden im Europaparlament im Zeitraum 2019-2024:\n\n",
+}
+
+
+def remove_overlap(previous_text, text, min_overlap=20, max_overlap=400):
+    """
+    Removes the beginning of text if it repeats the end of previous_text (e.g. the chunk_overlap of adjacent chunks).
+
+    Args:
+    previous_text: str, text that comes first
+    text: str, text whose repeated beginning is removed
+    min_overlap: int, minimum number of overlapping characters to remove, default is 20
+    max_overlap: int, maximum number of overlapping characters that are searched for, default is 400
+
+    Returns:
+    text: str, text without the repeated beginning
+    """
+    if len(text) < min_overlap:
+        return text
+    probe = text[:min_overlap]
+    start = max(0, len(previous_text) - max_overlap)
+    position = previous_text.find(probe, start)
+    while position != -1:
+        overlap = len(previous_text) - position
+        if text[:overlap] == previous_text[position:]:
+            return text[overlap:].lstrip()
+        position = previous_text.find(probe, position + 1)
+    return text
+
+
+def remove_trailing_overlap(text, next_text, min_overlap=20, max_overlap=400):
+    """
+    Removes the end of text if it repeats the beginning of next_text (a chunk that follows text in the document
+    but was retrieved first).
+
+    Args:
+    text: str, text whose repeated end is removed
+    next_text: str, text that comes next in the document
+    min_overlap: int, minimum number of overlapping characters to remove, default is 20
+    max_overlap: int, maximum number of overlapping characters that are searched for, default is 400
+
+    Returns:
+    text: str, text without the repeated end
+    """
+    if len(next_text) < min_overlap:
+        return text
+    probe = next_text[:min_overlap]
+    position = text.find(probe, max(0, len(text) - max_overlap))
+    while position != -1:
+        if next_text.startswith(text[position:]):
+            return text[:position].rstrip()
+        position = text.find(probe, position + 1)
+    return text
+
+
+class ApproximateEncoding:
+    """
+    Stand-in for a tiktoken encoding that treats every CHARS_PER_TOKEN characters as one token.
+    """
+
+    def encode(self, text):
+        return [
+            text[i : i + CHARS_PER_TOKEN] for i in range(0, len(text), CHARS_PER_TOKEN)
+        ]
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+
+class ContextBuilder:
+    """
+    Builds the context of a prompt from retrieved documents within a token budget.
+
+    Overlapping text between chunks of the same source (from the chunk_overlap of the text splitter, in
+    either order, as chunks arrive by relevance) and chunks that are already contained in another chunk
+    are removed. If the budget is exceeded,
+    chunks are taken alternately from each source in order of their rank and the last one is truncated.
+
+    Args:
+    max_tokens: int, optional, token budget of the context per party (no limit if None)
+    model_name: str, model whose tokenizer is used to count tokens, default is "gpt-3.5-turbo"
+    min_overlap: int, minimum number of overlapping characters between chunks that are removed, default is 20
+    min_chunk_tokens: int, minimum number of tokens a truncated chunk must keep to be included, default is 50
+    """
+
+    def __init__(
+        self,
+        max_tokens=None,
+        model_name="gpt-3.5-turbo",
+        min_overlap=20,
+        min_chunk_tokens=50,
+    ):
+        self.max_tokens = max_tokens
+        self.model_name = model_name
+        self.min_overlap = min_overlap
+        self.min_chunk_tokens = min_chunk_tokens
+        self._encoding = None
+
+    @property
+    def encoding(self):
+        """
+        Tokenizer of the model, loaded on first use.
+
+        tiktoken downloads the tokenizer files on first use (unless they are in TIKTOKEN_CACHE_DIR),
+        if that fails tokens are approximated by ApproximateEncoding.
+        """
+        if self._encoding is None:
+            try:
+                try:
+                    self._encoding = tiktoken.encoding_for_model(self.model_name)
+                except KeyError:
+                    # Models unknown to tiktoken (e.g. not from OpenAI) are approximated with cl100k_base
+                    self._encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                print(f"Could not load tokenizer, approximating token counts: {e}")
+                self._encoding = ApproximateEncoding()
+        return self._encoding
+
+    def count_tokens(self, text):
+        """
+        Returns the number of tokens of a text.
+        """
+        return len(self.encoding.encode(text))
+
+    @property
+    def approximate(self):
+        """
+        True if token counts are approximated because the tokenizer could not be loaded.
+        """
+        return isinstance(self.encoding, ApproximateEncoding)
+
+    def build(self, docs):
+        """
+        Builds the context string from documents.
+
+        Args:
+        docs: dict, dictionary of documents for each source type ("manifestos" and "debates")
+
+        Returns:
+        context: str, context string (formatted and human-readable excerpts from documents)
+        """
+        texts = {
+            source_type: self._deduplicate([doc.page_content for doc in documents])
+            for source_type, documents in docs.items()
+        }
+
+        if self.max_tokens is not None:
+            texts = self._fit_budget(texts)
+
+        context = ""
+        for source_type, source_texts in texts.items():
+            context += (
+                CONTEXT_HEADERS.get(source_type, "")
+                + "\n\n".join(source_texts)
+                + "\n\n"
+            )
+        return context
+
+    def _deduplicate(self, texts):
+        """
+        Drops texts contained in an earlier text and removes overlaps with earlier texts.
+        """
+        kept = []
+        for text in texts:
+            if any(text in previous for previous in kept):
+                continue
+            for previous in kept:
+                text = remove_overlap(previous, text, min_overlap=self.min_overlap)
+                # Retrieval returns chunks by relevance, so text may also precede an earlier chunk
+                text = remove_trailing_overlap(
+                    text, previous, min_overlap=self.min_overlap
+                )
+            if len(text) > 0:
+                kept.append(text)
+        return kept
+
+    def _fit_budget(self, texts):
+        """
+        Selects texts alternately from each source (by rank) until the token budget is used up.
+        """
+        budget = self.max_tokens - sum(
+            self.count_tokens(CONTEXT_HEADERS.get(source_type, "") + "\n\n")
+            for source_type in texts
+        )
+        selected = {source_type: [] for source_type in texts}
+
+        max_rank = max([len(source_texts) for source_texts in texts.values()] + [0])
+        for rank in range(max_rank):
+            for source_type, source_texts in texts.items():
+                if rank >= len(source_texts) or budget <= 0:
+                    continue
+                tokens = self.encoding.encode(source_texts[rank])
+                if len(tokens) + 2 <= budget:
+                    selected[source_type].append(source_texts[rank])
+                    budget -= len(tokens) + 2
+                elif budget - 2 >= self.min_chunk_tokens:
+                    selected[source_type].append(
+                        self.encoding.decode(tokens[: budget - 2]).rstrip() + " ..."
+                    )
+                    budget = 0
+                else:
+                    budget = 0
+        return selected
@@ -16,181 +16,140 @@ def mean_pooling(model_output, attention_mask):
     )
 
 
-class ManifestoBertaEmbeddings(Embeddings):
-    """Embeddings using ManifestoBerta for use with LangChain."""
-
-    def __init__(self):
+def length_sorted_batches(lengths, batch_size):
+    """
+    Groups indices into batches of similar lengths to minimise padding.
+
+    Args:
+    lengths: list of int, token length of each text
+    batch_size: int, maximum number of texts per batch
+
+    Returns:
+    batches: list of lists of int, indices of the texts in each batch (longest texts first)
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    return [order[i : i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+class BatchedTransformerEmbeddings(Embeddings):
+    """Batched embeddings with a Hugging Face model and masked mean pooling.
+
+    The texts are tokenized once, grouped into batches of similar token length, padded per batch and
+    embedded with one forward pass per batch. The embeddings are returned in the order of the texts.
+
+    Args:
+        model_name: Name of the tokenizer and model on the Hugging Face Hub.
+        batch_size: Maximum number of texts per forward pass.
+        max_length: Maximum number of tokens per text (None for the model's maximum).
+        normalize: Whether to L2-normalize the embeddings.
+        model_kwargs: Keyword arguments passed to AutoModel.from_pretrained.
+    """
+
+    def __init__(
+        self,
+        model_name,
+        batch_size=32,
+        max_length=512,
+        normalize=False,
+        model_kwargs=None,
+    ):
         # Load the tokenizer and model
-        self.tokenizer = AutoTokenizer.from_pretrained(
-            "manifesto-project/manifestoberta-xlm-roberta-56policy-topics-sentence-2023-1-1"
-        )
-        self.model = AutoModel.from_pretrained(
-            "manifesto-project/manifestoberta-xlm-roberta-56policy-topics-sentence-2023-1-1"
-        )
-
-    def _embed(self, text: str, mean_over_tokens=True) -> List[float]:
-        """Embed a text using ManifestoBerta.
-
-        Args:
-            text: The text to embed.
-
-        Returns:
-            Embeddings for the text.
-        """
-
-        # Encode the text
-        inputs = self.tokenizer(
-            text, return_tensors="pt", padding=True, truncation=True, max_length=512
-        )
-
-        # Get model output (make sure to set output_hidden_states to True)
-        with torch.no_grad():
-            outputs = self.model(**inputs, output_hidden_states=True)
-
-        # Extract the last hidden states
-        last_hidden_states = outputs.hidden_states[-1]
-
-        # Average the token embeddings for a representation of the whole text
-        if mean_over_tokens:
-            embedding = torch.mean(last_hidden_states, dim=1)
-        else:
-            embedding = last_hidden_states
-
-        # Convert to list
-        embedding_list = embedding.cpu().tolist()
-
-        return embedding_list[0]
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name, **(model_kwargs or {}))
+        self.model.eval()
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.normalize = normalize
 
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        return [self._embed(text) for text in texts]
-
-    def embed_query(self, text: str) -> List[float]:
-        # return self.embed_documents([text])[0] # previous version
-        return self._embed(text)
-
-
-class E5BaseEmbedding(Embeddings):
-    """Embeddings using ManifestoBerta for use with LangChain."""
-
-    def __init__(self):
-        # Load the tokenizer and model
-        self.tokenizer = AutoTokenizer.from_pretrained("danielheinz/e5-base-sts-en-de")
-
-        self.model = AutoModel.from_pretrained("danielheinz/e5-base-sts-en-de")
-
-    def _embed(self, text: str, mean_over_tokens=True) -> List[float]:
-        """Embed a text using ManifestoBerta.
+        """Embed texts in batches of similar token length.
 
         Args:
-            text: The text to embed.
+            texts: The texts to embed.
 
         Returns:
-            Embeddings for the text.
+            Embeddings for the texts, in the order of the texts.
         """
+        if len(texts) == 0:
+            return []
 
-        # Encode the text
-        inputs = self.tokenizer(
-            text, return_tensors="pt", padding=True, truncation=True, max_length=512
+        # Tokenize once without padding, the batches are padded to their longest text
+        encodings = self.tokenizer(
+            list(texts), truncation=True, max_length=self.max_length
         )
-
-        # Get model output (make sure to set output_hidden_states to True)
-        with torch.no_grad():
-            outputs = self.model(**inputs, output_hidden_states=True)
-
-        # Extract the last hidden states
-        last_hidden_states = outputs.hidden_states[-1]
-
-        # Average the token embeddings for a representation of the whole text
-        if mean_over_tokens:
-            embedding = torch.mean(last_hidden_states, dim=1)
-        else:
-            embedding = last_hidden_states
-
-        # Convert to list
-        embedding_list = embedding.cpu().tolist()
-
-        return embedding_list[0]
-
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        return [self._embed(text) for text in texts]
+        lengths = [len(input_ids) for input_ids in encodings["input_ids"]]
+
+        embeddings = [None] * len(texts)
+        for batch in length_sorted_batches(lengths, self.batch_size):
+            inputs = self.tokenizer.pad(
+                {key: [encodings[key][i] for i in batch] for key in encodings.keys()},
+                return_tensors="pt",
+            )
+            with torch.no_grad():
+                model_output = self.model(**inputs)
+
+            # Average the token embeddings, ignoring the padding
+            batch_embeddings = mean_pooling(model_output, inputs["attention_mask"])
+            if self.normalize:
+                batch_embeddings = F.normalize(batch_embeddings, p=2, dim=1)
+
+            for i, embedding in zip(batch, batch_embeddings.cpu().tolist()):
+                embeddings[i] = embedding
+        return embeddings
 
     def embed_query(self, text: str) -> List[float]:
-        # return self.embed_documents([text])[0] # previous version
-        return self._embed(text)
+        return self.embed_documents([text])[0]
 
 
-class JinaAIEmbedding(Embeddings):
+class ManifestoBertaEmbeddings(BatchedTransformerEmbeddings):
     """Embeddings using ManifestoBerta for use with LangChain."""
 
-    def __init__(self):
-        # Load the tokenizer and model
-        self.tokenizer = AutoTokenizer.from_pretrained(
-            "jinaai/jina-embeddings-v2-base-de"
-        )
-        self.model = AutoModel.from_pretrained(
-            "jinaai/jina-embeddings-v2-base-de", trust_remote_code=True
+    def __init__(self, batch_size=32):
+        super().__init__(
+            "manifesto-project/manifestoberta-xlm-roberta-56policy-topics-sentence-2023-1-1",
+            batch_size=batch_size,
         )
 
-    def _embed(self, text: str, mean_over_tokens=True) -> List[float]:
-        """Embed a text using ManifestoBerta.
 
-        Args:
-            text: The text to embed.
+class E5BaseEmbedding(BatchedTransformerEmbeddings):
+    """Embeddings using E5 for use with LangChain."""
 
-        Returns:
-            Embeddings for the text.
-        """
+    def __init__(self, batch_size=32):
+        super().__init__("danielheinz/e5-base-sts-en-de", batch_size=batch_size)
 
-        # Encode the text
-        inputs = self.tokenizer(
-            text, padding=True, truncation=True, return_tensors="pt"
-        )
 
-        # Get model output (make sure to set output_hidden_states to True)
-        with torch.no_grad():
-            model_output = self.model(**inputs)
+class JinaAIEmbedding(BatchedTransformerEmbeddings):
+    """Embeddings using Jina AI for use with LangChain."""
 
-        embedding = mean_pooling(model_output, inputs["attention_mask"])
-        embedding = F.normalize(embedding, p=2, dim=1)
-
-        # Convert to list
-        embedding_list = embedding.cpu().tolist()
-
-        return embedding_list[0]
-
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        return [self._embed(text) for text in texts]
-
-    def embed_query(self, text: str) -> List[float]:
-        # return self.embed_documents([text])[0] # previous version
-        return self._embed(text)
+    def __init__(self, batch_size=32):
+        super().__init__(
+            "jinaai/jina-embeddings-v2-base-de",
+            batch_size=batch_size,
+            max_length=None,
+            normalize=True,
+            model_kwargs={"trust_remote_code": True},
+        )
 
 
 class SentenceTransformerEmbedding(Embeddings):
-    """Embeddings using ManifestoBerta for use with LangChain."""
+    """Embeddings using a SentenceTransformer model for use with LangChain."""
 
-    def __init__(self, model_name="multi-qa-mpnet-base-dot-v1"):
+    def __init__(self, model_name="multi-qa-mpnet-base-dot-v1", batch_size=32):
         # Load the tokenizer and model
         self.model = SentenceTransformer(model_name)
+        self.batch_size = batch_size
 
-    def _embed(self, text: str) -> List[float]:
-        """Embed a text using ManifestoBerta.
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts in batches (SentenceTransformer sorts them by length).
 
         Args:
-            text: The text to embed.
+            texts: The texts to embed.
 
         Returns:
-            Embeddings for the text.
+            Embeddings for the texts, in the order of the texts.
         """
-
-        # Encode the text
-        embedding = self.model.encode(text)
-        embedding = [float(e) for e in embedding]
-        return embedding
-
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        return [self._embed(text) for text in texts]
+        embeddings = self.model.encode(list(texts), batch_size=self.batch_size)
+        return [[float(e) for e in embedding] for embedding in embeddings]
 
     def embed_query(self, text: str) -> List[float]:
-        # return self.embed_documents([text])[0] # previous version
-        return self._embed(text)
+        return self.embed_documents([text])[0]
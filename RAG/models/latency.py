@@ -0,0 +1,35 @@
+from collections import deque
+import threading
+
+import numpy as np
+
+
+class LatencyTracker:
+    """
+    Keeps the latencies of the most recent LLM completions to derive percentiles (e.g. for hedged requests).
+
+    Args:
+    window: int, number of most recent latencies that are kept, default is 500
+    min_samples: int, minimum number of latencies before percentiles are reported, default is 20
+    """
+
+    def __init__(self, window=500, min_samples=20):
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency):
+        """
+        Adds the latency (in seconds) of a completion.
+        """
+        with self._lock:
+            self._latencies.append(latency)
+
+    def percentile(self, q):
+        """
+        Returns the q-th percentile of the recent latencies in seconds, or None if there are too few.
+        """
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            return float(np.percentile(list(self._latencies), q))
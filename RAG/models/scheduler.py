@@ -0,0 +1,323 @@
+from collections import OrderedDict, deque
+import asyncio
+import threading
+import time
+
+
+def is_rate_limit_error(error):
+    """
+    Returns True if an error of an LLM call is a rate limit error (HTTP 429).
+    """
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    return status_code == 429 or type(error).__name__ == "RateLimitError"
+
+
+def get_retry_after(error):
+    """
+    Returns the delay in seconds requested by the retry-after(-ms) header of a rate limit error, or None.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    for header, factor in [("retry-after-ms", 0.001), ("retry-after", 1.0)]:
+        try:
+            return float(headers[header]) * factor
+        except (KeyError, TypeError, ValueError):
+            continue
+    return None
+
+
+class TokenBucket:
+    """
+    Token bucket that allows a given amount per minute, with bursts of up to one minute's amount.
+
+    Args:
+    per_minute: float, amount that is refilled per minute (and capacity of the bucket)
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.available = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(
+            self.capacity, self.available + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def wait_time(self, amount):
+        """
+        Returns the time in seconds until the amount is available.
+        """
+        self._refill()
+        # Requests larger than the capacity would never fit and only wait for a full bucket
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self.rate
+
+    def consume(self, amount):
+        self._refill()
+        self.available -= min(amount, self.capacity)
+
+
+class LLMScheduler:
+    """
+    Process-wide scheduler for LLM completions shared by all RAG instances (e.g. all sessions of the app).
+
+    Requests are queued per session and admitted round-robin across sessions, so a session with many
+    requests cannot starve the others. A request is admitted when a concurrency slot is free and the
+    request and token budgets per minute allow it. Rate limit errors (HTTP 429) pause all admissions
+    for the time given by the retry-after header (or an exponential backoff) and the request is retried
+    at the front of its session's queue.
+
+    The scheduler runs its own event loop in a background thread; its methods can be called from any thread.
+    Any LangChain chat model (with ainvoke and stream) can be used, including fake models for testing.
+
+    Args:
+    max_concurrency: int, maximum number of LLM requests in flight, default is 16
+    requests_per_minute: float, optional, maximum number of requests per minute (no limit if None)
+    tokens_per_minute: float, optional, maximum number of (estimated) tokens per minute (no limit if None)
+    max_retries: int, maximum number of retries of a request after rate limit errors, default is 3
+    backoff: float, delay in seconds before the first retry without retry-after header, doubled for each retry, default is 1.0
+    max_backoff: float, maximum delay in seconds before a retry, default is 30.0
+    """
+
+    def __init__(
+        self,
+        max_concurrency=16,
+        requests_per_minute=None,
+        tokens_per_minute=None,
+        max_retries=3,
+        backoff=1.0,
+        max_backoff=30.0,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.request_bucket = (
+            TokenBucket(requests_per_minute) if requests_per_minute else None
+        )
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+        self.requests = 0
+        self.rate_limit_errors = 0
+        self.in_flight = 0
+        self._paused_until = 0.0
+        # session_id -> deque of (estimated tokens, future resolved on admission)
+        self._queues = OrderedDict()
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="llm-scheduler", daemon=True
+        )
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+
+    async def _start(self):
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._pending = asyncio.Event()
+        self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+    def batch(self, llm, prompts, session_id=None, tokens=None):
+        """
+        Runs completions for several prompts through the scheduler and waits for all of them.
+
+        Args:
+        llm: chat model (e.g. ChatOpenAI object)
+        prompts: list of str, prompts
+        session_id: hashable, optional, session the requests are queued for
+        tokens: list of int, optional, estimated tokens (prompt and completion) of each request
+
+        Returns:
+        responses: list of messages, responses in the order of the prompts
+        """
+        if tokens is None:
+            tokens = [0] * len(prompts)
+        futures = [
+            self.submit(llm, prompt, session_id, n_tokens)
+            for prompt, n_tokens in zip(prompts, tokens)
+        ]
+        return [future.result() for future in futures]
+
+    def invoke(self, llm, prompt, session_id=None, tokens=0):
+        """
+        Runs a single completion through the scheduler (see batch).
+        """
+        return self.submit(llm, prompt, session_id, tokens).result()
+
+    def submit(self, llm, prompt, session_id=None, tokens=0):
+        """
+        Submits a completion to the scheduler without waiting for it (see batch).
+
+        Returns:
+        future: concurrent.futures.Future of the response message (cancelling it cancels the request)
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self._complete(llm, prompt, session_id, tokens), self._loop
+        )
+
+    def stream(self, llm, prompt, session_id=None, tokens=0):
+        """
+        Streams a completion through the scheduler; the concurrency slot is held until the stream ends.
+
+        Args:
+        llm: chat model (e.g. ChatOpenAI object)
+        prompt: str, prompt
+        session_id: hashable, optional, session the request is queued for
+        tokens: int, estimated tokens (prompt and completion) of the request
+
+        Yields:
+        chunk: message chunk of the response
+        """
+        for attempt in range(self.max_retries + 1):
+            asyncio.run_coroutine_threadsafe(
+                self._admit(session_id, tokens, retry=attempt > 0), self._loop
+            ).result()
+            started = False
+            try:
+                for chunk in llm.stream(prompt):
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                # Only retry if nothing has been yielded yet
+                if started or not self._retry_after_error(e, attempt):
+                    raise
+            finally:
+                self._loop.call_soon_threadsafe(self._release)
+
+    def close(self):
+        """
+        Stops the scheduler's event loop (requests still queued are not completed).
+        """
+        asyncio.run_coroutine_threadsafe(self._stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    async def _stop(self):
+        self._dispatcher.cancel()
+        try:
+            await self._dispatcher
+        except asyncio.CancelledError:
+            pass
+
+    @property
+    def stats(self):
+        """
+        Returns counters of the scheduler (requests, rate limit errors, requests in flight and queued).
+        """
+        return {
+            "requests": self.requests,
+            "rate_limit_errors": self.rate_limit_errors,
+            "in_flight": self.in_flight,
+            "queued": sum(len(requests) for requests in list(self._queues.values())),
+        }
+
+    async def _complete(self, llm, prompt, session_id, tokens):
+        for attempt in range(self.max_retries + 1):
+            await self._admit(session_id, tokens, retry=attempt > 0)
+            try:
+                return await llm.ainvoke(prompt)
+            except Exception as e:
+                if not self._retry_after_error(e, attempt):
+                    raise
+            finally:
+                self._release()
+
+    async def _admit(self, session_id, tokens, retry=False):
+        """
+        Queues a request for a session and waits until it is admitted (holding a concurrency slot).
+        """
+        admitted = self._loop.create_future()
+        requests = self._queues.setdefault(session_id, deque())
+        if retry:
+            requests.appendleft((tokens, admitted))
+        else:
+            requests.append((tokens, admitted))
+        self._pending.set()
+        try:
+            await admitted
+        except asyncio.CancelledError:
+            if admitted.done() and not admitted.cancelled():
+                # Admitted right before the cancellation, give the slot back
+                self._release()
+            else:
+                self._remove(session_id, (tokens, admitted))
+            raise
+
+    def _remove(self, session_id, request):
+        """
+        Removes a request that is still queued (e.g. after it was cancelled).
+        """
+        requests = self._queues.get(session_id)
+        if requests is None or request not in requests:
+            return
+        requests.remove(request)
+        if len(requests) == 0:
+            del self._queues[session_id]
+
+    def _release(self):
+        self.in_flight -= 1
+        self._slots.release()
+
+    def _retry_after_error(self, error, attempt):
+        """
+        Pauses admissions after a rate limit error and returns True if the request should be retried.
+        """
+        if not is_rate_limit_error(error):
+            return False
+        self.rate_limit_errors += 1
+        delay = get_retry_after(error)
+        if delay is None:
+            delay = min(self.backoff * 2**attempt, self.max_backoff)
+        print(f"LLM rate limit reached, pausing requests for {delay:.1f} s")
+        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        return attempt < self.max_retries
+
+    async def _dispatch(self):
+        while True:
+            if len(self._queues) == 0:
+                self._pending.clear()
+                await self._pending.wait()
+                continue
+            await self._slots.acquire()
+            if len(self._queues) == 0:
+                # The queued requests were cancelled while waiting for the slot
+                self._slots.release()
+                continue
+
+            # Round-robin across sessions: take the next request of the first session and move the session to the end
+            session_id, requests = self._queues.popitem(last=False)
+            tokens, admitted = requests.popleft()
+            if len(requests) > 0:
+                self._queues[session_id] = requests
+
+            if not admitted.done():
+                await self._wait_for_capacity(tokens)
+            if admitted.done():
+                # Cancelled while queued or waiting for capacity
+                self._slots.release()
+                continue
+            self.requests += 1
+            self.in_flight += 1
+            admitted.set_result(None)
+
+    async def _wait_for_capacity(self, tokens):
+        while True:
+            wait = self._paused_until - time.monotonic()
+            if self.request_bucket is not None:
+                wait = max(wait, self.request_bucket.wait_time(1))
+            if self.token_bucket is not None:
+                wait = max(wait, self.token_bucket.wait_time(tokens))
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+        if self.request_bucket is not None:
+            self.request_bucket.consume(1)
+        if self.token_bucket is not None:
+            self.token_bucket.consume(tokens)
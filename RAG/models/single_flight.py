@@ -0,0 +1,115 @@
+import copy
+import threading
+
+
+class InFlightCall:
+    """
+    A computation that one caller (the leader) runs while other callers with the same key wait for its result.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+    def wait(self):
+        """
+        Waits for the computation and returns a copy of its result (or raises its error).
+        """
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return copy.deepcopy(self.result)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical requests: while a computation for a key is in flight,
+    further requests with the same key wait for it and share its result instead of starting their own.
+
+    The result is not kept after the computation has finished (see ResponseCache for caching answers).
+    Followers receive a deep copy of the result, so they can modify it independently of each other.
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        # key -> InFlightCall
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def join(self, key):
+        """
+        Joins the computation for a key.
+
+        Args:
+        key: hashable, key of the request
+
+        Returns:
+        call: InFlightCall object
+        leader: bool, True if the caller has to run the computation and report it with finish,
+            False if the caller should wait for the result with call.wait()
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.followers += 1
+                self.coalesced += 1
+                return call, False
+            call = InFlightCall()
+            self._calls[key] = call
+            return call, True
+
+    def finish(self, key, call, result=None, error=None):
+        """
+        Publishes the result (or error) of a computation to its followers. Calls after the first one are ignored.
+
+        Errors that are not an Exception (e.g. KeyboardInterrupt of the leader) are passed to the followers
+        as RuntimeError, so callers catching Exception can handle them.
+        """
+        if error is not None and not isinstance(error, Exception):
+            wrapped = RuntimeError(
+                f"Coalesced query was aborted ({type(error).__name__})"
+            )
+            wrapped.__cause__ = error
+            error = wrapped
+        with self._lock:
+            if call.done.is_set():
+                return
+            if self._calls.get(key) is call:
+                del self._calls[key]
+            if call.followers > 0:
+                call.result = copy.deepcopy(result)
+            call.error = error
+            call.done.set()
+
+    def do(self, key, fn):
+        """
+        Runs fn, unless a computation for the same key is already in flight, and returns its result.
+
+        Args:
+        key: hashable, key of the request
+        fn: callable without arguments that computes the result
+
+        Returns:
+        result: return value of fn (a copy of it for followers)
+        leader: bool, True if fn was run by this call
+        """
+        call, leader = self.join(key)
+        if not leader:
+            return call.wait(), False
+        try:
+            result = fn()
+        except BaseException as e:
+            self.finish(key, call, error=e)
+            raise
+        self.finish(key, call, result=result)
+        return result, True
+
+    @property
+    def in_flight(self):
+        """
+        Returns the number of computations currently in flight.
+        """
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,73 @@
+# Measures the throughput (chunks per second) of the local embedding models for different batch sizes
+# on a sample of the manifesto chunks, and the deviation of the batched embeddings from batch size 1.
+# Run from the repository root: python -m RAG.scripts.benchmark_embedding_throughput --models e5 --n-chunks 256
+import argparse
+import random
+import time
+
+import numpy as np
+
+from RAG.database.vector_database import load_pdf_directory_splits
+from RAG.models.embedding import (
+    E5BaseEmbedding,
+    JinaAIEmbedding,
+    ManifestoBertaEmbeddings,
+    SentenceTransformerEmbedding,
+)
+
+DATA_PATH = "data/manifestos/01_pdf_originals"
+MODELS = {
+    "manifestoberta": ManifestoBertaEmbeddings,
+    "e5": E5BaseEmbedding,
+    "jina": JinaAIEmbedding,
+    "sentence_transformer": SentenceTransformerEmbedding,
+}
+
+
+def benchmark(embedding_model, texts, batch_size):
+    """
+    Embeds the texts with a batch size and returns the embeddings and the throughput in chunks per second.
+    """
+    embedding_model.batch_size = batch_size
+    start = time.perf_counter()
+    embeddings = np.array(embedding_model.embed_documents(texts))
+    return embeddings, len(texts) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the throughput of the local embedding models."
+    )
+    parser.add_argument(
+        "--models", nargs="+", choices=list(MODELS), default=list(MODELS)
+    )
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8, 32, 64])
+    parser.add_argument("--n-chunks", type=int, default=256)
+    args = parser.parse_args()
+
+    splits = load_pdf_directory_splits(DATA_PATH)
+    random.seed(0)
+    texts = [
+        split.page_content
+        for split in random.sample(splits, min(args.n_chunks, len(splits)))
+    ]
+    print(f"Embedding {len(texts)} manifesto chunks")
+
+    print(
+        f"{'model':<22} {'batch size':>10} {'chunks/s':>9} {'speedup':>8} "
+        f"{'max dev.':>9}"
+    )
+    for name in args.models:
+        embedding_model = MODELS[name]()
+        reference = None
+        reference_throughput = None
+        for batch_size in args.batch_sizes:
+            embeddings, throughput = benchmark(embedding_model, texts, batch_size)
+            if reference is None:
+                reference, reference_throughput = embeddings, throughput
+            # Padding must not change the embeddings (up to floating point error)
+            deviation = np.abs(embeddings - reference).max()
+            print(
+                f"{name:<22} {batch_size:10d} {throughput:9.1f} "
+                f"{throughput / reference_throughput:7.1f}x {deviation:9.2e}"
+            )
@@ -0,0 +1,89 @@
+# Compares per-party generation (one completion per party) with combined generation (one JSON completion for all parties):
+# latency, token usage, fallbacks and the queries per minute the OpenAI rate limits allow.
+# Run from the repository root: python -m RAG.scripts.benchmark_generation_modes
+import csv
+import time
+
+import numpy as np
+from langchain_community.callbacks import get_openai_callback
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+from RAG.database.vector_database import VectorDatabase
+from RAG.models.RAG import RAG
+
+DATABASE_DIRS = {
+    "manifestos": "data/manifestos/chroma/openai",
+    "debates": "data/debates/chroma/openai",
+}
+QUESTIONS_PATH = "data/questions/eval_questions.csv"
+MODES = ["per_party", "combined"]
+# Rate limits of the OpenAI account (see App.py)
+REQUESTS_PER_MINUTE = 3500
+TOKENS_PER_MINUTE = 160000
+
+
+def load_questions(path):
+    with open(path, "r") as file:
+        return [row["question"] for row in csv.DictReader(file)]
+
+
+def benchmark(rag, questions):
+    """
+    Answers all questions and returns the latencies (s), LLM requests, prompt/completion tokens and fallbacks per question.
+    """
+    results = {
+        "latency": [],
+        "requests": [],
+        "prompt_tokens": [],
+        "completion_tokens": [],
+        "fallbacks": [],
+    }
+    for question in questions:
+        with get_openai_callback() as callback:
+            start = time.perf_counter()
+            rag.query(question)
+            results["latency"].append(time.perf_counter() - start)
+        results["requests"].append(callback.successful_requests)
+        results["prompt_tokens"].append(callback.prompt_tokens)
+        results["completion_tokens"].append(callback.completion_tokens)
+        results["fallbacks"].append(rag.query_stats.get("combined_fallbacks", 0))
+    return {name: np.array(values) for name, values in results.items()}
+
+
+if __name__ == "__main__":
+    embedding_model = OpenAIEmbeddings(model="text-embedding-3-large")
+    databases = [
+        VectorDatabase(
+            embedding_model=embedding_model,
+            source_type=source_type,
+            database_directory=database_directory,
+            backend="numpy",
+        )
+        for source_type, database_directory in DATABASE_DIRS.items()
+    ]
+    questions = load_questions(QUESTIONS_PATH)
+
+    print(
+        f"{'mode':<10} {'p50':>7} {'p95':>7} {'requests':>9} {'prompt tok':>11} "
+        f"{'compl. tok':>11} {'fallbacks':>10} {'queries/min':>12}"
+    )
+    for mode in MODES:
+        rag = RAG(
+            databases=databases,
+            llm=ChatOpenAI(model_name="gpt-3.5-turbo", max_tokens=400, temperature=0),
+            generation_mode=mode,
+        )
+        results = benchmark(rag, questions)
+        tokens = results["prompt_tokens"].mean() + results["completion_tokens"].mean()
+        # Rate-limit headroom: queries per minute before the request or token limit is reached
+        queries_per_minute = min(
+            REQUESTS_PER_MINUTE / max(results["requests"].mean(), 1e-9),
+            TOKENS_PER_MINUTE / max(tokens, 1e-9),
+        )
+        print(
+            f"{mode:<10} {np.percentile(results['latency'], 50):6.2f}s "
+            f"{np.percentile(results['latency'], 95):6.2f}s "
+            f"{results['requests'].mean():9.1f} {results['prompt_tokens'].mean():11.0f} "
+            f"{results['completion_tokens'].mean():11.0f} {results['fallbacks'].sum():10d} "
+            f"{queries_per_minute:12.1f}"
+        )
@@ -0,0 +1,98 @@
+# Compares the former page attribution of the manifesto splits (each PDF loaded twice, both halves of every split
+# searched in every page) with the offset-based attribution of load_pdf_splits (each PDF parsed once).
+# Run from the repository root: python -m RAG.scripts.benchmark_page_attribution
+import glob
+import os
+import time
+
+from langchain_community.document_loaders import PDFMinerLoader
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from RAG.database.vector_database import load_pdf_splits, page_offsets
+
+DATA_PATH = "data/manifestos/01_pdf_originals"
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+
+def substring_splits(pdf_path):
+    """
+    Splits a PDF and attributes the pages like build_database did before (the last page containing either half).
+    """
+    party = os.path.basename(pdf_path).split("_")[0]
+    doc = PDFMinerLoader(pdf_path, concatenate_pages=True).load()
+    doc_pages = PDFMinerLoader(pdf_path, concatenate_pages=False).load()
+    for d in doc:
+        d.metadata.update({"party": party})
+
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP
+    )
+    splits = text_splitter.split_documents(doc)
+    for split in splits:
+        half = int(0.5 * len(split.page_content))
+        for i, doc_page in enumerate(doc_pages):
+            if split.page_content[:half] in doc_page.page_content:
+                split.metadata.update({"page": i})
+            elif split.page_content[half:] in doc_page.page_content:
+                split.metadata.update({"page": i})
+    return splits, doc[0].page_content
+
+
+def straddling_splits(splits, text):
+    """
+    Returns the number of splits that run across a page boundary.
+    """
+    offsets = page_offsets(text)
+    count = 0
+    position = 0
+    for split in splits:
+        start = text.find(split.page_content, position)
+        position = max(start, 0)
+        end = start + len(split.page_content)
+        count += any(start < offset < end for offset in offsets)
+    return count
+
+
+if __name__ == "__main__":
+    pdf_paths = sorted(glob.glob(os.path.join(DATA_PATH, "*.pdf")))
+
+    print(
+        f"{'file':<45} {'splits':>7} {'substring':>10} {'offsets':>9} "
+        f"{'differ':>7} {'no page':>8} {'straddle':>9}"
+    )
+    totals = {"splits": 0, "substring": 0.0, "offsets": 0.0, "differ": 0}
+    for pdf_path in pdf_paths:
+        start = time.perf_counter()
+        old_splits, text = substring_splits(pdf_path)
+        substring_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        new_splits = load_pdf_splits(pdf_path, CHUNK_SIZE, CHUNK_OVERLAP)
+        offsets_time = time.perf_counter() - start
+
+        # Both methods split the same text, only the page metadata differs
+        assert [s.page_content for s in old_splits] == [
+            s.page_content for s in new_splits
+        ]
+        differ = sum(
+            old.metadata.get("page") != new.metadata["page"]
+            for old, new in zip(old_splits, new_splits)
+        )
+        missing = sum("page" not in split.metadata for split in old_splits)
+
+        totals["splits"] += len(new_splits)
+        totals["substring"] += substring_time
+        totals["offsets"] += offsets_time
+        totals["differ"] += differ
+        print(
+            f"{os.path.basename(pdf_path):<45} {len(new_splits):7d} "
+            f"{substring_time:9.2f}s {offsets_time:8.2f}s {differ:7d} {missing:8d} "
+            f"{straddling_splits(new_splits, text):9d}"
+        )
+
+    print(
+        f"{'total':<45} {totals['splits']:7d} {totals['substring']:9.2f}s "
+        f"{totals['offsets']:8.2f}s {totals['differ']:7d}"
+    )
+    print(f"Speedup {totals['substring'] / totals['offsets']:.1f}x")
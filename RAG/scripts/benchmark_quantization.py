@@ -0,0 +1,106 @@
+# Compares compressed embedding storage settings of the in-memory index against full-precision search:
+# recall@k on the eval questions, memory of the embedding matrix, measured peak memory of a search and search latency.
+# Run from the repository root: python -m RAG.scripts.benchmark_quantization
+import csv
+import time
+import tracemalloc
+
+import numpy as np
+from langchain_community.vectorstores import Chroma
+from langchain_openai import OpenAIEmbeddings
+
+from RAG.database.numpy_index import NumpyVectorIndex
+
+DATABASE_DIRS = {
+    "manifestos": "data/manifestos/chroma/openai",
+    "debates": "data/debates/chroma/openai",
+}
+QUESTIONS_PATH = "data/questions/eval_questions.csv"
+PARTIES = ["gruene", "spd", "cdu", "afd", "fdp", "linke"]
+K = 3
+# (dtype, dimensions), dimensions=None keeps all 3072 dimensions
+SETTINGS = [
+    ("float32", None),
+    ("float16", None),
+    ("int8", None),
+    ("float32", 1024),
+    ("float16", 1024),
+    ("int8", 1024),
+    ("float32", 256),
+    ("int8", 256),
+]
+
+
+def load_questions(path):
+    with open(path, "r") as file:
+        return [row["question"] for row in csv.DictReader(file)]
+
+
+def search_all(index, question_embeddings):
+    """
+    Runs the top-k search of all parties for all questions and returns the selected IDs, the latencies (ms)
+    and the peak memory allocated by a search over all chunks (bytes).
+    """
+    selected_ids = []
+    latencies = []
+    for embedding in question_embeddings:
+        for party in PARTIES:
+            start = time.perf_counter()
+            ids = index.similarity_search_ids_by_vector(
+                embedding, k=K, filter={"party": party}
+            )
+            latencies.append((time.perf_counter() - start) * 1000)
+            selected_ids.append(ids)
+
+    # Peak memory of a search over all chunks (measured separately, tracemalloc slows down allocations)
+    tracemalloc.start()
+    index.similarity_search_ids_by_vector(question_embeddings[0], k=K)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return selected_ids, np.array(latencies), peak_memory
+
+
+if __name__ == "__main__":
+    embedding_model = OpenAIEmbeddings(model="text-embedding-3-large")
+    questions = load_questions(QUESTIONS_PATH)
+    question_embeddings = embedding_model.embed_documents(questions)
+
+    for source_type, database_directory in DATABASE_DIRS.items():
+        data = Chroma(
+            persist_directory=database_directory, embedding_function=embedding_model
+        )._collection.get(include=["embeddings", "documents", "metadatas"])
+
+        reference_ids = None
+        print(f"\n{source_type} ({len(data['ids'])} chunks)")
+        print(
+            f"{'setting':<16} {'memory':>10} {'peak search':>12} "
+            f"{'recall@' + str(K):>10} {'mean latency':>14}"
+        )
+        for dtype, dimensions in SETTINGS:
+            index = NumpyVectorIndex(
+                ids=data["ids"],
+                embeddings=data["embeddings"],
+                documents=data["documents"],
+                metadatas=data["metadatas"],
+                dtype=dtype,
+                dimensions=dimensions,
+            )
+            selected_ids, latencies, peak_memory = search_all(
+                index, question_embeddings
+            )
+            if reference_ids is None:
+                # The first setting is full precision and serves as reference
+                reference_ids = selected_ids
+
+            recall = np.mean(
+                [
+                    len(set(ids) & set(reference)) / max(len(reference), 1)
+                    for ids, reference in zip(selected_ids, reference_ids)
+                ]
+            )
+            setting = f"{dtype}/{index.dimensions}"
+            print(
+                f"{setting:<16} {index.nbytes / 2**20:8.1f} MB "
+                f"{peak_memory / 2**20:9.1f} MB {recall:10.1%} "
+                f"{latencies.mean():11.2f} ms"
+            )
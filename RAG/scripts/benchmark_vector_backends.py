@@ -0,0 +1,79 @@
+# Compares the retrieval latency of the Chroma and the in-memory NumPy backend of VectorDatabase.
+# Run from the repository root: python -m RAG.scripts.benchmark_vector_backends
+import csv
+import time
+
+import numpy as np
+from langchain_openai import OpenAIEmbeddings
+
+from RAG.database.vector_database import VectorDatabase
+
+DATABASE_DIRS = {
+    "manifestos": "data/manifestos/chroma/openai",
+    "debates": "data/debates/chroma/openai",
+}
+QUESTIONS_PATH = "data/questions/eval_questions.csv"
+PARTIES = ["gruene", "spd", "cdu", "afd", "fdp", "linke"]
+K = 3
+FETCH_K = 5
+REPETITIONS = 5
+
+
+def load_questions(path):
+    with open(path, "r") as file:
+        return [row["question"] for row in csv.DictReader(file)]
+
+
+def benchmark(database, question_embeddings):
+    """
+    Runs the MMR search of all parties for all questions and returns the latencies (ms) and the selected IDs.
+    """
+    latencies = []
+    selected_ids = []
+    for _ in range(REPETITIONS):
+        selected_ids = []
+        for embedding in question_embeddings:
+            for party in PARTIES:
+                start = time.perf_counter()
+                ids, _ = database.max_marginal_relevance_search_ids_by_vector(
+                    embedding, k=K, fetch_k=FETCH_K, filter={"party": party}
+                )
+                latencies.append((time.perf_counter() - start) * 1000)
+                selected_ids.append(ids)
+    return np.array(latencies), selected_ids
+
+
+if __name__ == "__main__":
+    embedding_model = OpenAIEmbeddings(model="text-embedding-3-large")
+    questions = load_questions(QUESTIONS_PATH)
+    # Embed all questions once, so only the search itself is timed
+    question_embeddings = embedding_model.embed_documents(questions)
+
+    for source_type, database_directory in DATABASE_DIRS.items():
+        results = {}
+        for backend in ["chroma", "numpy"]:
+            start = time.perf_counter()
+            database = VectorDatabase(
+                embedding_model=embedding_model,
+                source_type=source_type,
+                database_directory=database_directory,
+                backend=backend,
+            )
+            load_time = time.perf_counter() - start
+            latencies, selected_ids = benchmark(database, question_embeddings)
+            results[backend] = selected_ids
+            print(
+                f"{source_type:<10} {backend:<6} load {load_time:6.2f} s | "
+                f"search mean {latencies.mean():7.2f} ms, "
+                f"p50 {np.percentile(latencies, 50):7.2f} ms, "
+                f"p95 {np.percentile(latencies, 95):7.2f} ms"
+            )
+
+        # Chroma's HNSW search is approximate, the NumPy search is exact
+        overlap = np.mean(
+            [
+                len(set(a) & set(b)) / max(len(a), 1)
+                for a, b in zip(results["chroma"], results["numpy"])
+            ]
+        )
+        print(f"{source_type:<10} overlap of selected chunks: {overlap:.1%}")
@@ -0,0 +1,32 @@
+# Exports the Chroma databases as memory-mapped bundles, which the app loads instead of Chroma if they exist.
+# Run from the repository root: python -m RAG.scripts.export_bundles
+from langchain_openai import OpenAIEmbeddings
+
+from RAG.database.vector_database import VectorDatabase
+
+DATABASES = {
+    "manifestos": (
+        "data/manifestos/chroma/openai",
+        "data/manifestos/bundle/openai",
+    ),
+    "debates": (
+        "data/debates/chroma/openai",
+        "data/debates/bundle/openai",
+    ),
+}
+
+
+if __name__ == "__main__":
+    embedding_model = OpenAIEmbeddings(model="text-embedding-3-large")
+
+    for source_type, (database_directory, bundle_directory) in DATABASES.items():
+        database = VectorDatabase(
+            embedding_model=embedding_model,
+            source_type=source_type,
+            database_directory=database_directory,
+        )
+        manifest = database.export_bundle(bundle_directory)
+        print(
+            f"Exported {manifest['count']} {source_type} chunks to {bundle_directory} "
+            f"(content hash {manifest['content_hash'][:12]})"
+        )
@@ -0,0 +1,254 @@
+# Answers all questions of a CSV file with the RAG engine and appends the results to a JSONL checkpoint file.
+# An interrupted run continues with the questions that have no result yet when it is started again.
+# The questions are answered in batches by RAG.query_many (batched embeddings, one LLM pipeline per batch)
+# with a dedicated engine that neither reads nor writes the app's response cache.
+# Run from the repository root:
+# python -m RAG.scripts.run_questions data/questions/eval_questions.csv results/eval_questions.jsonl --concurrency 4 --batch-size 8
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+
+from RAG.service.client import RAGClient
+from RAG.service.engine import PARTIES, build_rag, session_rag
+from RAG.service.serialization import response_to_json
+
+
+def read_questions(path, column=None):
+    """
+    Yields (row number, question) for each row of a CSV file.
+
+    The questions are taken from the given column, the "question" column or else the first column.
+    """
+    with open(path, "r", newline="") as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        if column is None:
+            column = "question" if "question" in header else header[0]
+        index = header.index(column)
+        for row_number, row in enumerate(reader):
+            if index < len(row) and len(row[index].strip()) > 0:
+                yield row_number, row[index].strip()
+
+
+def read_checkpoint(path):
+    """
+    Returns the row numbers with a result in a JSONL checkpoint file (failed rows and incomplete lines are ignored).
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # The last line may be incomplete if the run was interrupted while writing it
+                continue
+            if "response" in record:
+                done.add(record["row"])
+    return done
+
+
+class CheckpointWriter:
+    """
+    Appends records as JSON lines to a file, each line is flushed to disk when it is written.
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, "a+")
+        # Terminate an incomplete last line of an interrupted run
+        self.file.seek(0, os.SEEK_END)
+        if self.file.tell() > 0:
+            self.file.seek(self.file.tell() - 1)
+            if self.file.read(1) != "\n":
+                self.file.write("\n")
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+def answer_batch(answer_many, batch):
+    """
+    Answers a batch of (row number, question) and returns the checkpoint record of each question.
+
+    answer_many answers a list of questions and returns their responses and the query statistics. If the
+    batch fails, its questions are answered one by one, so only the failing ones are recorded as errors.
+    """
+    start = time.perf_counter()
+    try:
+        responses, query_stats = answer_many([question for _, question in batch])
+    except Exception as e:
+        if len(batch) == 1:
+            row_number, question = batch[0]
+            return [{"row": row_number, "question": question, "error": str(e)}]
+        print(f"Batch failed, answering its questions one by one: {e}")
+        return [
+            record for item in batch for record in answer_batch(answer_many, [item])
+        ]
+    latency = time.perf_counter() - start
+    return [
+        {
+            "row": row_number,
+            "question": question,
+            "response": response_to_json(response),
+            "query_stats": query_stats,
+            "batch_size": len(batch),
+            "latency": latency,
+        }
+        for (row_number, question), response in zip(batch, responses)
+    ]
+
+
+def batches(questions, batch_size):
+    """
+    Yields lists of up to batch_size (row number, question) tuples.
+    """
+    batch = []
+    for item in questions:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def run(questions, answer_many, writer, concurrency, batch_size=1, report_every=10):
+    """
+    Answers the questions in batches with at most concurrency batches in flight and writes each record as soon
+    as its batch is done.
+
+    Returns:
+    answered: int, number of answered questions
+    errors: int, number of failed questions
+    latencies: list of float, latencies of the batches of the answered questions in seconds
+    """
+    answered = 0
+    errors = 0
+    latencies = []
+    start = time.perf_counter()
+
+    def collect(futures):
+        nonlocal answered, errors
+        for future in futures:
+            for record in future.result():
+                writer.write(record)
+                if "error" in record:
+                    errors += 1
+                    print(f"Row {record['row']} failed: {record['error']}")
+                    continue
+                answered += 1
+                latencies.append(record["latency"])
+                if answered % report_every == 0:
+                    elapsed = time.perf_counter() - start
+                    print(
+                        f"{answered} answered, {errors} failed, "
+                        f"{answered / elapsed * 60:.1f} questions/min, "
+                        f"mean latency {np.mean(latencies):.2f} s"
+                    )
+
+    # Questions are read lazily, so at most concurrency batches are in memory
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = set()
+        for batch in batches(questions, batch_size):
+            if len(pending) >= concurrency:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending.add(executor.submit(answer_batch, answer_many, batch))
+        collect(wait(pending).done)
+
+    return answered, errors, latencies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Answer the questions of a CSV file with checkpointing and resume."
+    )
+    parser.add_argument("questions", help="CSV file with the questions")
+    parser.add_argument("output", help="JSONL file the results are appended to")
+    parser.add_argument(
+        "--column",
+        help="column of the questions (default: 'question' or the first column)",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=4, help="number of batches in flight"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=8,
+        help="questions answered together by RAG.query_many (1 with --service-url)",
+    )
+    parser.add_argument(
+        "--exact-cache",
+        action="store_true",
+        help="reuse the answers of exactly repeated questions (in memory, no near-duplicate matching)",
+    )
+    parser.add_argument("--language", default="Deutsch")
+    parser.add_argument("--parties", nargs="+", default=PARTIES)
+    parser.add_argument(
+        "--service-url",
+        default=os.environ.get("RAG_SERVICE_URL"),
+        help="URL of a running query service (default: run the RAG engine in this process)",
+    )
+    args = parser.parse_args()
+
+    if args.service_url:
+        # The service batches concurrent requests itself
+        batch_size = 1
+
+        def answer_many(questions):
+            client = RAGClient(
+                args.service_url, parties=args.parties, language=args.language
+            )
+            responses = [client.query(question) for question in questions]
+            return responses, client.query_stats
+
+    else:
+        batch_size = args.batch_size
+        # A dedicated engine, so eval traffic never reads or fills the app's response cache
+        engine = build_rag(response_cache="exact" if args.exact_cache else None)
+
+        def answer_many(questions):
+            rag = session_rag(engine, args.language, args.parties)
+            return rag.query_many(questions), rag.query_stats
+
+    done = read_checkpoint(args.output)
+    if len(done) > 0:
+        print(f"Resuming: skipping {len(done)} answered questions in {args.output}")
+    questions = (
+        (row_number, question)
+        for row_number, question in read_questions(args.questions, args.column)
+        if row_number not in done
+    )
+
+    writer = CheckpointWriter(args.output)
+    start = time.perf_counter()
+    try:
+        answered, errors, latencies = run(
+            questions, answer_many, writer, args.concurrency, batch_size
+        )
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - start
+
+    print(f"Answered {answered} questions ({errors} failed) in {elapsed:.1f} s")
+    if answered > 0:
+        print(
+            f"Throughput {answered / elapsed * 60:.1f} questions/min, "
+            f"latency p50 {np.percentile(latencies, 50):.2f} s, "
+            f"p95 {np.percentile(latencies, 95):.2f} s"
+        )
@@ -0,0 +1,129 @@
+import json
+
+import requests
+
+from RAG.service.engine import session_rag
+from RAG.service.serialization import event_from_json, response_from_json
+
+
+class RAGClient:
+    """
+    Client of the RAG query service (see RAG/service/server.py) with the query interface of RAG.
+
+    Args:
+    url: str, base URL of the service (e.g. "http://localhost:8000")
+    parties: list of str, parties to answer for
+    language: str, language of the answers, default is "Deutsch"
+    session_id: hashable, optional, session under which the service schedules the LLM requests
+    timeout: float, timeout of a request in seconds, default is 120
+    """
+
+    def __init__(self, url, parties, language="Deutsch", session_id=None, timeout=120):
+        self.url = url.rstrip("/")
+        self.parties = parties
+        self.language = language
+        self.session_id = session_id
+        self.timeout = timeout
+        self.query_stats = {}
+
+    def query(self, question):
+        """
+        Generates answers for each party given a question (see RAG.query).
+        """
+        result = requests.post(
+            f"{self.url}/query", json=self._request(question), timeout=self.timeout
+        )
+        if result.status_code != 200:
+            raise RuntimeError(
+                f"Query service error {result.status_code}: {result.text}"
+            )
+        data = result.json()
+        self.query_stats = data["query_stats"]
+        return response_from_json(data["response"])
+
+    def stream_query(self, question):
+        """
+        Generates answers for each party given a question and yields them as they arrive (see RAG.stream_query).
+        """
+        with requests.post(
+            f"{self.url}/stream",
+            json=self._request(question),
+            timeout=self.timeout,
+            stream=True,
+        ) as result:
+            if result.status_code != 200:
+                raise RuntimeError(
+                    f"Query service error {result.status_code}: {result.text}"
+                )
+            for line in result.iter_lines():
+                if not line:
+                    continue
+                event_type, party, content = event_from_json(json.loads(line))
+                # Errors of a party are followed by its regenerated answer
+                if event_type == "error" and party is None:
+                    raise RuntimeError(f"Query service error: {content}")
+                yield event_type, party, content
+
+    def stats(self):
+        """
+        Returns the statistics of the service.
+        """
+        return requests.get(f"{self.url}/health", timeout=self.timeout).json()["stats"]
+
+    def _request(self, question):
+        return {
+            "question": question,
+            "language": self.language,
+            "parties": self.parties,
+            "session_id": self.session_id,
+        }
+
+
+class InProcessRAGClient:
+    """
+    Client that runs queries on a RAG engine in the same process (for local development without the service).
+
+    Args:
+    rag: RAG object, shared engine (see RAG.service.engine.build_rag)
+    parties: list of str, optional, parties to answer for (default is the engine's parties)
+    language: str, language of the answers, default is "Deutsch"
+    session_id: hashable, optional, session under which the LLM requests are scheduled
+    """
+
+    def __init__(self, rag, parties=None, language="Deutsch", session_id=None):
+        self.rag = rag
+        self.parties = list(rag.parties) if parties is None else parties
+        self.language = language
+        self.session_id = session_id
+        self.query_stats = {}
+
+    def query(self, question):
+        """
+        Generates answers for each party given a question (see RAG.query).
+        """
+        rag = self._session_rag()
+        response = rag.query(question)
+        self.query_stats = rag.query_stats
+        return response
+
+    def stream_query(self, question):
+        """
+        Generates answers for each party given a question and yields them as they arrive (see RAG.stream_query).
+        """
+        rag = self._session_rag()
+        yield from rag.stream_query(question)
+        self.query_stats = rag.query_stats
+
+    def stats(self):
+        """
+        Returns the statistics of the engine's response cache and LLM scheduler.
+        """
+        stats = {}
+        if self.rag.cache is not None:
+            stats["response_cache"] = self.rag.cache.stats
+        if self.rag.scheduler is not None:
+            stats["llm_scheduler"] = self.rag.scheduler.stats
+        return stats
+
+    def _session_rag(self):
+        return session_rag(self.rag, self.language, self.parties, self.session_id)
@@ -0,0 +1,146 @@
+import copy
+import os
+
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+from RAG.database.vector_database import VectorDatabase
+from RAG.models.RAG import RAG
+from RAG.models.cache import ResponseCache, RetrievalCache
+from RAG.models.context import ContextBuilder
+from RAG.models.latency import LatencyTracker
+from RAG.models.scheduler import LLMScheduler
+from RAG.models.single_flight import SingleFlight
+
+DATABASE_DIR_MANIFESTOS = "./data/manifestos/chroma/openai"
+DATABASE_DIR_DEBATES = "./data/debates/chroma/openai"
+# Exported bundles (see RAG/scripts/export_bundles.py) are memory-mapped and preferred if they exist:
+BUNDLE_DIR_MANIFESTOS = "./data/manifestos/bundle/openai"
+BUNDLE_DIR_DEBATES = "./data/debates/bundle/openai"
+# Without bundles, "numpy" keeps all embeddings in memory and searches them exactly, "chroma" searches the Chroma databases:
+DATABASE_BACKEND = "numpy"
+# Per-party BM25 indexes answer single-keyword questions without an embedding call (prebuilt in bundles):
+LEXICAL_INDEX = True
+# SQLite file of the response cache, the Docker image sets it to a writable volume (see Dockerfile):
+RESPONSE_CACHE_PATH = os.environ.get(
+    "RESPONSE_CACHE_PATH", "./data/cache/response_cache.sqlite"
+)
+PARTIES = ["cdu", "spd", "gruene", "fdp", "linke", "afd"]
+TEMPERATURE = 0.0
+# Token budget of the retrieved context in each party prompt (None for no limit):
+MAX_CONTEXT_TOKENS = 1500
+# Limits of all LLM requests (the scheduler retries rate-limited requests, so the client does not):
+LLM_MAX_CONCURRENCY = 32
+LLM_REQUESTS_PER_MINUTE = 3500
+LLM_TOKENS_PER_MINUTE = 160000
+# Retries of a failed party answer, and the latency percentile after which a duplicate request is sent for a slow party:
+LLM_MAX_RETRIES = 2
+LLM_HEDGE_PERCENTILE = 95
+# "per_party" sends one completion per party, "combined" one JSON completion for all parties (see RAG/scripts/benchmark_generation_modes.py):
+GENERATION_MODE = "per_party"
+
+
+def load_db(embedding_model, source_type, database_directory, bundle_directory):
+    """
+    Loads a database from its bundle if it has been exported, otherwise from its Chroma directory.
+    """
+    if os.path.exists(bundle_directory):
+        return VectorDatabase(
+            embedding_model=embedding_model,
+            source_type=source_type,
+            database_directory=bundle_directory,
+            backend="bundle",
+            lexical=LEXICAL_INDEX,
+        )
+    return VectorDatabase(
+        embedding_model=embedding_model,
+        source_type=source_type,
+        database_directory=database_directory,
+        backend=DATABASE_BACKEND,
+        lexical=LEXICAL_INDEX,
+    )
+
+
+def build_rag(response_cache="persistent"):
+    """
+    Builds the RAG engine with its databases, caches and LLM scheduler (shared by all sessions of a process).
+
+    Args:
+    response_cache: str, "persistent" for the near-duplicate matching response cache at RESPONSE_CACHE_PATH
+        (shared with the app), "exact" for an in-memory cache of exactly repeated questions, or None for
+        no response cache, default is "persistent"
+
+    Returns:
+    rag: RAG object
+    """
+    assert response_cache in [
+        "persistent",
+        "exact",
+        None,
+    ], f"Unknown response cache {response_cache}"
+    cache = None
+    if response_cache == "persistent":
+        cache = ResponseCache(path=RESPONSE_CACHE_PATH)
+    elif response_cache == "exact":
+        cache = ResponseCache(similarity_threshold=None)
+
+    embedding_model = OpenAIEmbeddings(model="text-embedding-3-large")
+    llm = ChatOpenAI(
+        model_name="gpt-3.5-turbo",
+        max_tokens=400,
+        temperature=TEMPERATURE,
+        max_retries=0,
+    )
+    return RAG(
+        databases=[
+            load_db(
+                embedding_model,
+                "manifestos",
+                DATABASE_DIR_MANIFESTOS,
+                BUNDLE_DIR_MANIFESTOS,
+            ),
+            load_db(
+                embedding_model, "debates", DATABASE_DIR_DEBATES, BUNDLE_DIR_DEBATES
+            ),
+        ],
+        parties=PARTIES,
+        llm=llm,
+        k=3,
+        cache=cache,
+        retrieval_cache=RetrievalCache(),
+        context_builder=ContextBuilder(
+            max_tokens=MAX_CONTEXT_TOKENS, model_name=llm.model_name
+        ),
+        single_flight=SingleFlight(),
+        scheduler=LLMScheduler(
+            max_concurrency=LLM_MAX_CONCURRENCY,
+            requests_per_minute=LLM_REQUESTS_PER_MINUTE,
+            tokens_per_minute=LLM_TOKENS_PER_MINUTE,
+        ),
+        max_retries=LLM_MAX_RETRIES,
+        hedge_percentile=LLM_HEDGE_PERCENTILE,
+        latency_tracker=LatencyTracker(),
+        generation_mode=GENERATION_MODE,
+    )
+
+
+def session_rag(rag, language=None, parties=None, session_id=None):
+    """
+    Returns a copy of the RAG engine for one request, sharing its databases, caches and scheduler.
+
+    Args:
+    rag: RAG object, shared engine
+    language: str, optional, language of the answers (default is the engine's language)
+    parties: list of str, optional, parties to answer for (default is the engine's parties)
+    session_id: hashable, optional, session under which the LLM requests are scheduled
+
+    Returns:
+    rag: RAG object
+    """
+    request_rag = copy.copy(rag)
+    if language is not None:
+        request_rag.language = language
+    if parties is not None:
+        request_rag.parties = list(parties)
+    request_rag.session_id = session_id
+    request_rag.query_stats = {"embedding_calls": 0}
+    return request_rag
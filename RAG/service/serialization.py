@@ -0,0 +1,60 @@
+from langchain_core.documents import Document
+
+
+def response_to_json(response):
+    """
+    Converts a formatted response (see RAG.format_response) into a JSON-serializable dictionary.
+    """
+    return dict(
+        response,
+        docs={
+            source_type: {
+                party: [
+                    {"page_content": doc.page_content, "metadata": doc.metadata}
+                    for doc in docs
+                ]
+                for party, docs in party_docs.items()
+            }
+            for source_type, party_docs in response["docs"].items()
+        },
+    )
+
+
+def response_from_json(data):
+    """
+    Converts a dictionary created by response_to_json back into a formatted response with Document objects.
+    """
+    return dict(
+        data,
+        docs={
+            source_type: {
+                party: [
+                    Document(page_content=doc["page_content"], metadata=doc["metadata"])
+                    for doc in docs
+                ]
+                for party, docs in party_docs.items()
+            }
+            for source_type, party_docs in data["docs"].items()
+        },
+    )
+
+
+def event_to_json(event_type, party, content):
+    """
+    Converts an event of RAG.stream_query into a JSON-serializable dictionary.
+    """
+    if event_type == "response":
+        content = response_to_json(content)
+    elif event_type == "error":
+        content = str(content)
+    return {"event": event_type, "party": party, "content": content}
+
+
+def event_from_json(data):
+    """
+    Converts a dictionary created by event_to_json back into an event tuple (event_type, party, content).
+    """
+    content = data["content"]
+    if data["event"] == "response":
+        content = response_from_json(content)
+    return data["event"], data["party"], content
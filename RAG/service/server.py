@@ -0,0 +1,294 @@
+# Standalone query service: holds one copy of the RAG engine (databases, caches, LLM scheduler)
+# and serves the app replicas over HTTP (see RAG/service/client.py).
+# Run from the repository root: python -m RAG.service.server --port 8000 --workers 8
+import argparse
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+from RAG.models.cache import normalize_question
+from RAG.service.engine import build_rag, session_rag
+from RAG.service.serialization import event_to_json, response_to_json
+
+
+class RAGService:
+    """
+    Asynchronous front of a RAG engine that runs queries in a pool of worker threads.
+
+    Query requests arriving within a short batching window are collected into a batch. The requests
+    of a batch with the same language and parties are answered together by RAG.query_many (which
+    embeds their questions in one request and answers identical questions once), and the groups
+    run concurrently on the workers. The LLM requests of each question are scheduled under the
+    session that asked it, and if a group fails, its requests are answered (and fail) one by one.
+
+    Args:
+    rag: RAG object, shared engine
+    workers: int, number of worker threads running queries, default is 8
+    batch_window: float, time in seconds during which requests are collected into a batch, default is 0.01
+    max_batch_size: int, maximum number of requests in a batch, default is 32
+    """
+
+    def __init__(self, rag, workers=8, batch_window=0.01, max_batch_size=32):
+        self.rag = rag
+        self.workers = workers
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+        self.requests = 0
+        self.batches = 0
+        self.coalesced = 0
+        self._queue = None
+        self._batcher = None
+
+    async def start(self):
+        """
+        Starts collecting batches (on the running event loop).
+        """
+        self._queue = asyncio.Queue()
+        self._batcher = asyncio.ensure_future(self._collect_batches())
+
+    async def stop(self):
+        """
+        Stops collecting batches and shuts down the workers.
+        """
+        if self._batcher is not None:
+            self._batcher.cancel()
+        self.executor.shutdown(wait=False)
+
+    async def query(self, question, language=None, parties=None, session_id=None):
+        """
+        Answers a question (see RAG.query).
+
+        Returns:
+        response: dict, formatted response
+        query_stats: dict, query statistics of the RAG engine
+        """
+        self.requests += 1
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(((question, language, parties, session_id), future))
+        return await future
+
+    async def stream_query(
+        self, question, language=None, parties=None, session_id=None
+    ):
+        """
+        Answers a question and yields the events of RAG.stream_query as they arrive (errors as "error" events).
+        """
+        self.requests += 1
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        rag = session_rag(self.rag, language, parties, session_id)
+
+        def run():
+            try:
+                for event in rag.stream_query(question):
+                    loop.call_soon_threadsafe(events.put_nowait, event)
+            except Exception as e:
+                loop.call_soon_threadsafe(events.put_nowait, ("error", None, e))
+            finally:
+                loop.call_soon_threadsafe(events.put_nowait, None)
+
+        loop.run_in_executor(self.executor, run)
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            yield event
+
+    @property
+    def stats(self):
+        """
+        Returns counters of the service (requests, batches, coalesced requests) and the engine's caches and scheduler.
+        """
+        stats = {
+            "requests": self.requests,
+            "batches": self.batches,
+            "coalesced": self.coalesced,
+            "workers": self.workers,
+        }
+        if self.rag.cache is not None:
+            stats["response_cache"] = self.rag.cache.stats
+        if self.rag.scheduler is not None:
+            stats["llm_scheduler"] = self.rag.scheduler.stats
+        return stats
+
+    async def _collect_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self.batches += 1
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+
+        # Requests with the same language and parties are answered together by RAG.query_many
+        groups = {}
+        for request, future in batch:
+            _, language, parties, _ = request
+            key = (language, None if parties is None else tuple(parties))
+            groups.setdefault(key, []).append((request, future))
+
+        for group in groups.values():
+            questions = {normalize_question(request[0]) for request, _ in group}
+            self.coalesced += len(group) - len(questions)
+            task = loop.run_in_executor(
+                self.executor, self._query, [request for request, _ in group]
+            )
+            task.add_done_callback(
+                lambda task, group=group: self._resolve(task, group)
+            )
+
+    def _query(self, requests):
+        """
+        Answers the requests of a group (same language and parties) and returns a (response, query_stats) tuple
+        or the raised exception for each.
+        """
+        question, language, parties, session_id = requests[0]
+        if len(requests) == 1:
+            rag = session_rag(self.rag, language, parties, session_id)
+            try:
+                # Single requests are coalesced with identical concurrent queries of other batches
+                return [(rag.query(question), rag.query_stats)]
+            except Exception as e:
+                return [e]
+
+        rag = session_rag(self.rag, language, parties)
+        try:
+            responses = rag.query_many(
+                [request[0] for request in requests],
+                session_ids=[request[3] for request in requests],
+            )
+        except Exception as e:
+            # Answer the requests separately, so only the failing ones get the error
+            print(f"Batched query failed, answering the requests one by one: {e}")
+            return [self._query([request])[0] for request in requests]
+        return [(response, rag.query_stats) for response in responses]
+
+    def _resolve(self, task, group):
+        for i, (_, future) in enumerate(group):
+            if future.cancelled():
+                continue
+            if task.exception() is not None:
+                future.set_exception(task.exception())
+            elif isinstance(task.result()[i], Exception):
+                future.set_exception(task.result()[i])
+            else:
+                future.set_result(task.result()[i])
+
+
+def parse_request(data):
+    """
+    Validates the JSON body of a query request and returns (question, language, parties, session_id).
+    """
+    if not isinstance(data, dict) or not isinstance(data.get("question"), str):
+        raise web.HTTPBadRequest(text="Request must contain a question")
+    if len(data["question"].strip()) == 0:
+        raise web.HTTPBadRequest(text="Question must not be empty")
+    parties = data.get("parties")
+    if parties is not None and not (
+        isinstance(parties, list) and all(isinstance(p, str) for p in parties)
+    ):
+        raise web.HTTPBadRequest(text="Parties must be a list of strings")
+    return data["question"], data.get("language"), parties, data.get("session_id")
+
+
+async def read_request(request):
+    try:
+        data = await request.json()
+    except json.JSONDecodeError:
+        raise web.HTTPBadRequest(text="Request body must be JSON")
+    return parse_request(data)
+
+
+async def handle_query(request):
+    service = request.app["service"]
+    question, language, parties, session_id = await read_request(request)
+    try:
+        response, query_stats = await service.query(
+            question, language, parties, session_id
+        )
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return web.json_response({"error": str(e)}, status=502)
+    return web.json_response(
+        {"response": response_to_json(response), "query_stats": query_stats}
+    )
+
+
+async def handle_stream(request):
+    service = request.app["service"]
+    question, language, parties, session_id = await read_request(request)
+
+    # Events are sent as newline-delimited JSON
+    stream = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    await stream.prepare(request)
+    async for event in service.stream_query(question, language, parties, session_id):
+        line = json.dumps(event_to_json(*event), ensure_ascii=False) + "\n"
+        await stream.write(line.encode("utf-8"))
+    await stream.write_eof()
+    return stream
+
+
+async def handle_health(request):
+    return web.json_response({"status": "ok", "stats": request.app["service"].stats})
+
+
+def create_app(service):
+    """
+    Creates the aiohttp application of a RAGService.
+
+    Endpoints:
+    POST /query: {"question", "language", "parties", "session_id"} -> {"response", "query_stats"}
+    POST /stream: same request, newline-delimited JSON events {"event", "party", "content"}
+    GET /health: {"status", "stats"}
+    """
+    app = web.Application()
+    app["service"] = service
+
+    async def on_startup(app):
+        await service.start()
+
+    async def on_cleanup(app):
+        await service.stop()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.add_routes(
+        [
+            web.post("/query", handle_query),
+            web.post("/stream", handle_stream),
+            web.get("/health", handle_health),
+        ]
+    )
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the RAG query service.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--batch-window", type=float, default=0.01)
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    service = RAGService(
+        build_rag(),
+        workers=args.workers,
+        batch_window=args.batch_window,
+        max_batch_size=args.max_batch_size,
+    )
+    web.run_app(create_app(service), host=args.host, port=args.port)
@@ -0,0 +1,70 @@
+import os
+
+from langchain_community.chat_models.fake import FakeListChatModel
+from langchain_community.embeddings import DeterministicFakeEmbedding
+from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
+
+from RAG.database.vector_database import VectorDatabase
+from RAG.models.RAG import RAG
+
+PARTIES = ["gruene", "spd", "cdu", "afd", "fdp", "linke"]
+TOPICS = ["Klima", "Migration", "Rente", "Energie", "Steuern", "Europa"]
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    """Deterministic fake embeddings that count the embedded texts."""
+
+    calls: int = 0
+    texts: int = 0
+
+    def embed_query(self, text):
+        object.__setattr__(self, "calls", self.calls + 1)
+        object.__setattr__(self, "texts", self.texts + 1)
+        return super().embed_query(text)
+
+    def embed_documents(self, texts):
+        object.__setattr__(self, "calls", self.calls + 1)
+        object.__setattr__(self, "texts", self.texts + len(texts))
+        return super().embed_documents(texts)
+
+
+def make_database(embeddings, source_type, directory, backend="numpy"):
+    """
+    Builds a small Chroma database with 6 chunks per party and loads it as VectorDatabase.
+    """
+    docs = [
+        Document(
+            page_content=f"{party} Position {i} zu {TOPICS[i]} in Europa",
+            metadata={"party": party, "page": i},
+        )
+        for party in PARTIES
+        for i in range(len(TOPICS))
+    ]
+    path = os.path.join(directory, source_type)
+    Chroma.from_documents(
+        docs,
+        embeddings,
+        persist_directory=path,
+        collection_metadata={"hnsw:space": "cosine"},
+    )
+    return VectorDatabase(
+        embeddings, source_type, database_directory=path, backend=backend
+    )
+
+
+def fake_llm(n=1000):
+    return FakeListChatModel(responses=[f"Antwort {i}" for i in range(n)])
+
+
+def make_rag(directory, llm=None, embeddings=None, **kwargs):
+    """
+    Returns a RAG engine with fake embeddings, a fake LLM and small manifesto and debate databases.
+    """
+    embeddings = embeddings or CountingEmbeddings(size=16)
+    databases = [
+        make_database(embeddings, "manifestos", str(directory)),
+        make_database(embeddings, "debates", str(directory)),
+    ]
+    kwargs.setdefault("parties", ["spd", "cdu"])
+    return RAG(databases=databases, llm=llm or fake_llm(), k=2, fetch_k=4, **kwargs)
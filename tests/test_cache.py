@@ -0,0 +1,140 @@
+import os
+
+import numpy as np
+from langchain_core.documents import Document
+
+from RAG.models.cache import ResponseCache, RetrievalCache, normalize_question
+
+
+def response(answer):
+    return {"question": "q", "prompt": "p", "docs": [], "answer": answer}
+
+
+def test_normalize_question():
+    assert normalize_question("  Was ist  Klimaschutz?! ") == "was ist klimaschutz"
+
+
+def test_exact_and_partial_hits():
+    cache = ResponseCache()
+    settings = ("Deutsch", "gpt", 3)
+    cache.put("Was ist Klimaschutz?", settings, {"spd": response("a")})
+
+    found = cache.get("was ist klimaschutz", ["spd", "cdu"], settings)
+    assert list(found) == ["spd"]
+    assert cache.get("Was ist Klimaschutz?", ["spd"], ("English", "gpt", 3)) == {}
+    assert cache.stats["hits"] == 1
+
+
+def test_semantic_hit_only_embeds_on_miss():
+    cache = ResponseCache(similarity_threshold=0.9)
+    settings = ("Deutsch", "gpt", 3)
+    cache.put("Rente", settings, {"spd": response("a")}, [1.0, 0.0])
+
+    calls = []
+
+    def embed():
+        calls.append(1)
+        return [0.99, 0.05]
+
+    assert cache.get("Rente", ["spd"], settings, embed)["spd"]["answer"] == "a"
+    assert calls == []
+    assert cache.get("Renten", ["spd"], settings, embed)["spd"]["answer"] == "a"
+    assert calls == [1]
+    assert cache.stats["semantic_hits"] == 1
+
+
+def test_max_size_evicts_least_recently_used():
+    cache = ResponseCache(max_size=2)
+    settings = ("Deutsch", "gpt", 3)
+    for question in ["a", "b", "c"]:
+        cache.put(question, settings, {"spd": response(question)})
+    assert cache.get("a", ["spd"], settings) == {}
+    assert len(cache.get("c", ["spd"], settings)) == 1
+
+
+def test_persisted_entries_of_several_processes(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    settings = ("Deutsch", "gpt", 3)
+    first = ResponseCache(path=path)
+    second = ResponseCache(path=path)
+    first.put("a", settings, {"spd": response("a")}, np.ones(3))
+    second.put("b", settings, {"cdu": response("b")})
+    first.flush()
+    second.flush()
+
+    reloaded = ResponseCache(path=path)
+    assert reloaded.get("a", ["spd"], settings)["spd"]["answer"] == "a"
+    assert reloaded.get("b", ["cdu"], settings)["cdu"]["answer"] == "b"
+
+
+def test_unwritable_path_keeps_cache_in_memory(tmp_path, capsys):
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    cache = ResponseCache(path=os.path.join(str(blocker), "cache.sqlite"))
+    settings = ("Deutsch", "gpt", 3)
+    for question in ["a", "b"]:
+        cache.put(question, settings, {"spd": response(question)})
+        cache.flush()
+
+    assert capsys.readouterr().out.count("Could not persist") == 1
+    assert len(cache.get("b", ["spd"], settings)) == 1
+
+
+def test_retrieval_cache():
+    cache = RetrievalCache(max_size=1)
+    assert cache.get("Frage", "spd", "manifestos", 3, 5) is None
+    cache.put("Frage", "spd", "manifestos", 3, 5, ["id1"])
+    assert cache.get("frage?", "spd", "manifestos", 3, 5) == ["id1"]
+    assert cache.get("frage", "spd", "manifestos", 3, 5, mode="hybrid") is None
+    cache.put_embeddings("Frage", {"manifestos": [1.0]})
+    assert cache.get_embeddings("frage") == {"manifestos": [1.0]}
+
+
+def test_exact_cache_never_embeds():
+    cache = ResponseCache(similarity_threshold=None)
+    settings = ("Deutsch", "gpt", 3)
+    cache.put("Rente", settings, {"spd": response("a")}, [1.0, 0.0])
+
+    def embed():
+        raise AssertionError("embedded")
+
+    assert cache.get("rente?", ["spd"], settings, embed)["spd"]["answer"] == "a"
+    assert cache.get("Renten", ["spd"], settings, embed) == {}
+
+
+def test_persisted_documents_and_unstorable_entries(tmp_path, capsys):
+    path = str(tmp_path / "cache.sqlite")
+    settings = ("Deutsch", "gpt", 3)
+    cache = ResponseCache(path=path)
+    docs = {"manifestos": [Document(page_content="Text", metadata={"page": 2})]}
+    cache.put("a", settings, {"spd": dict(response("a"), docs=docs)}, [3.0, 4.0])
+    # An entry that cannot be serialized must not stop the writer
+    cache.put("b", settings, {"spd": dict(response("b"), docs=object())})
+    cache.put("c", settings, {"spd": response("c")})
+    cache.flush()
+    assert "cannot be stored" in capsys.readouterr().out
+
+    reloaded = ResponseCache(path=path)
+    assert reloaded.get("a", ["spd"], settings)["spd"]["docs"] == docs
+    assert reloaded.get("b", ["spd"], settings) == {}
+    assert reloaded.get("c", ["spd"], settings)["spd"]["answer"] == "c"
+    # The embedding is restored for near-duplicate matching
+    assert reloaded.get("x", ["spd"], settings, lambda: [0.6, 0.8]) != {}
+
+
+def test_writer_survives_unexpected_errors(tmp_path, monkeypatch):
+    path = str(tmp_path / "cache.sqlite")
+    settings = ("Deutsch", "gpt", 3)
+    cache = ResponseCache(path=path)
+    write = cache._write
+
+    def failing_write(connection, new_entries):
+        monkeypatch.setattr(cache, "_write", write)
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(cache, "_write", failing_write)
+    cache.put("a", settings, {"spd": response("a")})
+    cache.flush()
+    cache.put("b", settings, {"spd": response("b")})
+    cache.flush()
+    assert len(ResponseCache(path=path).get("b", ["spd"], settings)) == 1
@@ -0,0 +1,74 @@
+import pytest
+from langchain_core.documents import Document
+
+from RAG.database.chunk_cache import (
+    ChunkCache,
+    cached_splits,
+    documents_to_table,
+    table_to_documents,
+)
+
+
+def counting(function, calls):
+    def wrapper(arg):
+        calls.append(function.__name__)
+        return function(arg)
+
+    return wrapper
+
+
+def parse(path):
+    return [Document(page_content="a b c d e f", metadata={"source": path})]
+
+
+def split(documents):
+    return [
+        Document(page_content=word, metadata=dict(doc.metadata, page=i))
+        for doc in documents
+        for i, word in enumerate(doc.page_content.split())
+    ]
+
+
+def test_without_cache_parses_every_time():
+    calls = []
+    for _ in range(2):
+        splits = cached_splits(
+            None, "a.pdf", None, {}, counting(parse, calls), counting(split, calls)
+        )
+    assert [s.page_content for s in splits] == ["a", "b", "c", "d", "e", "f"]
+    assert calls == ["parse", "split"] * 2
+
+
+def test_cache_reuses_parsed_documents_and_splits(tmp_path):
+    pytest.importorskip("pyarrow")
+    cache = ChunkCache(str(tmp_path))
+    calls = []
+
+    def load(path, params):
+        return cached_splits(
+            cache, path, "hash", params, counting(parse, calls), counting(split, calls)
+        )
+
+    first = load("a.pdf", {"chunk_size": 1})
+    assert calls == ["parse", "split"]
+    assert load("a.pdf", {"chunk_size": 1}) == first
+    assert calls == ["parse", "split"]
+
+    # Other splitter parameters only re-split the cached text
+    load("a.pdf", {"chunk_size": 2})
+    assert calls == ["parse", "split", "split"]
+
+    # The same file under another path gets the new source
+    moved = load("moved/a.pdf", {"chunk_size": 1})
+    assert [s.metadata for s in moved] == [
+        {"source": "moved/a.pdf", "page": i} for i in range(6)
+    ]
+
+
+def test_missing_metadata_round_trips():
+    pytest.importorskip("pyarrow")
+    documents = [
+        Document(page_content="a", metadata={"party": "spd", "page": 1}),
+        Document(page_content="b", metadata={"party": "cdu"}),
+    ]
+    assert table_to_documents(documents_to_table(documents)) == documents
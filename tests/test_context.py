@@ -0,0 +1,82 @@
+import pytest
+import tiktoken
+from langchain_core.documents import Document
+
+from RAG.models import context
+from RAG.models.context import (
+    ContextBuilder,
+    remove_overlap,
+    remove_trailing_overlap,
+)
+from tests.fakes import make_rag
+
+
+@pytest.fixture(autouse=True)
+def offline_tiktoken(monkeypatch):
+    # tiktoken downloads its tokenizer files on first use, the tests run without network access
+    def fail(*args, **kwargs):
+        raise ConnectionError("no network")
+
+    monkeypatch.setattr(tiktoken, "encoding_for_model", fail)
+    monkeypatch.setattr(tiktoken, "get_encoding", fail)
+
+
+def test_remove_overlap():
+    previous = "Der Klimaschutz ist eine zentrale Aufgabe der Europäischen Union."
+    text = "eine zentrale Aufgabe der Europäischen Union. Deshalb fordern wir"
+    assert remove_overlap(previous, text) == "Deshalb fordern wir"
+    assert remove_overlap(previous, "Etwas ganz anderes") == "Etwas ganz anderes"
+    assert remove_trailing_overlap(previous, text) == "Der Klimaschutz ist"
+
+
+def test_overlap_is_removed_in_both_orders():
+    first = "Der Klimaschutz ist eine zentrale Aufgabe der Europäischen Union."
+    second = "eine zentrale Aufgabe der Europäischen Union. Deshalb fordern wir"
+    builder = ContextBuilder()
+    for docs in [[first, second], [second, first]]:
+        built = builder.build(
+            {"manifestos": [Document(page_content=doc) for doc in docs]}
+        )
+        assert built.count("zentrale Aufgabe") == 1
+        assert "Der Klimaschutz ist" in built and "Deshalb fordern wir" in built
+
+
+def test_tokens_are_approximated_without_tokenizer():
+    builder = ContextBuilder()
+    assert builder.count_tokens("a" * 40) == 10
+    assert builder.approximate
+
+
+def test_budget_falls_back_to_approximate_tokens():
+    builder = ContextBuilder(max_tokens=120, min_chunk_tokens=5)
+    docs = {
+        "manifestos": [Document(page_content=f"Text {i} " + "x" * 99) for i in [0, 1]],
+        "debates": [Document(page_content=f"Rede {i} " + "y" * 99) for i in [0, 1]],
+    }
+    built = builder.build(docs)
+    assert isinstance(builder.encoding, context.ApproximateEncoding)
+    assert builder.count_tokens(built) <= 120 + 10
+    # Chunks are taken alternately from both sources, the last one is truncated
+    assert "Text 0" in built and "Rede 0" in built
+    assert " ...\n" in built
+
+
+def test_query_without_network(tmp_path):
+    rag = make_rag(tmp_path)
+    response = rag.query("Was ist Klimaschutz?")
+    assert set(response["answer"]) == {"spd", "cdu"}
+    assert rag.query_stats["prompt_tokens"]["spd"] > 0
+    assert rag.query_stats["prompt_tokens_estimated"]
+
+
+def test_prompt_tokens_are_counted_with_the_tokenizer(tmp_path, monkeypatch):
+    class WordEncoding:
+        def encode(self, text):
+            return text.split()
+
+    monkeypatch.setattr(tiktoken, "encoding_for_model", lambda model: WordEncoding())
+    rag = make_rag(tmp_path)
+    response = rag.query("Was ist Klimaschutz?")
+    prompt = response["prompt"]["spd"]
+    assert rag.query_stats["prompt_tokens"]["spd"] == len(prompt.split())
+    assert not rag.query_stats["prompt_tokens_estimated"]
@@ -0,0 +1,114 @@
+import asyncio
+import re
+from types import SimpleNamespace
+
+from RAG.evaluation.evaluation import Evaluator, JudgmentCache, parse_judgments
+
+
+class FakeJudgeClient:
+    """Fake AsyncOpenAI client that judges documents mentioning "Klima" as relevant."""
+
+    def __init__(self):
+        self.prompts = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, model, temperature, messages):
+        prompt = messages[0]["content"]
+        self.prompts.append(prompt)
+        documents = re.findall(r"Dokument \d+: (.*)", prompt)
+        content = ", ".join("1" if "Klima" in doc else "0" for doc in documents)
+        message = SimpleNamespace(content=content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+DATASET = {
+    "spd": [
+        {"question": "Klima?", "contexts": ["Klimaschutz", "Rente"]},
+        {"question": "Rente?", "contexts": ["Rente", "Steuern"]},
+    ],
+    "cdu": [{"question": "Klima?", "contexts": ["Klimaziele", "Klimaschutz"]}],
+}
+
+
+def test_parse_judgments():
+    assert parse_judgments("0, 1, 1", 3) == [0, 1, 1]
+    assert parse_judgments("[1,0]\n", 2) == [1, 0]
+    assert parse_judgments("0, 1", 3) is None
+    assert parse_judgments("0, 2", 2) is None
+    assert parse_judgments("Dokument 1 ist relevant", 1) is None
+
+
+def test_judgment_cache_is_persisted(tmp_path):
+    path = str(tmp_path / "judgments" / "cache.jsonl")
+    cache = JudgmentCache(path)
+    cache.put("Klima?", ["a", "b"], "gpt", [1, 0])
+    with open(path, "a") as file:
+        file.write('{"question": "Kli')
+
+    loaded = JudgmentCache(path)
+    assert len(loaded) == 2
+    assert loaded.get("Klima?", "a", "gpt") == 1
+    assert loaded.get("Klima?", "b", "gpt") == 0
+    assert loaded.get("Klima?", "a", "gpt-4") is None
+
+
+def test_evaluation_only_judges_new_documents(tmp_path):
+    path = str(tmp_path / "cache.jsonl")
+    client = FakeJudgeClient()
+    evaluator = Evaluator(cache_path=path, client=client)
+    results, aggregate = evaluator.evaluate_context_relevancy(DATASET)
+    assert results["Klima?"] == {
+        "spd": {"context_relevancy": 0.5},
+        "cdu": {"context_relevancy": 1.0},
+    }
+    assert aggregate["spd"] == {"mean": 0.25, "scored": 2, "failed": 0}
+    assert aggregate["overall"]["scored"] == 3
+    assert len(client.prompts) == 3
+
+    # A new run with the same cache only judges the new document
+    new_row = {"question": "Rente?", "contexts": ["Rente", "Klimageld"]}
+    dataset = dict(DATASET, linke=[new_row])
+    client = FakeJudgeClient()
+    evaluator = Evaluator(cache_path=path, client=client)
+    results, _ = evaluator.evaluate_context_relevancy(dataset)
+    assert results["Rente?"]["linke"] == {"context_relevancy": 0.5}
+    assert evaluator.requests == 1
+    assert "Dokument 1: Klimageld" in client.prompts[0]
+
+
+def test_unparsable_judgment_fails_the_row():
+    client = FakeJudgeClient()
+
+    async def create(model, temperature, messages):
+        message = SimpleNamespace(content="Ich weiß es nicht")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    client.chat.completions.create = create
+    evaluator = Evaluator(client=client)
+    _, aggregate = evaluator.evaluate_context_relevancy({"spd": DATASET["spd"]})
+    assert aggregate["overall"] == {"mean": None, "scored": 0, "failed": 2}
+    assert len(evaluator.cache) == 0
+
+
+def test_empty_judgment_fails_the_row():
+    client = FakeJudgeClient()
+
+    async def create(model, temperature, messages):
+        message = SimpleNamespace(content=None)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    client.chat.completions.create = create
+    evaluator = Evaluator(client=client)
+    _, aggregate = evaluator.evaluate_context_relevancy(DATASET)
+    assert aggregate["overall"] == {"mean": None, "scored": 0, "failed": 3}
+
+
+def test_streamed_aggregates_are_snapshots():
+    evaluator = Evaluator(client=FakeJudgeClient())
+
+    async def collect():
+        return [u async for u in evaluator.astream_context_relevancy(DATASET)]
+
+    updates = asyncio.run(collect())
+    scored = [update["aggregate"]["overall"]["scored"] for update in updates]
+    assert scored == [1, 2, 3]
@@ -0,0 +1,73 @@
+import pickle
+
+from RAG.database.lexical_index import (
+    BM25Index,
+    is_single_keyword,
+    reciprocal_rank_fusion,
+    tokenize_german,
+)
+
+
+def make_index():
+    texts = [
+        "Wir wollen den Klimaschutz stärken und die Energiewende beschleunigen.",
+        "Klimaschutz, Klimaschutz und nochmals Klimaschutz.",
+        "Die Rente muss sicher sein.",
+        "Klimaschutzes wegen fordern wir mehr Windkraft.",
+    ]
+    metadatas = [{"party": "spd"}, {"party": "spd"}, {"party": "spd"}, {"party": "cdu"}]
+    return BM25Index(["id0", "id1", "id2", "id3"], texts, metadatas)
+
+
+def test_tokenizer_stems_and_drops_stopwords():
+    tokens = tokenize_german("Die Rente und der Klimaschutz")
+    assert tokens == tokenize_german("Renten Klimaschutz")
+    assert len(tokens) == 2
+    assert tokenize_german("Klimaschutzes") == tokenize_german("Klimaschutz")
+    assert tokenize_german("Größe") == tokenize_german("Grosse")
+
+
+def test_stemmer_merges_inflections_without_over_stemming():
+    for forms in [
+        "Migration Migrationen",
+        "Steuer Steuern",
+        "Schule Schulen",
+        "Land Länder Ländern",
+    ]:
+        assert len(set(tokenize_german(forms))) == 1, forms
+    for words in ["Rente Rennen", "Rente Rentner", "Wert Wer"]:
+        assert len(set(tokenize_german(words, remove_stopwords=False))) == 2, words
+
+
+def test_single_keyword():
+    assert is_single_keyword("Klimaschutz")
+    assert is_single_keyword(" Rente? ")
+    assert not is_single_keyword("Was sagt die SPD zur Rente?")
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "c", "d"]])
+    assert fused == ["b", "c", "a", "d"]
+
+
+def test_bm25_ranks_within_the_party():
+    index = make_index()
+    results = index.search("Klimaschutz", "spd", k=3)
+    # Only matching chunks are returned, the most frequent match first
+    assert [id_ for id_, _ in results] == ["id1", "id0"]
+    assert results[0][1] > results[1][1] > 0
+    assert [id_ for id_, _ in index.search("Klimaschutz", "cdu")] == ["id3"]
+    assert index.search("Klimaschutz", "afd") == []
+    assert index.search("und die", "spd") == []
+
+
+def test_bm25_save_and_load(tmp_path):
+    index = make_index()
+    path = str(tmp_path / "lexical_index.pkl")
+    index.save(path)
+    loaded = BM25Index.load(path)
+    assert loaded.search("Rente", "spd") == index.search("Rente", "spd")
+
+    with open(path, "wb") as file:
+        pickle.dump({"version": 0, "index": index}, file)
+    assert BM25Index.load(path) is None
@@ -0,0 +1,95 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from RAG.database import numpy_index
+from RAG.database.numpy_index import (
+    NumpyVectorIndex,
+    batched_maximal_marginal_relevance_indices,
+    maximal_marginal_relevance_indices,
+)
+
+
+def make_index(n=300, dim=16, dtype="float32", seed=0):
+    rng = np.random.default_rng(seed)
+    embeddings = rng.normal(size=(n, dim))
+    parties = ["spd", "cdu", "afd"]
+    return NumpyVectorIndex(
+        ids=[f"id{i}" for i in range(n)],
+        embeddings=embeddings,
+        documents=[f"text {i}" for i in range(n)],
+        metadatas=[{"party": parties[i % 3]} for i in range(n)],
+        dtype=dtype,
+    ), rng
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16", "int8"])
+def test_top_k_matches_exact_search(dtype, monkeypatch):
+    # Small blocks, so the blockwise conversion is exercised
+    monkeypatch.setattr(numpy_index, "SEARCH_BLOCK_SIZE", 7)
+    reference, rng = make_index()
+    index, _ = make_index(dtype=dtype)
+    query = rng.normal(size=16)
+
+    party = {"party": "spd"}
+    expected = reference.similarity_search_ids_by_vector(query, k=5, filter=party)
+    found = index.similarity_search_ids_by_vector(query, k=5, filter=party)
+    assert len(set(found) & set(expected)) >= 4
+    assert all(int(id_[2:]) % 3 == 0 for id_ in found)
+
+
+def test_quantized_search_does_not_copy_the_matrix():
+    index, rng = make_index(n=20000, dim=256, dtype="int8")
+    query = rng.normal(size=256)
+    index.similarity_search_ids_by_vector(query, k=3)
+
+    tracemalloc.start()
+    index.similarity_search_ids_by_vector(query, k=3)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    # A float32 copy of the matrix would take 20000 * 256 * 4 bytes
+    assert peak < 20000 * 256 * 4 / 4
+
+
+def test_batched_mmr_matches_single_party_mmr():
+    index, rng = make_index()
+    query = rng.normal(size=16)
+    batched = index.max_marginal_relevance_search_ids_for_parties(
+        query, ["spd", "cdu", "gruene"], k=3, fetch_k=10
+    )
+    for party in ["spd", "cdu"]:
+        ids, docs = index.max_marginal_relevance_search_ids_by_vector(
+            query, k=3, fetch_k=10, filter={"party": party}
+        )
+        assert batched[party][0] == ids
+        assert [doc.page_content for doc in batched[party][1]] == [
+            doc.page_content for doc in docs
+        ]
+    assert batched["gruene"] == ([], [])
+
+
+def test_mmr_indices_prefer_diverse_candidates():
+    query = np.array([1.0, 0.0])
+    candidates = np.array([[1.0, 0.0], [1.0, 0.0], [0.7, 0.7]])
+    candidates = candidates / np.linalg.norm(candidates, axis=1, keepdims=True)
+    selected = maximal_marginal_relevance_indices(
+        query, candidates, k=2, lambda_mult=0.3
+    )
+    assert selected == [0, 2]
+
+    selected = batched_maximal_marginal_relevance_indices(
+        query, candidates[None], np.ones((1, 3), dtype=bool), k=2, lambda_mult=0.3
+    )
+    assert sorted(selected[0]) == [0, 2]
+
+
+def test_bundle_round_trip(tmp_path):
+    index, rng = make_index(dtype="int8")
+    index.save_bundle(str(tmp_path / "bundle"), source_type="manifestos")
+    loaded = NumpyVectorIndex.from_bundle(str(tmp_path / "bundle"))
+    query = rng.normal(size=16)
+    assert loaded.similarity_search_ids_by_vector(
+        query, k=5
+    ) == index.similarity_search_ids_by_vector(query, k=5)
+    assert loaded.get_documents(["id3"])[0].metadata == {"party": "spd"}
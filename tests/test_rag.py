@@ -0,0 +1,160 @@
+import threading
+import time
+from concurrent.futures import Future
+
+from langchain_community.chat_models.fake import FakeListChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from RAG.models.cache import ResponseCache
+from RAG.models.latency import LatencyTracker
+from tests.fakes import CountingEmbeddings, make_rag
+
+
+class RecordingScheduler:
+    """Fake LLM scheduler that answers immediately and records the session of each request."""
+
+    def __init__(self):
+        self.sessions = {}
+
+    def submit(self, llm, prompt, session_id=None, tokens=0):
+        self.sessions.setdefault(session_id, []).append(prompt)
+        future = Future()
+        future.set_result(AIMessage(content=f"Antwort {session_id}"))
+        return future
+
+
+def test_query_many_embeds_all_questions_in_one_call(tmp_path):
+    embeddings = CountingEmbeddings(size=16)
+    rag = make_rag(tmp_path, embeddings=embeddings, cache=ResponseCache())
+    embeddings_calls = embeddings.calls
+
+    responses = rag.query_many(["Klima?", "Rente?", "Europa?"])
+    assert [response["question"] for response in responses] == [
+        "Klima?",
+        "Rente?",
+        "Europa?",
+    ]
+    assert embeddings.calls - embeddings_calls == 1
+    assert rag.query_stats["embedding_calls"] == 1
+
+
+def test_query_many_schedules_each_question_under_its_session(tmp_path):
+    scheduler = RecordingScheduler()
+    rag = make_rag(tmp_path, scheduler=scheduler)
+
+    responses = rag.query_many(
+        ["Klima?", "Rente?", "klima"], session_ids=["a", "b", "c"]
+    )
+    # Each question is answered for both parties, the duplicate question only once
+    sessions = scheduler.sessions
+    assert {session: len(prompts) for session, prompts in sessions.items()} == {
+        "a": 2,
+        "b": 2,
+    }
+    assert responses[1]["answer"]["spd"] == "Antwort b"
+    assert responses[2]["answer"]["spd"] == "Antwort a"
+
+
+class FlakyStreamLLM:
+    """Fake chat model whose stream breaks after the first token for CDU prompts."""
+
+    def __init__(self):
+        self.invoked = []
+
+    def stream(self, prompt):
+        yield AIMessageChunk(content="Teil ")
+        if "cdu Position" in prompt:
+            raise RuntimeError("connection reset")
+        yield AIMessageChunk(content="Antwort")
+
+    def invoke(self, prompt):
+        self.invoked.append(prompt)
+        return AIMessage(content="Neu")
+
+
+class ConcurrencyLLM:
+    """Fake chat model that fails the first request of each prompt and records its peak concurrency."""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.peak = 0
+        self.seen = set()
+
+    def invoke(self, prompt):
+        with self.lock:
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+            first = prompt not in self.seen
+            self.seen.add(prompt)
+        try:
+            time.sleep(self.delay)
+            if first:
+                raise RuntimeError("server error")
+            return AIMessage(content=prompt)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+def test_stream_keeps_answers_of_other_parties_after_an_error(tmp_path):
+    llm = FlakyStreamLLM()
+    rag = make_rag(tmp_path, llm=llm, cache=ResponseCache())
+
+    events = list(rag.stream_query("Klima?"))
+    assert [(t, p) for t, p, _ in events if t == "error"] == [("error", "cdu")]
+    response = events[-1][2]
+    assert response["answer"] == {"spd": "Teil Antwort", "cdu": "Neu"}
+    # Only the failed party is generated again, and both answers are cached
+    assert len(llm.invoked) == 1 and "cdu Position" in llm.invoked[0]
+    cached = rag.cache.get("Klima?", ["spd", "cdu"], rag.cache_settings())
+    assert {party: r["answer"] for party, r in cached.items()} == response["answer"]
+
+
+def test_retries_and_hedges_respect_max_concurrency(tmp_path):
+    llm = ConcurrencyLLM()
+    latency_tracker = LatencyTracker(min_samples=1)
+    latency_tracker.record(0.01)
+    rag = make_rag(
+        tmp_path,
+        llm=llm,
+        max_retries=1,
+        hedge_percentile=50,
+        latency_tracker=latency_tracker,
+    )
+    prompts = {party: f"Prompt {party}" for party in ["a", "b", "c", "d", "e"]}
+    answers = rag.generate_answers(prompts, max_concurrency=2)
+    assert answers == prompts
+    assert rag.query_stats["llm_retries"] > 0
+    assert rag.query_stats["hedged_requests"] > 0
+    assert llm.peak <= 2
+
+
+def test_single_keyword_cache_miss_is_not_embedded(tmp_path):
+    embeddings = CountingEmbeddings(size=16)
+    rag = make_rag(
+        tmp_path,
+        embeddings=embeddings,
+        cache=ResponseCache(similarity_threshold=0.9),
+    )
+    for db in rag.databases:
+        db.build_lexical_index()
+    rag.query("Was sagen die Parteien zur Rente?")
+    embeddings_calls = embeddings.calls
+
+    # Every chunk mentions Europa, so BM25 finds k documents for each party
+    response = rag.query("Europa")
+    assert set(response["answer"]) == {"spd", "cdu"}
+    assert embeddings.calls == embeddings_calls
+
+
+def test_combined_answers_keep_the_combined_prompt(tmp_path):
+    llm = FakeListChatModel(responses=['{"PARTEI_1": "Kombiniert"}', "Einzeln"])
+    rag = make_rag(tmp_path, llm=llm, generation_mode="combined")
+
+    response = rag.query("Klima?")
+    assert response["answer"] == {"spd": "Kombiniert", "cdu": "Einzeln"}
+    # The party that fell back to its own completion keeps its own prompt
+    assert "PARTEI_2" in response["prompt"]["spd"]
+    assert "PARTEI_2" not in response["prompt"]["cdu"]
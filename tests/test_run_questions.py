@@ -0,0 +1,112 @@
+import json
+
+from RAG.scripts.run_questions import (
+    CheckpointWriter,
+    read_checkpoint,
+    read_questions,
+    run,
+)
+
+
+class FakeEngine:
+    """Answers batches of questions like RAG.query_many, failing every batch with "fail"."""
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, questions):
+        self.batches.append(questions)
+        if "fail" in questions:
+            raise RuntimeError("LLM error")
+        responses = [
+            {"question": question, "docs": {}, "answer": {"spd": "Antwort"}}
+            for question in questions
+        ]
+        return responses, {"embedding_calls": 1}
+
+
+def write_questions(path, questions):
+    path.write_text("id,question\n" + "".join(f"{i},{q}\n" for i, q in questions))
+
+
+def run_questions(questions_path, output_path, engine=None, batch_size=2):
+    done = read_checkpoint(str(output_path))
+    questions = (
+        (row_number, question)
+        for row_number, question in read_questions(str(questions_path))
+        if row_number not in done
+    )
+    writer = CheckpointWriter(str(output_path))
+    try:
+        return run(questions, engine or FakeEngine(), writer, 2, batch_size)
+    finally:
+        writer.close()
+
+
+def read_records(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_read_questions_skips_empty_rows(tmp_path):
+    path = tmp_path / "questions.csv"
+    write_questions(path, [(1, "Klima?"), (2, " "), (3, " Rente? ")])
+    assert list(read_questions(str(path))) == [(0, "Klima?"), (2, "Rente?")]
+    ids = read_questions(str(path), column="id")
+    assert list(ids) == [(0, "1"), (1, "2"), (2, "3")]
+
+
+def test_resume_answers_only_missing_and_failed_rows(tmp_path):
+    questions_path = tmp_path / "questions.csv"
+    output_path = tmp_path / "results" / "answers.jsonl"
+    write_questions(questions_path, [(i, f"Frage {i}?") for i in range(5)])
+
+    # An interrupted run: two answered rows, one failed row and an incomplete line
+    records = [
+        {"row": 0, "question": "Frage 0?", "response": {}},
+        {"row": 1, "question": "Frage 1?", "response": {}},
+        {"row": 2, "question": "Frage 2?", "error": "LLM error"},
+    ]
+    output_path.parent.mkdir()
+    output_path.write_text(
+        "".join(json.dumps(record) + "\n" for record in records) + '{"row": 3, "qu'
+    )
+    assert read_checkpoint(str(output_path)) == {0, 1}
+
+    answered, errors, latencies = run_questions(questions_path, output_path)
+    assert (answered, errors, len(latencies)) == (3, 0, 3)
+    # The incomplete line is terminated, so the new records are on lines of their own
+    lines = output_path.read_text().splitlines()
+    assert lines[3] == '{"row": 3, "qu'
+    assert sorted(json.loads(line)["row"] for line in lines[4:]) == [2, 3, 4]
+    assert read_checkpoint(str(output_path)) == {0, 1, 2, 3, 4}
+
+    # Nothing is left to answer
+    assert run_questions(questions_path, output_path) == (0, 0, [])
+
+
+def test_failed_questions_are_recorded(tmp_path):
+    questions_path = tmp_path / "questions.csv"
+    output_path = tmp_path / "answers.jsonl"
+    write_questions(questions_path, [(0, "Klima?"), (1, "fail")])
+
+    engine = FakeEngine()
+    assert run_questions(questions_path, output_path, engine)[:2] == (1, 1)
+    # The failed batch is answered again question by question
+    assert engine.batches == [["Klima?", "fail"], ["Klima?"], ["fail"]]
+    records = {r["row"]: r for r in read_records(output_path)}
+    assert records[1] == {"row": 1, "question": "fail", "error": "LLM error"}
+    assert records[0]["response"]["answer"] == {"spd": "Antwort"}
+    assert read_checkpoint(str(output_path)) == {0}
+
+
+def test_questions_are_answered_in_batches(tmp_path):
+    questions_path = tmp_path / "questions.csv"
+    output_path = tmp_path / "answers.jsonl"
+    write_questions(questions_path, [(i, f"Frage {i}?") for i in range(5)])
+
+    engine = FakeEngine()
+    answered, errors, _ = run_questions(questions_path, output_path, engine)
+    assert (answered, errors) == (5, 0)
+    assert sorted(len(batch) for batch in engine.batches) == [1, 2, 2]
+    records = read_records(output_path)
+    assert all(r["query_stats"] == {"embedding_calls": 1} for r in records)
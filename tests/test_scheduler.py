@@ -0,0 +1,95 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from langchain_community.chat_models.fake import FakeListChatModel
+
+from RAG.models.scheduler import LLMScheduler
+
+
+class GatedLLM:
+    """Fake chat model that records the prompts and answers once the gate is open."""
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.prompts = []
+
+    async def ainvoke(self, prompt):
+        self.prompts.append(prompt)
+        while not self.gate.is_set():
+            await asyncio.sleep(0.01)
+        return prompt.upper()
+
+
+class RateLimitedLLM:
+    """Fake chat model that fails with a rate limit error on its first call."""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def ainvoke(self, prompt):
+        self.calls += 1
+        if self.calls == 1:
+            error = RuntimeError("rate limit")
+            error.status_code = 429
+            error.response = SimpleNamespace(headers={"retry-after-ms": "50"})
+            raise error
+        return prompt
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = LLMScheduler(max_concurrency=1)
+    yield scheduler
+    scheduler.close()
+
+
+def test_cancelled_queued_request_frees_the_scheduler(scheduler):
+    llm = GatedLLM()
+    first = scheduler.submit(llm, "first", "session")
+    wait_until(lambda: llm.prompts == ["first"])
+    queued = scheduler.submit(llm, "queued", "session")
+    wait_until(lambda: scheduler.stats["queued"] == 1)
+
+    queued.cancel()
+    wait_until(lambda: scheduler.stats["queued"] == 0)
+    llm.gate.set()
+    assert first.result(timeout=5) == "FIRST"
+
+    answer = scheduler.submit(FakeListChatModel(responses=["ok"]), "next")
+    assert answer.result(timeout=5).content == "ok"
+    assert llm.prompts == ["first"]
+    assert scheduler.stats["in_flight"] == 0
+
+
+def test_sessions_are_admitted_round_robin(scheduler):
+    llm = GatedLLM()
+    futures = [scheduler.submit(llm, "blocking", "other")]
+    wait_until(lambda: llm.prompts == ["blocking"])
+    for prompt, session_id in [("a1", "a"), ("a2", "a"), ("a3", "a"), ("b1", "b")]:
+        futures.append(scheduler.submit(llm, prompt, session_id))
+    wait_until(lambda: scheduler.stats["queued"] == 4)
+
+    llm.gate.set()
+    for future in futures:
+        future.result(timeout=5)
+    assert llm.prompts == ["blocking", "a1", "b1", "a2", "a3"]
+
+
+def test_rate_limit_error_is_retried(scheduler):
+    llm = RateLimitedLLM()
+    start = time.monotonic()
+    assert scheduler.invoke(llm, "prompt") == "prompt"
+    assert time.monotonic() - start >= 0.05
+    assert llm.calls == 2
+    assert scheduler.stats["rate_limit_errors"] == 1
+    assert scheduler.stats["in_flight"] == 0
@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from RAG.service.server import RAGService
+
+
+class StubRAG:
+    """Stand-in for the RAG engine that fails for the question "fail" and records its calls."""
+
+    cache = None
+    scheduler = None
+    language = "Deutsch"
+    parties = ["spd"]
+    session_id = None
+
+    def __init__(self):
+        self.query_stats = {}
+        self.calls = []
+
+    def query(self, question):
+        self.calls.append(("query", question, self.session_id))
+        if question == "fail":
+            raise RuntimeError("LLM error")
+        return {"question": question}
+
+    def query_many(self, questions, session_ids=None):
+        self.calls.append(("query_many", questions, session_ids))
+        if "fail" in questions:
+            raise RuntimeError("LLM error")
+        return [{"question": question} for question in questions]
+
+
+async def query_all(rag, requests):
+    service = RAGService(rag, workers=2, batch_window=0.05)
+    await service.start()
+    try:
+        return await asyncio.gather(
+            *[service.query(question, session_id=s) for question, s in requests],
+            return_exceptions=True,
+        )
+    finally:
+        await service.stop()
+
+
+def test_batch_keeps_the_session_of_each_request():
+    rag = StubRAG()
+    results = asyncio.run(query_all(rag, [("Klima?", "a"), ("Rente?", "b")]))
+    assert [response["question"] for response, _ in results] == ["Klima?", "Rente?"]
+    assert rag.calls == [("query_many", ["Klima?", "Rente?"], ["a", "b"])]
+
+
+def test_failing_request_does_not_fail_the_batch():
+    rag = StubRAG()
+    results = asyncio.run(query_all(rag, [("Klima?", "a"), ("fail", "b")]))
+    assert results[0][0] == {"question": "Klima?"}
+    with pytest.raises(RuntimeError, match="LLM error"):
+        raise results[1]
+    # The requests are answered one by one under their own sessions
+    assert ("query", "Klima?", "a") in rag.calls
+    assert ("query", "fail", "b") in rag.calls
@@ -0,0 +1,94 @@
+import threading
+import time
+
+from RAG.models.single_flight import SingleFlight
+from tests.fakes import make_rag
+
+
+def run_followers(single_flight, key, n, results):
+    def follow():
+        try:
+            results.append(single_flight.do(key, lambda: "own result"))
+        except Exception as e:
+            results.append(e)
+
+    threads = [threading.Thread(target=follow) for _ in range(n)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def wait_for_followers(single_flight, n):
+    while single_flight.coalesced < n:
+        time.sleep(0.001)
+
+
+def test_followers_share_a_copy_of_the_result():
+    single_flight = SingleFlight()
+    call, leader = single_flight.join("key")
+    assert leader
+    results = []
+    threads = run_followers(single_flight, "key", 3, results)
+    wait_for_followers(single_flight, 3)
+
+    result = {"answer": ["a"]}
+    single_flight.finish("key", call, result=result)
+    for thread in threads:
+        thread.join()
+
+    assert results == [({"answer": ["a"]}, False)] * 3
+    results[0][0]["answer"].append("b")
+    assert results[1][0] == {"answer": ["a"]}
+    assert single_flight.in_flight == 0
+
+
+def test_errors_are_passed_to_followers_as_exceptions():
+    single_flight = SingleFlight()
+    call, _ = single_flight.join("key")
+    results = []
+    threads = run_followers(single_flight, "key", 2, results)
+    wait_for_followers(single_flight, 2)
+
+    single_flight.finish("key", call, error=KeyboardInterrupt())
+    for thread in threads:
+        thread.join()
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_closed_stream_releases_followers_with_an_exception(tmp_path):
+    rag = make_rag(tmp_path, single_flight=SingleFlight())
+    stream = rag.stream_query("Was ist Klimaschutz?")
+    next(stream)
+
+    results = []
+
+    def follow():
+        try:
+            results.append(list(rag.stream_query("was ist klimaschutz")))
+        except Exception as e:
+            results.append(e)
+
+    follower = threading.Thread(target=follow)
+    follower.start()
+    wait_for_followers(rag.single_flight, 1)
+    stream.close()
+    follower.join()
+
+    assert isinstance(results[0], RuntimeError)
+    assert rag.single_flight.in_flight == 0
+
+
+def test_concurrent_queries_are_coalesced(tmp_path):
+    rag = make_rag(tmp_path, single_flight=SingleFlight())
+    responses = []
+    threads = [
+        threading.Thread(target=lambda: responses.append(rag.query("Rente?")))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(responses) == 5
+    assert len({str(response["answer"]) for response in responses}) == 1
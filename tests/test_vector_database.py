@@ -0,0 +1,178 @@
+import os
+
+import pytest
+from langchain_core.documents import Document
+
+from RAG.database import vector_database
+from RAG.database.vector_database import (
+    VectorDatabase,
+    chunk_ids,
+    load_pdf_files_splits,
+    load_pdf_splits,
+    page_of_offset,
+    page_offsets,
+    split_pdf,
+)
+from tests.fakes import CountingEmbeddings
+
+# Three pages as PDFMiner returns them, every page ends with a form feed
+PAGES = ["Seite eins. " * 20, "Seite zwei. " * 20, "Seite drei. " * 20]
+TEXT = "".join(page + "\x0c" for page in PAGES)
+
+
+class FakePDFMinerLoader:
+    """Stand-in for PDFMinerLoader that returns the same text for every file."""
+
+    loads = 0
+
+    def __init__(self, path, concatenate_pages=True):
+        self.path = path
+
+    def load(self):
+        FakePDFMinerLoader.loads += 1
+        return [Document(page_content=TEXT, metadata={"source": self.path})]
+
+
+class NamedPDFMinerLoader(FakePDFMinerLoader):
+    """Fake loader that writes the file name into the text of every page."""
+
+    def load(self):
+        text = TEXT.replace("Seite", os.path.basename(self.path))
+        return [Document(page_content=text, metadata={"source": self.path})]
+
+
+class TextPDFMinerLoader(FakePDFMinerLoader):
+    """Fake loader that reads the "PDF" as a text file."""
+
+    def load(self):
+        with open(self.path, "r") as file:
+            return [Document(page_content=file.read(), metadata={"source": self.path})]
+
+
+@pytest.fixture
+def fake_pdfs(monkeypatch):
+    FakePDFMinerLoader.loads = 0
+    monkeypatch.setattr(vector_database, "PDFMinerLoader", FakePDFMinerLoader)
+
+
+def test_page_offsets():
+    offsets = page_offsets(TEXT)
+    assert offsets == [0, 241, 482, 723]
+    assert page_of_offset(offsets, 0) == 0
+    assert page_of_offset(offsets, 240) == 0
+    assert page_of_offset(offsets, 241) == 1
+    assert page_of_offset(offsets, 500) == 2
+    assert page_offsets("kein Seitenumbruch") == [0]
+
+
+def test_splits_get_the_page_they_start_on():
+    splits = split_pdf([Document(page_content=TEXT)], chunk_size=100, chunk_overlap=20)
+    offsets = page_offsets(TEXT)
+    position = 0
+    for split in splits:
+        start = TEXT.find(split.page_content, position)
+        position = start
+        assert split.metadata["page"] == page_of_offset(offsets, start)
+        assert "start_index" not in split.metadata
+    assert {split.metadata["page"] for split in splits} == {0, 1, 2}
+
+
+def test_load_pdf_splits_parses_the_pdf_once(fake_pdfs):
+    splits = load_pdf_splits("data/spd_wahlprogramm.pdf", 100, 20)
+    assert FakePDFMinerLoader.loads == 1
+    assert all(split.metadata["party"] == "spd" for split in splits)
+    assert splits[0].metadata["page"] == 0
+    assert splits[-1].metadata["page"] == 2
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_parallel_ingestion_keeps_the_file_order(workers, monkeypatch):
+    monkeypatch.setattr(vector_database, "PDFMinerLoader", NamedPDFMinerLoader)
+    pdf_paths = [f"data/{party}_wahlprogramm.pdf" for party in ["spd", "cdu", "afd"]]
+    splits = load_pdf_files_splits(pdf_paths, 100, 20, workers=workers)
+
+    parties = [split.metadata["party"] for split in splits]
+    assert parties == sorted(parties, key=["spd", "cdu", "afd"].index)
+    assert splits == load_pdf_files_splits(pdf_paths, 100, 20, workers=1)
+    assert all(
+        f"{split.metadata['party']}_wahlprogramm" in split.page_content
+        for split in splits
+    )
+
+
+def test_chunk_ids_are_content_based():
+    splits = [
+        Document(page_content="a", metadata={"source": "data/spd.pdf"}),
+        Document(page_content="a", metadata={"source": "data/spd.pdf"}),
+        Document(page_content="a", metadata={"source": "other/cdu.pdf"}),
+    ]
+    ids = chunk_ids(splits)
+    assert len(set(ids)) == 3
+    # Only the file name counts, not the directory
+    moved = [
+        Document(page_content=s.page_content, metadata={"source": f"new/{name}"})
+        for s, name in zip(splits, ["spd.pdf", "spd.pdf", "cdu.pdf"])
+    ]
+    assert chunk_ids(moved) == ids
+
+
+def write_pdf(directory, name, topics):
+    text = "".join(f"{topic} ist uns wichtig. " * 8 + "\x0c" for topic in topics)
+    with open(os.path.join(directory, name), "w") as file:
+        file.write(text)
+
+
+def test_incremental_update(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_database, "PDFMinerLoader", TextPDFMinerLoader)
+    data_path = tmp_path / "pdfs"
+    data_path.mkdir()
+    write_pdf(data_path, "spd_wahlprogramm.pdf", ["Rente", "Klima"])
+    write_pdf(data_path, "cdu_wahlprogramm.pdf", ["Steuern"])
+    embeddings = CountingEmbeddings(size=16)
+    db = VectorDatabase(
+        embeddings,
+        "manifestos",
+        data_path=str(data_path),
+        database_directory=str(tmp_path / "chroma"),
+        chunk_size=100,
+        chunk_overlap=20,
+        reload=False,
+    )
+
+    # A dry run reports the changes without creating the database
+    report = db.update_database(dry_run=True, workers=1)
+    assert report["sources"] == {
+        "cdu_wahlprogramm.pdf": "new",
+        "spd_wahlprogramm.pdf": "new",
+    }
+    assert not (tmp_path / "chroma").exists()
+    assert embeddings.texts == 0
+
+    report = db.update_database(workers=1)
+    n_chunks = report["embed"]
+    assert embeddings.texts == n_chunks > 0
+    report = db.update_database(workers=1)
+    assert report["embed"] == report["delete"] == report["update"] == 0
+    assert embeddings.texts == n_chunks
+
+    # Only the chunks of the new page are embedded
+    write_pdf(data_path, "spd_wahlprogramm.pdf", ["Rente", "Klima", "Europa"])
+    report = db.update_database(workers=1)
+    assert report["sources"]["spd_wahlprogramm.pdf"] == "changed"
+    assert 0 < report["embed"] < n_chunks
+    assert embeddings.texts == n_chunks + report["embed"]
+
+    # A renamed file reuses the stored embeddings
+    texts = embeddings.texts
+    os.rename(data_path / "cdu_wahlprogramm.pdf", data_path / "cdu_programm_2025.pdf")
+    report = db.update_database(workers=1)
+    assert report["sources"]["cdu_wahlprogramm.pdf"] == "removed"
+    assert report["embed"] == 0 and report["reuse"] == report["delete"] > 0
+    assert embeddings.texts == texts
+
+    splits = load_pdf_files_splits(
+        sorted(str(path) for path in data_path.iterdir()), 100, 20, workers=1
+    )
+    stored = db.database._collection.get(include=["metadatas"])
+    assert set(stored["ids"]) == set(chunk_ids(splits))
+    assert {metadata["party"] for metadata in stored["metadatas"]} == {"spd", "cdu"}